@@ -1,9 +1,84 @@
+import logging
+import threading
 import urllib.parse
+from typing import Dict, Set
 
-from sqlalchemy import create_engine
+from sqlalchemy import Engine, create_engine
 from sqlalchemy.orm import Session, sessionmaker
 
-from . import model
+from . import model, upgrade
+
+logger = logging.getLogger(__name__)
+
+# engines are cached per url, so that sessions share the connection pool
+_engines: Dict[str, Engine] = {}
+# urls of the engines whose bookkeeping tables are up to date
+_bootstrapped: Set[str] = set()
+_lock = threading.Lock()
+
+
+def get_engine(
+    host: str,
+    port: int,
+    user: str,
+    password: str,
+    schema: str,
+    echo: bool = False,
+    local_infile: bool = False,
+) -> Engine:
+    """
+    local_infile enables LOAD DATA LOCAL INFILE on the client side
+    """
+    encoded_password = urllib.parse.quote_plus(password)
+    url = f"mysql+mysqldb://{user}:{encoded_password}@{host}:{port}/{schema}"
+    key = f"{url}?echo={bool(echo)}&local_infile={bool(local_infile)}"
+    with _lock:
+        if key not in _engines:
+            _engines[key] = create_engine(
+                url,
+                echo=echo,
+                pool_pre_ping=True,
+                connect_args={"local_infile": 1} if local_infile else {},
+            )
+        return _engines[key]
+
+
+def bootstrap(engine: Engine) -> None:
+    """
+    Create or upgrade the bookkeeping tables once per engine.
+    The upgrade only happens when the recorded bookkeeping version changes.
+    """
+    key = _engine_key(engine)
+    if key in _bootstrapped:
+        return
+    with _lock:
+        if key in _bootstrapped:
+            return
+        with engine.connect() as conn:
+            version = upgrade.read_bookkeeping_version(conn)
+        if version is None or version < model.BOOKKEEPING_VERSION:
+            with engine.begin() as conn:
+                upgrade.upgrade(conn, version)
+        elif version > model.BOOKKEEPING_VERSION:
+            logger.warning(
+                "Bookkeeping tables are newer than sdm, version=%d, expected=%d",
+                version,
+                model.BOOKKEEPING_VERSION,
+            )
+        _bootstrapped.add(key)
+
+
+def forget_bootstrap(engine: Engine) -> None:
+    """
+    Should be called after the bookkeeping tables are dropped,
+    so that the next session recreates them.
+    """
+    with _lock:
+        _bootstrapped.discard(_engine_key(engine))
+
+
+def _engine_key(engine: Engine) -> str:
+    return engine.url.render_as_string(hide_password=False)
 
 
 def make_session(
@@ -14,14 +89,12 @@ def make_session(
     schema: str,
     echo: bool = False,
     create_all_tables: bool = True,
+    local_infile: bool = False,
 ) -> Session:
-    encoded_password = urllib.parse.quote_plus(password)
-    engine = create_engine(
-        f"mysql+mysqldb://{user}:{encoded_password}@{host}:{port}/{schema}",
-        echo=echo,
-        pool_pre_ping=True,
+    engine = get_engine(
+        host, port, user, password, schema, echo=echo, local_infile=local_infile
     )
     if create_all_tables:
-        model.Base.metadata.create_all(engine)
+        bootstrap(engine)
     Session = sessionmaker(bind=engine)
     return Session()
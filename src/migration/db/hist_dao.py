@@ -1,13 +1,19 @@
+import datetime
+import hashlib
 import json
+import zlib
 from enum import StrEnum
-from typing import List, Optional
+from typing import Dict, List, Optional, Set, Tuple
 
-from sqlalchemy import select
+from sqlalchemy import delete, event, func, insert, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
 from sqlalchemy.orm import Session
 
 from migration import migration_plan as mp
+from migration.env import cli_env
 
 from . import model
+from .lock import MigrationLock
 
 
 class Operation(StrEnum):
@@ -16,20 +22,82 @@ class Operation(StrEnum):
     UPDATE_SUCC = "update_succ"
     UPDATE_ROLLBACK = "update_rollback"
     UPDATE_PROCESSING = "update_processing"  # only for repeatable migration
+    PROGRESS = "progress"  # progress of a long running migration
 
 
+# Writers are serialized by the migration lock (see db/lock.py),
+#   so reading the histories doesn't lock any rows.
 VERSIONED_TYPE_CRITERION = (model.MigrationHistory.type == mp.Type.DATA) | (
     model.MigrationHistory.type == mp.Type.SCHEMA
 )
+# the versioned histories in completion order, the unfinished ones last
+VERSIONED_ORDER = (
+    model.MigrationHistory.applied_seq.is_(None),
+    model.MigrationHistory.applied_seq.asc(),
+    model.MigrationHistory.id.asc(),
+)
+
+
+def next_applied_seq():
+    """
+    The next completion sequence, evaluated by the UPDATE statement itself.
+    The aggregation materializes the derived table, so that mysql allows
+    reading the updated table.
+    """
+    hist = model.MigrationHistory.__table__.alias("h")
+    seq = select(
+        (func.coalesce(func.max(hist.c.applied_seq), 0) + 1).label("seq")
+    ).subquery("s")
+    return select(seq.c.seq).scalar_subquery()
 
 
 class MigrationHistoryDAO:
-    def __init__(self, session: Session) -> None:
+    """
+    In batched mode the DAO issues the fewest statements:
+    - histories are inserted by core statements, ids come from lastrowid
+    - histories are updated/deleted by a single statement guarded by the
+        expected state and checksum, the rowcount is checked instead of
+        SELECT FOR UPDATE
+    - logs are buffered and inserted by one multi-row INSERT on commit
+
+    Unless DEDUP_HISTORY_SNAPSHOT is disabled, the logs reference the
+    snapshots stored once in MigrationHistorySnapshot, new snapshots are
+    buffered and inserted by one multi-row INSERT IGNORE on commit.
+    """
+
+    def __init__(
+        self,
+        session: Session,
+        batched: bool = False,
+        lock: Optional[MigrationLock] = None,
+    ) -> None:
         self.session = session
+        self.batched = batched
+        # if set, the lock is checked before committing
+        self.lock = lock
+        # (ver, name) -> id of the histories written by this DAO
+        self._hist_ids: Dict[Tuple[str, str], int] = {}
+        self._pending_logs: List[Dict] = []
+        # ids of the snapshots known to be stored
+        self._snapshot_ids: Set[str] = set()
+        self._pending_snapshots: Dict[str, Dict] = {}
+        # (count, chain checksum) of the versioned head, written on commit
+        self._pending_head: Optional[Tuple[int, str]] = None
+        event.listen(self.session, "after_rollback", self._discard_pending)
+
+    def _discard_pending(self, session: Session) -> None:
+        self._hist_ids.clear()
+        self._pending_logs.clear()
+        self._snapshot_ids.clear()
+        self._pending_snapshots.clear()
+        self._pending_head = None
 
     def add_one(
         self, plan: mp.MigrationPlan, operator: str = "", fake: bool = False
     ) -> None:
+        if self.batched:
+            self._add_one_batched(plan, operator=operator, fake=fake)
+            return
         # add migration history
         hist = model.MigrationHistory(
             ver=plan.version,
@@ -45,7 +113,7 @@ class MigrationHistoryDAO:
             hist_id=hist.id,
             operation=Operation.CREATE,
             operator=operator,
-            snapshot=self._gen_snapshot_log(plan, fake),
+            **self._gen_snapshot_columns(plan, fake),
         )
         self.session.add(log)
 
@@ -61,7 +129,12 @@ class MigrationHistoryDAO:
         )
 
     def update_succ(
-        self, plan: mp.MigrationPlan, operator: str = "", fake: bool = False
+        self,
+        plan: mp.MigrationPlan,
+        operator: str = "",
+        fake: bool = False,
+        from_state: Optional[model.MigrationState] = None,
+        chain_checksum: Optional[str] = None,
     ) -> None:
         self._update(
             plan,
@@ -69,10 +142,16 @@ class MigrationHistoryDAO:
             Operation.UPDATE_SUCC,
             operator=operator,
             fake=fake,
+            from_state=from_state,
+            chain_checksum=chain_checksum,
         )
 
     def update_rollback(
-        self, plan: mp.MigrationPlan, operator: str = "", fake: bool = False
+        self,
+        plan: mp.MigrationPlan,
+        operator: str = "",
+        fake: bool = False,
+        from_state: Optional[model.MigrationState] = None,
     ) -> None:
         self._update(
             plan,
@@ -80,6 +159,7 @@ class MigrationHistoryDAO:
             Operation.UPDATE_ROLLBACK,
             operator=operator,
             fake=fake,
+            from_state=from_state,
         )
 
     def _gen_snapshot_log(self, plan: mp.MigrationPlan, fake: bool) -> str:
@@ -88,6 +168,73 @@ class MigrationHistoryDAO:
             plan_for_log.update({"fake": fake})
         return json.dumps(plan_for_log)
 
+    def _encode_snapshot(self, snapshot: str) -> Dict:
+        if cli_env.COMPRESS_HISTORY_LOG:
+            return {"snapshot": "", "snapshot_z": zlib.compress(snapshot.encode())}
+        return {"snapshot": snapshot, "snapshot_z": None}
+
+    def _gen_snapshot_columns(self, plan: mp.MigrationPlan, fake: bool) -> Dict:
+        snapshot = self._gen_snapshot_log(plan, fake)
+        if not cli_env.DEDUP_HISTORY_SNAPSHOT:
+            return {**self._encode_snapshot(snapshot), "snapshot_id": None}
+        return {
+            "snapshot": "",
+            "snapshot_z": None,
+            "snapshot_id": self._add_snapshot(snapshot),
+        }
+
+    def _add_snapshot(self, snapshot: str) -> str:
+        snapshot_id = hashlib.sha1(snapshot.encode()).hexdigest()
+        if (
+            snapshot_id not in self._snapshot_ids
+            and snapshot_id not in self._pending_snapshots
+        ):
+            self._pending_snapshots[snapshot_id] = {
+                "id": snapshot_id,
+                **self._encode_snapshot(snapshot),
+                "created": datetime.datetime.utcnow(),
+            }
+        return snapshot_id
+
+    def flush_snapshots(self) -> None:
+        if len(self._pending_snapshots) == 0:
+            return
+        # the snapshot may have been stored by another log
+        self.session.execute(
+            insert(model.MigrationHistorySnapshot)
+            .prefix_with("IGNORE")
+            .values(list(self._pending_snapshots.values()))
+        )
+        self._snapshot_ids.update(self._pending_snapshots.keys())
+        self._pending_snapshots = {}
+
+    def add_progress_log(
+        self, plan: mp.MigrationPlan, progress: Dict, operator: str = ""
+    ) -> None:
+        """
+        The progress is stored as the snapshot of the log, it's not deduplicated
+        """
+        self.session.execute(
+            insert(model.MigrationHistoryLog).values(
+                hist_id=self._get_hist_id(plan),
+                operation=Operation.PROGRESS,
+                operator=operator,
+                snapshot_id=None,
+                created=datetime.datetime.utcnow(),
+                **self._encode_snapshot(json.dumps(progress)),
+            )
+        )
+
+    def get_log_snapshot(self, log: model.MigrationHistoryLogMixin) -> str:
+        if log.snapshot_id is None:
+            return log.get_snapshot()
+        snapshot = self.session.get(model.MigrationHistorySnapshot, log.snapshot_id)
+        if snapshot is None:
+            raise Exception(
+                f"Missing migration history snapshot, snapshot_id={log.snapshot_id}"
+            )
+        return snapshot.get_snapshot()
+
     def _update(
         self,
         plan: mp.MigrationPlan,
@@ -95,7 +242,20 @@ class MigrationHistoryDAO:
         operation: Operation,
         operator: str = "",
         fake: bool = False,
+        from_state: Optional[model.MigrationState] = None,
+        chain_checksum: Optional[str] = None,
     ) -> None:
+        if self.batched:
+            self._update_batched(
+                plan,
+                state,
+                operation,
+                operator=operator,
+                fake=fake,
+                from_state=from_state,
+                chain_checksum=chain_checksum,
+            )
+            return
         # update migration history
         stmt = (
             select(model.MigrationHistory)
@@ -106,20 +266,33 @@ class MigrationHistoryDAO:
             .with_for_update()
         )
         hist: model.MigrationHistory = self.session.scalars(stmt).one()
+        self._check_state(plan, hist.state, from_state)
         hist.state = state
         hist.checksum = plan.get_checksum()
+        hist.chain_checksum = chain_checksum
+        if self._is_applied(plan, state):
+            hist.applied_seq = next_applied_seq()
         # add log
         log = model.MigrationHistoryLog(
             hist_id=hist.id,
             operation=operation,
             operator=operator,
-            snapshot=self._gen_snapshot_log(plan, fake),
+            **self._gen_snapshot_columns(plan, fake),
         )
         self.session.add(log)
 
     def delete(
-        self, plan: mp.MigrationPlan, operator: str = "", fake: bool = False
+        self,
+        plan: mp.MigrationPlan,
+        operator: str = "",
+        fake: bool = False,
+        from_state: Optional[model.MigrationState] = None,
     ) -> None:
+        if self.batched:
+            self._delete_batched(
+                plan, operator=operator, fake=fake, from_state=from_state
+            )
+            return
         # delete migration history
         stmt = (
             select(model.MigrationHistory)
@@ -130,21 +303,184 @@ class MigrationHistoryDAO:
             .with_for_update()
         )
         hist = self.session.scalars(stmt).one()
+        self._check_state(plan, hist.state, from_state)
         self.session.delete(hist)
+        self.session.execute(
+            delete(model.MigrationHistoryProgress).where(
+                model.MigrationHistoryProgress.hist_id == hist.id
+            )
+        )
         # add log
         log = model.MigrationHistoryLog(
             hist_id=hist.id,
             operation=Operation.DELETE,
             operator=operator,
-            snapshot=self._gen_snapshot_log(plan, fake),
+            **self._gen_snapshot_columns(plan, fake),
         )
         self.session.add(log)
 
+    def _is_applied(self, plan: mp.MigrationPlan, state: model.MigrationState) -> bool:
+        return (
+            state == model.MigrationState.SUCCESSFUL and plan.type != mp.Type.REPEATABLE
+        )
+
+    def _check_state(
+        self,
+        plan: mp.MigrationPlan,
+        state: model.MigrationState,
+        from_state: Optional[model.MigrationState],
+    ) -> None:
+        if from_state is not None and state != from_state:
+            raise Exception(
+                "Unexpected migration history state,"
+                f" version={plan.version}, name={plan.name}, state={state}"
+            )
+
+    def _add_one_batched(
+        self, plan: mp.MigrationPlan, operator: str = "", fake: bool = False
+    ) -> None:
+        now = datetime.datetime.utcnow()
+        result = self.session.execute(
+            insert(model.MigrationHistory).values(
+                ver=plan.version,
+                name=plan.name,
+                state=model.MigrationState.PROCESSING,
+                type=plan.type,
+                checksum=plan.get_checksum(),
+                created=now,
+                updated=now,
+            )
+        )
+        hist_id = result.inserted_primary_key[0]
+        self._hist_ids[(plan.version, plan.name)] = hist_id
+        self._add_pending_log(hist_id, plan, Operation.CREATE, operator, fake)
+
+    def _update_batched(
+        self,
+        plan: mp.MigrationPlan,
+        state: model.MigrationState,
+        operation: Operation,
+        operator: str = "",
+        fake: bool = False,
+        from_state: Optional[model.MigrationState] = None,
+        chain_checksum: Optional[str] = None,
+    ) -> None:
+        criteria = self._guard_criteria(plan, from_state)
+        values = {
+            "state": state,
+            "checksum": plan.get_checksum(),
+            "chain_checksum": chain_checksum,
+        }
+        if self._is_applied(plan, state):
+            values["applied_seq"] = next_applied_seq()
+        result = self.session.execute(
+            update(model.MigrationHistory).where(*criteria).values(**values)
+        )
+        self._check_rowcount(plan, result.rowcount, from_state)
+        hist_id = self._get_hist_id(plan)
+        self._add_pending_log(hist_id, plan, operation, operator, fake)
+
+    def _delete_batched(
+        self,
+        plan: mp.MigrationPlan,
+        operator: str = "",
+        fake: bool = False,
+        from_state: Optional[model.MigrationState] = None,
+    ) -> None:
+        hist_id = self._get_hist_id(plan)
+        criteria = self._guard_criteria(plan, from_state)
+        result = self.session.execute(delete(model.MigrationHistory).where(*criteria))
+        self._check_rowcount(plan, result.rowcount, from_state)
+        self.session.execute(
+            delete(model.MigrationHistoryProgress).where(
+                model.MigrationHistoryProgress.hist_id == hist_id
+            )
+        )
+        self._hist_ids.pop((plan.version, plan.name), None)
+        self._add_pending_log(hist_id, plan, Operation.DELETE, operator, fake)
+
+    def _sig_criteria(self, plan: mp.MigrationPlan) -> List:
+        return [
+            model.MigrationHistory.ver == plan.version,
+            model.MigrationHistory.name == plan.name,
+        ]
+
+    def _guard_criteria(
+        self, plan: mp.MigrationPlan, from_state: Optional[model.MigrationState]
+    ) -> List:
+        criteria = self._sig_criteria(plan)
+        if from_state is not None:
+            criteria.extend(
+                [
+                    model.MigrationHistory.state == from_state,
+                    model.MigrationHistory.checksum == plan.get_checksum(),
+                ]
+            )
+        return criteria
+
+    def _check_rowcount(
+        self,
+        plan: mp.MigrationPlan,
+        rowcount: int,
+        from_state: Optional[model.MigrationState],
+    ) -> None:
+        if rowcount != 1:
+            raise Exception(
+                "Unexpected migration history,"
+                f" version={plan.version}, name={plan.name},"
+                f" expected_state={from_state}, rowcount={rowcount}"
+            )
+
+    def get_hist_id(self, plan: mp.MigrationPlan) -> int:
+        return self._get_hist_id(plan)
+
+    def clear_progress(self, plan: mp.MigrationPlan) -> None:
+        """
+        Discard the checkpoint, so that the next run starts over
+        """
+        self.session.execute(
+            delete(model.MigrationHistoryProgress).where(
+                model.MigrationHistoryProgress.hist_id == self._get_hist_id(plan)
+            )
+        )
+
+    def _get_hist_id(self, plan: mp.MigrationPlan) -> int:
+        key = (plan.version, plan.name)
+        if key not in self._hist_ids:
+            stmt = select(model.MigrationHistory.id).where(*self._sig_criteria(plan))
+            self._hist_ids[key] = self.session.scalars(stmt).one()
+        return self._hist_ids[key]
+
+    def _add_pending_log(
+        self,
+        hist_id: int,
+        plan: mp.MigrationPlan,
+        operation: Operation,
+        operator: str,
+        fake: bool,
+    ) -> None:
+        self._pending_logs.append(
+            {
+                "hist_id": hist_id,
+                "operation": operation,
+                "operator": operator,
+                **self._gen_snapshot_columns(plan, fake),
+                "created": datetime.datetime.utcnow(),
+            }
+        )
+
+    def flush_logs(self) -> None:
+        if len(self._pending_logs) == 0:
+            return
+        self.session.execute(
+            insert(model.MigrationHistoryLog).values(self._pending_logs)
+        )
+        self._pending_logs = []
+
     def get_all(self) -> List[model.MigrationHistory]:
         return (
             self.session.query(model.MigrationHistory)
             .order_by(model.MigrationHistory.id.asc())
-            .with_for_update()
             .all()
         )
 
@@ -155,26 +491,42 @@ class MigrationHistoryDAO:
             .all()
         )
         dtos = [hist.to_dto() for hist in hists]
-        self.commit()
+        # end the read-only transaction
+        self.session.commit()
+        return dtos
+
+    def get_all_by_sig_dto(
+        self,
+    ) -> Dict[mp.MigrationSignature, model.MigrationHistoryDTO]:
+        """
+        Fetch all the histories by one query, keyed by signature
+        """
+        hists = self.session.query(model.MigrationHistory).all()
+        dtos = {
+            mp.MigrationSignature(version=hist.ver, name=hist.name): hist.to_dto()
+            for hist in hists
+        }
+        # end the read-only transaction
+        self.session.commit()
         return dtos
 
     def get_all_versioned_dto(self) -> List[model.MigrationHistoryDTO]:
         hists = (
             self.session.query(model.MigrationHistory)
             .filter(VERSIONED_TYPE_CRITERION)
-            .order_by(model.MigrationHistory.id.asc())
+            .order_by(*VERSIONED_ORDER)
             .all()
         )
         dtos = [hist.to_dto() for hist in hists]
-        self.commit()
+        # end the read-only transaction
+        self.session.commit()
         return dtos
 
     def get_all_versioned(self) -> List[model.MigrationHistory]:
         return (
             self.session.query(model.MigrationHistory)
             .filter(VERSIONED_TYPE_CRITERION)
-            .order_by(model.MigrationHistory.id.asc())
-            .with_for_update()
+            .order_by(*VERSIONED_ORDER)
             .all()
         )
 
@@ -182,7 +534,6 @@ class MigrationHistoryDAO:
         return (
             self.session.query(model.MigrationHistory)
             .order_by(model.MigrationHistory.id.desc())
-            .with_for_update()
             .first()
         )
 
@@ -191,7 +542,6 @@ class MigrationHistoryDAO:
             self.session.query(model.MigrationHistory)
             .filter(VERSIONED_TYPE_CRITERION)
             .order_by(model.MigrationHistory.id.desc())
-            .with_for_update()
             .first()
         )
 
@@ -204,7 +554,6 @@ class MigrationHistoryDAO:
                 model.MigrationHistory.ver == sig.version,
                 model.MigrationHistory.name == sig.name,
             )
-            .with_for_update()
             .one_or_none()
         )
 
@@ -220,11 +569,136 @@ class MigrationHistoryDAO:
             .one_or_none()
         )
         hist_dto = hist.to_dto() if hist is not None else None
-        self.commit()
+        # end the read-only transaction
+        self.session.commit()
         return hist_dto
 
+    def count_logs_before(self, before: datetime.datetime) -> int:
+        stmt = (
+            select(func.count())
+            .select_from(model.MigrationHistoryLog)
+            .where(model.MigrationHistoryLog.created < before)
+        )
+        count = self.session.scalar(stmt)
+        # end the read-only transaction
+        self.session.commit()
+        return count
+
+    def archive_logs(self, before: datetime.datetime, batch_size: int) -> int:
+        """
+        Move at most batch_size logs created before the time into the archive
+        table in one short transaction, return the number of moved logs
+        """
+        log = model.MigrationHistoryLog
+        archive = model.MigrationHistoryLogArchive
+        with self.session.begin():
+            ids = self.session.scalars(
+                select(log.id)
+                .where(log.created < before)
+                .order_by(log.id.asc())
+                .limit(batch_size)
+            ).all()
+            if len(ids) == 0:
+                return 0
+            columns = [
+                "id",
+                "hist_id",
+                "operation",
+                "snapshot",
+                "snapshot_z",
+                "snapshot_id",
+                "operator",
+                "created",
+            ]
+            self.session.execute(
+                insert(archive).from_select(
+                    columns,
+                    select(*[log.__table__.c[c] for c in columns]).where(
+                        log.id.in_(ids)
+                    ),
+                )
+            )
+            self.session.execute(delete(log).where(log.id.in_(ids)))
+        return len(ids)
+
+    def dedup_log_snapshots(self, batch_size: int) -> int:
+        """
+        Move the inline snapshots of at most batch_size logs into the snapshot
+        table in one short transaction, return the number of updated logs
+        """
+        log = model.MigrationHistoryLog
+        with self.session.begin():
+            logs = self.session.scalars(
+                select(log)
+                .where(log.snapshot_id.is_(None))
+                .order_by(log.id.asc())
+                .limit(batch_size)
+            ).all()
+            if len(logs) == 0:
+                return 0
+            # snapshot_id -> ids of the logs
+            log_ids: Dict[str, List[int]] = {}
+            for row in logs:
+                snapshot_id = self._add_snapshot(row.get_snapshot())
+                log_ids.setdefault(snapshot_id, []).append(row.id)
+            self.flush_snapshots()
+            for snapshot_id, ids in log_ids.items():
+                self.session.execute(
+                    update(log)
+                    .where(log.id.in_(ids))
+                    .values(snapshot="", snapshot_z=None, snapshot_id=snapshot_id)
+                    .execution_options(synchronize_session=False)
+                )
+        return len(logs)
+
+    def set_versioned_head(self, count: int, chain_checksum: str) -> None:
+        """
+        Record that the first count versioned histories are successful,
+        the head is written on commit
+        """
+        self._pending_head = (count, chain_checksum)
+
+    def flush_head(self) -> None:
+        if self._pending_head is None:
+            return
+        count, chain_checksum = self._pending_head
+        stmt = mysql_insert(model.MigrationHistoryMeta).values(
+            name=model.META_VERSIONED_HEAD, value=f"{count}:{chain_checksum}"
+        )
+        stmt = stmt.on_duplicate_key_update(value=stmt.inserted.value)
+        self.session.execute(stmt)
+        self._pending_head = None
+
+    def get_versioned_head(self) -> Optional[Tuple[int, str]]:
+        """
+        return (count, chain checksum) of the successful versioned histories,
+        None if the head is not recorded
+        """
+        value = self.session.scalar(
+            select(model.MigrationHistoryMeta.value).where(
+                model.MigrationHistoryMeta.name == model.META_VERSIONED_HEAD
+            )
+        )
+        # end the read-only transaction
+        self.session.commit()
+        if value is None:
+            return None
+        count, chain_checksum = value.split(":", 1)
+        return int(count), chain_checksum
+
     def clear_all(self) -> None:
         self.session.query(model.MigrationHistory).delete()
+        self.session.query(model.MigrationHistoryProgress).delete()
+        self.session.execute(
+            delete(model.MigrationHistoryMeta).where(
+                model.MigrationHistoryMeta.name == model.META_VERSIONED_HEAD
+            )
+        )
 
     def commit(self) -> None:
+        if self.lock is not None:
+            self.lock.ensure_held()
+        self.flush_snapshots()
+        self.flush_logs()
+        self.flush_head()
         self.session.commit()
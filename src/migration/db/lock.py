@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import threading
+from typing import Optional
+
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.exc import DBAPIError
+
+from migration import err
+
+logger = logging.getLogger(__name__)
+
+# mysql limits the length of lock names to 64 characters
+MAX_LOCK_NAME_LEN = 64
+
+
+def lock_name(schema: str) -> str:
+    name = f"sdm:{schema}"
+    if len(name) > MAX_LOCK_NAME_LEN:
+        name = "sdm:" + hashlib.sha1(schema.encode()).hexdigest()
+    return name
+
+
+class MigrationLock:
+    """
+    The migration mutex of a schema, implemented by a named advisory lock
+    (GET_LOCK), so that the migration history rows don't need to be locked.
+    The lock is held by a dedicated connection until it is released.
+    """
+
+    def __init__(self, engine: Engine, timeout: int) -> None:
+        self.engine = engine
+        self.timeout = timeout
+        self.name = lock_name(engine.url.database)
+        self._conn: Optional[Connection] = None
+        self._owner_id: Optional[int] = None
+        # the connection is shared by the workers of parallel migrations
+        self._mutex = threading.Lock()
+
+    def acquire(self) -> None:
+        conn = self.engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+        try:
+            owner_id = conn.execute(text("SELECT CONNECTION_ID()")).scalar_one()
+            logger.debug(
+                "Acquiring migration lock %s, timeout=%ds", self.name, self.timeout
+            )
+            acquired = conn.execute(
+                text("SELECT GET_LOCK(:name, :timeout)"),
+                {"name": self.name, "timeout": self.timeout},
+            ).scalar_one()
+            if acquired != 1:
+                raise err.MigrationLockError(
+                    f"Failed to acquire migration lock {self.name} in {self.timeout}s,"
+                    " another migration is running on schema"
+                    f" {self.engine.url.database}, holder:"
+                    f" {self._describe_holder(conn)}"
+                )
+        except Exception:
+            conn.close()
+            raise
+        self._conn = conn
+        self._owner_id = owner_id
+        logger.debug("Acquired migration lock %s", self.name)
+
+    def _describe_holder(self, conn: Connection) -> str:
+        holder_id = conn.execute(
+            text("SELECT IS_USED_LOCK(:name)"), {"name": self.name}
+        ).scalar_one()
+        if holder_id is None:
+            return "unknown"
+        try:
+            row = conn.execute(
+                text(
+                    "SELECT USER, HOST, TIME FROM information_schema.PROCESSLIST"
+                    " WHERE ID = :id"
+                ),
+                {"id": holder_id},
+            ).one_or_none()
+        except DBAPIError:
+            row = None
+        if row is None:
+            return f"connection_id={holder_id}"
+        return (
+            f"connection_id={holder_id}, user={row[0]}, host={row[1]}, time={row[2]}s"
+        )
+
+    def ensure_held(self) -> None:
+        """
+        Fencing, make sure the lock is still held before writing the history.
+        The lock is lost if the connection holding it is closed by the server.
+        """
+        if self._conn is None:
+            raise err.MigrationLockError(f"Migration lock {self.name} is not held")
+        try:
+            with self._mutex:
+                holder_id = self._conn.execute(
+                    text("SELECT IS_USED_LOCK(:name)"), {"name": self.name}
+                ).scalar_one()
+        except DBAPIError as e:
+            raise err.MigrationLockError(
+                f"Lost the connection holding migration lock {self.name}"
+            ) from e
+        if holder_id != self._owner_id:
+            raise err.MigrationLockError(
+                f"Lost migration lock {self.name}, owner={self._owner_id},"
+                f" holder={holder_id}"
+            )
+
+    def release(self) -> None:
+        if self._conn is None:
+            return
+        try:
+            self._conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": self.name})
+            logger.debug("Released migration lock %s", self.name)
+        except DBAPIError:
+            logger.warning("Failed to release migration lock %s", self.name)
+        finally:
+            self._conn.close()
+            self._conn = None
+            self._owner_id = None
+
+    def __enter__(self) -> "MigrationLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.release()
@@ -1,10 +1,14 @@
 import datetime
 import enum
+import hashlib
+import zlib
 from dataclasses import dataclass
+from typing import Optional
 
 from sqlalchemy import BIGINT, Integer, String, Text
+from sqlalchemy.dialects.mysql import MEDIUMBLOB
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column
-from sqlalchemy.schema import UniqueConstraint
+from sqlalchemy.schema import Index, UniqueConstraint
 from sqlalchemy.types import DateTime
 
 from migration.env import cli_env
@@ -29,6 +33,22 @@ class MigrationState(enum.Enum):
     ROLLBACKING = "ROLLBACKING"
 
 
+# Bump the version whenever the bookkeeping tables change,
+# and add the corresponding upgrade step in db/upgrade.py
+BOOKKEEPING_VERSION = 6
+META_BOOKKEEPING_VERSION = "bookkeeping_version"
+# "<count>:<chain checksum>" of the successful versioned histories
+META_VERSIONED_HEAD = "versioned_head"
+
+
+def chain_checksum(prev_chain_checksum: str, checksum: str) -> str:
+    """
+    The chain checksum of versioned plans covers the checksums of all the
+    plans before, so comparing the last one compares them all
+    """
+    return hashlib.sha1(f"{prev_chain_checksum}:{checksum}".encode()).hexdigest()
+
+
 TABLE_ARGS = {"mysql_charset": "utf8mb4", "mysql_collate": "utf8mb4_unicode_ci"}
 
 
@@ -65,6 +85,11 @@ class MigrationHistory(Base):
         DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
     )
     checksum: Mapped[str] = mapped_column(String(255), default="")
+    # chain checksum of the versioned histories up to this one
+    chain_checksum: Mapped[Optional[str]] = mapped_column(String(40), nullable=True)
+    # completion order of the versioned histories, which may differ from the
+    # plan order when the plans are migrated concurrently
+    applied_seq: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
 
     def can_match(self, ver: str, name: str, checksum: str) -> bool:
         return self.ver == ver and self.name == name and self.checksum == checksum
@@ -81,15 +106,97 @@ class MigrationHistory(Base):
         )
 
 
-class MigrationHistoryLog(Base):
-    __tablename__ = cli_env.TABLE_MIGRATION_HISTORY_LOG
-    __table_args__ = TABLE_ARGS
+class SnapshotMixin:
+    snapshot: Mapped[str] = mapped_column(Text(), default="")
+    # zlib compressed snapshot, takes precedence over snapshot
+    snapshot_z: Mapped[Optional[bytes]] = mapped_column(MEDIUMBLOB, nullable=True)
 
-    id: Mapped[int] = mapped_column(primary_key=True)
+    def get_snapshot(self) -> str:
+        if self.snapshot_z is not None:
+            return zlib.decompress(self.snapshot_z).decode()
+        return self.snapshot
+
+
+class MigrationHistoryLogMixin(SnapshotMixin):
     hist_id: Mapped[int] = mapped_column(Integer)
     operation: Mapped[str] = mapped_column(String(255))
-    snapshot: Mapped[str] = mapped_column(Text(), default="")
+    # references MigrationHistorySnapshot, the inline snapshot is empty if set
+    snapshot_id: Mapped[Optional[str]] = mapped_column(String(40), nullable=True)
     operator: Mapped[str] = mapped_column(String(255), default="")
     created: Mapped[DateTime] = mapped_column(
         DateTime, default=datetime.datetime.utcnow
     )
+
+
+class MigrationHistoryLog(MigrationHistoryLogMixin, Base):
+    __tablename__ = cli_env.TABLE_MIGRATION_HISTORY_LOG
+    __table_args__ = (
+        Index("idx_hist_id_created", "hist_id", "created"),
+        TABLE_ARGS,
+    )
+
+    id: Mapped[int] = mapped_column(primary_key=True)
+
+
+class MigrationHistoryLogArchive(MigrationHistoryLogMixin, Base):
+    __tablename__ = cli_env.TABLE_MIGRATION_HISTORY_LOG_ARCHIVE
+    __table_args__ = (
+        Index("idx_archive_hist_id_created", "hist_id", "created"),
+        TABLE_ARGS,
+    )
+
+    # keep the id of MigrationHistoryLog
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    archived: Mapped[DateTime] = mapped_column(
+        DateTime, default=datetime.datetime.utcnow
+    )
+
+
+class MigrationHistorySnapshot(SnapshotMixin, Base):
+    """
+    Content-addressed snapshots of migration plans shared by the logs,
+    the id is the sha1 of the snapshot
+    """
+
+    __tablename__ = cli_env.TABLE_MIGRATION_HISTORY_SNAPSHOT
+    __table_args__ = TABLE_ARGS
+
+    id: Mapped[str] = mapped_column(String(40), primary_key=True)
+    created: Mapped[DateTime] = mapped_column(
+        DateTime, default=datetime.datetime.utcnow
+    )
+
+
+class MigrationHistoryProgress(Base):
+    """
+    The checkpoint of a long running migration, which is saved in the same
+    transaction as the migrated data
+    """
+
+    __tablename__ = cli_env.TABLE_MIGRATION_HISTORY_PROGRESS
+    __table_args__ = TABLE_ARGS
+
+    hist_id: Mapped[int] = mapped_column(primary_key=True, autoincrement=False)
+    # the checkpoint is discarded if the plan is changed
+    checksum: Mapped[str] = mapped_column(String(255))
+    direction: Mapped[str] = mapped_column(String(255))
+    # the last migrated key of sql_chunked
+    last_key: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    # the last committed statement index (1-based) of sql_file
+    statement_index: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # the migrated rows, the committed rows of the file of bulk_load
+    rows: Mapped[int] = mapped_column(BIGINT, default=0)
+    updated: Mapped[DateTime] = mapped_column(
+        DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
+    )
+
+
+class MigrationHistoryMeta(Base):
+    __tablename__ = cli_env.TABLE_MIGRATION_HISTORY_META
+    __table_args__ = TABLE_ARGS
+
+    name: Mapped[str] = mapped_column(String(255), primary_key=True)
+    value: Mapped[str] = mapped_column(String(255), default="")
+    updated: Mapped[DateTime] = mapped_column(
+        DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow
+    )
@@ -0,0 +1,82 @@
+import datetime
+import logging
+from enum import StrEnum
+from typing import Dict, Optional
+
+from sqlalchemy import delete
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.orm import Session
+
+from . import model
+
+logger = logging.getLogger(__name__)
+
+
+class Direction(StrEnum):
+    FORWARD = "forward"
+    BACKWARD = "backward"
+
+
+class ProgressCheckpoint:
+    """
+    The checkpoint of a migration history, the executors save it in the same
+    transaction as the data they migrate, so a failed migration can be
+    resumed from the last checkpoint.
+    """
+
+    def __init__(self, hist_id: int, checksum: str, direction: Direction) -> None:
+        self.hist_id = hist_id
+        self.checksum = checksum
+        self.direction = direction
+
+    def load(self, session: Session) -> Optional[Dict]:
+        """
+        return None if there is no valid checkpoint
+        """
+        progress = session.get(model.MigrationHistoryProgress, self.hist_id)
+        if progress is None:
+            return None
+        if progress.checksum != self.checksum or progress.direction != self.direction:
+            logger.info(
+                "Discarding the checkpoint of hist_id=%d, the plan or direction"
+                " is changed",
+                self.hist_id,
+            )
+            self.clear(session)
+            return None
+        return {
+            "last_key": progress.last_key,
+            "statement_index": progress.statement_index,
+            "rows": progress.rows,
+        }
+
+    def save(
+        self,
+        session: Session,
+        rows: int,
+        last_key: Optional[str] = None,
+        statement_index: Optional[int] = None,
+    ) -> None:
+        """
+        the checkpoint is committed with the transaction of the session
+        """
+        values = {
+            "checksum": self.checksum,
+            "direction": self.direction,
+            "last_key": last_key,
+            "statement_index": statement_index,
+            "rows": rows,
+            "updated": datetime.datetime.utcnow(),
+        }
+        stmt = insert(model.MigrationHistoryProgress).values(
+            hist_id=self.hist_id, **values
+        )
+        stmt = stmt.on_duplicate_key_update(**values)
+        session.execute(stmt)
+
+    def clear(self, session: Session) -> None:
+        session.execute(
+            delete(model.MigrationHistoryProgress).where(
+                model.MigrationHistoryProgress.hist_id == self.hist_id
+            )
+        )
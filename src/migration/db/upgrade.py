@@ -0,0 +1,145 @@
+import logging
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import Connection, inspect, select, update
+from sqlalchemy.dialects.mysql import insert
+from sqlalchemy.exc import ProgrammingError
+
+from . import model
+
+logger = logging.getLogger(__name__)
+
+
+def _upgrade_to_2(conn: Connection) -> None:
+    # index and compressed snapshot of the migration history log
+    table = model.MigrationHistoryLog.__table__
+    insp = inspect(conn)
+    columns = [c["name"] for c in insp.get_columns(table.name)]
+    if "snapshot_z" not in columns:
+        conn.exec_driver_sql(
+            f"ALTER TABLE `{table.name}` ADD COLUMN `snapshot_z` MEDIUMBLOB NULL"
+            " AFTER `snapshot`"
+        )
+    indexes = [i["name"] for i in insp.get_indexes(table.name)]
+    for index in table.indexes:
+        if index.name not in indexes:
+            index.create(conn)
+
+
+def _upgrade_to_3(conn: Connection) -> None:
+    # logs reference the content-addressed snapshots
+    insp = inspect(conn)
+    for table in [
+        model.MigrationHistoryLog.__table__,
+        model.MigrationHistoryLogArchive.__table__,
+    ]:
+        columns = [c["name"] for c in insp.get_columns(table.name)]
+        if "snapshot_id" not in columns:
+            conn.exec_driver_sql(
+                f"ALTER TABLE `{table.name}` ADD COLUMN `snapshot_id` VARCHAR(40)"
+                " NULL AFTER `snapshot_z`"
+            )
+
+
+def _upgrade_to_4(conn: Connection) -> None:
+    # chain checksums of the versioned histories and the versioned head
+    table = model.MigrationHistory.__table__
+    columns = [c["name"] for c in inspect(conn).get_columns(table.name)]
+    if "chain_checksum" not in columns:
+        conn.exec_driver_sql(
+            f"ALTER TABLE `{table.name}` ADD COLUMN `chain_checksum` VARCHAR(40)"
+            " NULL AFTER `checksum`"
+        )
+    hists = conn.execute(
+        select(table.c.id, table.c.state, table.c.checksum)
+        # the versioned types of migration_plan.Type
+        .where(table.c.type.in_(["schema", "data"])).order_by(table.c.id.asc())
+    ).all()
+    count, chain_checksum = 0, ""
+    for hist in hists:
+        if hist.state != model.MigrationState.SUCCESSFUL:
+            break
+        count += 1
+        chain_checksum = model.chain_checksum(chain_checksum, hist.checksum)
+        conn.execute(
+            update(table)
+            .where(table.c.id == hist.id)
+            .values(chain_checksum=chain_checksum)
+        )
+    if count > 0:
+        write_meta(conn, model.META_VERSIONED_HEAD, f"{count}:{chain_checksum}")
+
+
+def _upgrade_to_6(conn: Connection) -> None:
+    # completion order of the versioned histories
+    table = model.MigrationHistory.__table__
+    columns = [c["name"] for c in inspect(conn).get_columns(table.name)]
+    if "applied_seq" in columns:
+        return
+    conn.exec_driver_sql(
+        f"ALTER TABLE `{table.name}` ADD COLUMN `applied_seq` INT NULL"
+        " AFTER `chain_checksum`"
+    )
+    # the versioned histories were applied in the order of the ids
+    conn.execute(
+        update(table)
+        .where(
+            table.c.type.in_(["schema", "data"]),
+            table.c.state == model.MigrationState.SUCCESSFUL,
+        )
+        .values(applied_seq=table.c.id)
+    )
+
+
+# (version, upgrade step)
+# Each step upgrades the bookkeeping tables from (version - 1) to version.
+# The steps must be idempotent, because the tables created by create_all
+# already have the latest structure.
+# New tables are created by create_all, no step is needed, e.g. version 5.
+UPGRADE_STEPS: List[Tuple[int, Callable[[Connection], None]]] = [
+    (2, _upgrade_to_2),
+    (3, _upgrade_to_3),
+    (4, _upgrade_to_4),
+    (6, _upgrade_to_6),
+]
+
+
+def read_bookkeeping_version(conn: Connection) -> Optional[int]:
+    """
+    return None if the bookkeeping version is not recorded yet
+    """
+    stmt = select(model.MigrationHistoryMeta.value).where(
+        model.MigrationHistoryMeta.name == model.META_BOOKKEEPING_VERSION
+    )
+    try:
+        value = conn.execute(stmt).scalar_one_or_none()
+    except ProgrammingError:
+        # the meta table does not exist
+        return None
+    return int(value) if value is not None else None
+
+
+def write_meta(conn: Connection, name: str, value: str) -> None:
+    stmt = insert(model.MigrationHistoryMeta).values(name=name, value=value)
+    stmt = stmt.on_duplicate_key_update(value=stmt.inserted.value)
+    conn.execute(stmt)
+
+
+def write_bookkeeping_version(conn: Connection, version: int) -> None:
+    write_meta(conn, model.META_BOOKKEEPING_VERSION, str(version))
+
+
+def upgrade(conn: Connection, from_version: Optional[int]) -> None:
+    logger.info(
+        "Upgrading bookkeeping tables, from_version=%s, to_version=%s",
+        from_version,
+        model.BOOKKEEPING_VERSION,
+    )
+    model.Base.metadata.create_all(conn)
+    current = from_version if from_version is not None else 0
+    for version, step in UPGRADE_STEPS:
+        if version <= current:
+            continue
+        logger.info("Applying bookkeeping upgrade step, version=%d", version)
+        step(conn)
+    write_bookkeeping_version(conn, model.BOOKKEEPING_VERSION)
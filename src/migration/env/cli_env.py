@@ -30,15 +30,100 @@ UNITTEST_MYSQL_PORT2 = int(
 
 ALLOW_UNSAFE = int(load.getenv("ALLOW_UNSAFE", default="0", required=False))
 ALLOW_ECHO_SQL = int(load.getenv("ALLOW_ECHO_SQL", default="0", required=False))
+# write migration history with the fewest statements, see MigrationHistoryDAO
+BATCHED_HISTORY = int(load.getenv("BATCHED_HISTORY", default="0", required=False))
+# execute sql/sql_file data migrations in the same transaction as their history
+FUSED_SQL_MIGRATION = int(
+    load.getenv("FUSED_SQL_MIGRATION", default="0", required=False)
+)
+# max number of fused data migrations committed in one transaction
+FUSED_SQL_BATCH_LIMIT = int(
+    load.getenv("FUSED_SQL_BATCH_LIMIT", default="1", required=False)
+)
+# max number of statements and bytes of a fused data migration, larger
+#   migrations are executed the usual way, e.g. sql_file streamed
+FUSED_SQL_MAX_STATEMENTS = int(
+    load.getenv("FUSED_SQL_MAX_STATEMENTS", default="1000", required=False)
+)
+FUSED_SQL_MAX_BYTES = int(
+    load.getenv("FUSED_SQL_MAX_BYTES", default="1048576", required=False)
+)
+# commit sql_file migrations every n statements, 0 means a single transaction
+SQL_FILE_COMMIT_EVERY = int(
+    load.getenv("SQL_FILE_COMMIT_EVERY", default="0", required=False)
+)
+# store the snapshots in migration history log compressed
+COMPRESS_HISTORY_LOG = int(
+    load.getenv("COMPRESS_HISTORY_LOG", default="1", required=False)
+)
+# store each distinct snapshot once and reference it from the logs
+DEDUP_HISTORY_SNAPSHOT = int(
+    load.getenv("DEDUP_HISTORY_SNAPSHOT", default="1", required=False)
+)
+# number of versioned migrations executed concurrently,
+#   a plan is started once its dependencies are applied
+VERSIONED_PARALLELISM = int(
+    load.getenv("VERSIONED_PARALLELISM", default="1", required=False)
+)
+# number of repeatable migrations executed concurrently
+REPEATABLE_PARALLELISM = int(
+    load.getenv("REPEATABLE_PARALLELISM", default="1", required=False)
+)
+# serialize migrations of a schema by a named advisory lock
+MIGRATION_LOCK = int(load.getenv("MIGRATION_LOCK", default="1", required=False))
+# seconds to wait for the lock, negative value means waiting forever
+MIGRATION_LOCK_TIMEOUT = int(
+    load.getenv("MIGRATION_LOCK_TIMEOUT", default="10", required=False)
+)
+# pause the migration while the replicas lag behind or the primary is busy,
+#   0 means not checked
+THROTTLE_MAX_REPLICA_LAG = int(
+    load.getenv("THROTTLE_MAX_REPLICA_LAG", default="0", required=False)
+)
+THROTTLE_MAX_THREADS_RUNNING = int(
+    load.getenv("THROTTLE_MAX_THREADS_RUNNING", default="0", required=False)
+)
+# replicas to check the lag, e.g. "replica1:3306,replica2:3306"
+THROTTLE_REPLICAS = load.getenv("THROTTLE_REPLICAS", default="", required=False)
+THROTTLE_CHECK_INTERVAL = float(
+    load.getenv("THROTTLE_CHECK_INTERVAL", default="1", required=False)
+)
+# seconds to wait for the servers to recover, negative value means waiting forever
+THROTTLE_MAX_WAIT = int(load.getenv("THROTTLE_MAX_WAIT", default="600", required=False))
 
 SKEEMA_CMD_PATH = load.getenv("SKEEMA_CMD_PATH", default="skeema", required=False)
 NODE_CMD_PATH = load.getenv("NODE_CMD_PATH", default="node", required=False)
 NPM_CMD_PATH = load.getenv("NPM_CMD_PATH", default="npm", required=False)
+# reuse the compiled js of typescript migrations and condition checks
+TYPESCRIPT_BUILD_CACHE = int(
+    load.getenv("TYPESCRIPT_BUILD_CACHE", default="1", required=False)
+)
+# run the typescript migrations of a migration run by one long-lived node process
+TYPESCRIPT_WORKER = int(load.getenv("TYPESCRIPT_WORKER", default="0", required=False))
+# prepare up to N versioned plans ahead of their execution, 0 means disabled
+PREFETCH_LOOKAHEAD = int(load.getenv("PREFETCH_LOOKAHEAD", default="0", required=False))
+# reuse the last pulled schema of an environment while its structure is unchanged,
+# by a fingerprint of information_schema, 0 means always pulling
+SCHEMA_SNAPSHOT_CACHE = int(
+    load.getenv("SCHEMA_SNAPSHOT_CACHE", default="0", required=False)
+)
+# run the python migrations by a pool of worker processes, 0 runs them in sdm
+PYTHON_WORKERS = int(load.getenv("PYTHON_WORKERS", default="0", required=False))
+# address space limit of a python worker in MB, 0 means unlimited
+PYTHON_WORKER_MEMORY_LIMIT = int(
+    load.getenv("PYTHON_WORKER_MEMORY_LIMIT", default="0", required=False)
+)
+# seconds a python migration may run in a worker, 0 means unlimited
+PYTHON_WORKER_TIMEOUT = float(
+    load.getenv("PYTHON_WORKER_TIMEOUT", default="0", required=False)
+)
 
 SCHEMA_DIR = "schema"
 DATA_DIR = "data"
 MIGRATION_PLAN_DIR = "migration_plan"
 SCHEMA_STORE_DIR = ".schema_store"
+# build artifacts, safe to delete
+CACHE_DIR = ".sdm_cache"
 ENV_INI_FILE = os.path.join(SCHEMA_DIR, ".skeema")
 
 SDM_SCHEMA_DIR = os.path.abspath(os.path.join(MIGRATION_CWD, SCHEMA_DIR))
@@ -50,6 +135,28 @@ TABLE_MIGRATION_HISTORY = load.getenv(
 TABLE_MIGRATION_HISTORY_LOG = load.getenv(
     "TABLE_MIGRATION_HISTORY", default="_migration_history_log", required=False
 )
+# keep the "_migration_history" prefix, so that the table is also covered by
+# the --ignore-table option passed to skeema
+TABLE_MIGRATION_HISTORY_LOG_ARCHIVE = load.getenv(
+    "TABLE_MIGRATION_HISTORY_LOG_ARCHIVE",
+    default="_migration_history_log_archive",
+    required=False,
+)
+TABLE_MIGRATION_HISTORY_SNAPSHOT = load.getenv(
+    "TABLE_MIGRATION_HISTORY_SNAPSHOT",
+    default="_migration_history_snapshot",
+    required=False,
+)
+TABLE_MIGRATION_HISTORY_PROGRESS = load.getenv(
+    "TABLE_MIGRATION_HISTORY_PROGRESS",
+    default="_migration_history_progress",
+    required=False,
+)
+TABLE_MIGRATION_HISTORY_META = load.getenv(
+    "TABLE_MIGRATION_HISTORY_META",
+    default="_migration_history_meta",
+    required=False,
+)
 
 SAMPLE_PYTHON_FILE = """from sqlalchemy.orm import Session
 from sqlalchemy import Column, String
@@ -91,6 +198,7 @@ node_modules/
 build/
 data/*.js
 data/*.js.map
+.sdm_cache/
 *pyc
 
 # Temporary files
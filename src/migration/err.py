@@ -9,3 +9,24 @@ class ConditionCheckFailedError(CustomError):
 # Define integrity exception
 class IntegrityError(CustomError):
     pass
+
+
+class MigrationLockError(CustomError):
+    pass
+
+
+class ThrottleError(CustomError):
+    pass
+
+
+class SQLStatementError(CustomError):
+    def __init__(self, message: str, index: int, line_no: int) -> None:
+        super().__init__(message)
+        # 1-based index of the failed statement
+        self.index = index
+        # line number where the failed statement starts
+        self.line_no = line_no
+
+
+class PythonWorkerError(CustomError):
+    pass
@@ -4,11 +4,15 @@ import logging
 import os
 import shlex
 import subprocess
-from typing import Dict, List
+import threading
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Dict, List, Mapping, Tuple
 
+from sqlalchemy import Engine
 from sqlalchemy.orm import Session
 
-from .db.db import make_session
+from .db.db import get_engine, make_session
 from .env import cli_env
 
 logger = logging.getLogger(__name__)
@@ -70,6 +74,33 @@ def truncate_str(s: str, max_len: int = 40) -> str:
     return s[:max_len] + "..."
 
 
+@dataclass(frozen=True)
+class EnvConfig:
+    """
+    An environment of the env ini file, with its connection settings and the
+    environment variables of its shell and typescript migrations
+    """
+
+    name: str
+    host: str
+    port: int
+    user: str
+    schema: str
+    # os.environ with the connection settings, the template of subprocess envs
+    env_template: Mapping[str, str]
+
+    def subprocess_env(self, update_env: Dict[str, str]) -> Dict[str, str]:
+        env = dict(self.env_template)
+        env.update(update_env)
+        return env
+
+
+# the parsed env ini file by path, checked for changes once per command
+#   (path) -> ((mtime_ns, size), configs)
+_env_ini_cache: Dict[str, Tuple[Tuple[int, int], Mapping[str, EnvConfig]]] = {}
+_env_ini_lock = threading.Lock()
+
+
 def parse_env_ini() -> configparser.ConfigParser:
     file_path = os.path.join(cli_env.MIGRATION_CWD, cli_env.ENV_INI_FILE)
     with open(file_path) as f:
@@ -79,27 +110,100 @@ def parse_env_ini() -> configparser.ConfigParser:
     return config
 
 
-def get_env_ini_section(env: str) -> configparser.SectionProxy:
-    cfg = parse_env_ini()
-    if not cfg.has_section(env):
-        raise Exception(f"Environment [{env}] not found in configuration")
-    return cfg[env]
+def _env_ini_version(file_path: str) -> Tuple[int, int]:
+    stat = os.stat(file_path)
+    return (stat.st_mtime_ns, stat.st_size)
 
 
-def get_env_with_update(update_env: Dict[str, str]) -> Dict[str, str]:
-    os_env = os.environ.copy()
-    os_env.update(update_env)
-    return os_env
+def refresh_env_configs() -> None:
+    """
+    Drop the parsed env ini file if it changed since it was parsed,
+    called at the start of each command and after the file is written
+    """
+    file_path = os.path.join(cli_env.MIGRATION_CWD, cli_env.ENV_INI_FILE)
+    with _env_ini_lock:
+        cached = _env_ini_cache.get(file_path)
+        if cached is None:
+            return
+        try:
+            changed = _env_ini_version(file_path) != cached[0]
+        except FileNotFoundError:
+            changed = True
+        if changed:
+            del _env_ini_cache[file_path]
+
+
+def load_env_configs() -> Mapping[str, EnvConfig]:
+    """
+    return the environments of the env ini file, parsed once per process,
+    without touching the file until refresh_env_configs finds it changed
+    """
+    file_path = os.path.join(cli_env.MIGRATION_CWD, cli_env.ENV_INI_FILE)
+    with _env_ini_lock:
+        cached = _env_ini_cache.get(file_path)
+        if cached is not None:
+            return cached[1]
+        version = _env_ini_version(file_path)
+        config = parse_env_ini()
+        os_env = os.environ.copy()
+        configs: Dict[str, EnvConfig] = {}
+        for name in config.sections():
+            section = config[name]
+            if not all(k in section for k in ["host", "port", "user", "schema"]):
+                continue
+            env_template = dict(os_env)
+            env_template.update(
+                {
+                    "MYSQL_PWD": cli_env.MYSQL_PWD,
+                    "HOST": section["host"],
+                    "PORT": section["port"],
+                    "USER": section["user"],
+                    "SCHEMA": section["schema"],
+                }
+            )
+            configs[name] = EnvConfig(
+                name=name,
+                host=section["host"],
+                port=int(section["port"]),
+                user=section["user"],
+                schema=section["schema"],
+                env_template=MappingProxyType(env_template),
+            )
+        res = MappingProxyType(configs)
+        _env_ini_cache[file_path] = (version, res)
+        return res
+
+
+def get_env_config(env: str) -> EnvConfig:
+    configs = load_env_configs()
+    if env not in configs:
+        raise Exception(f"Environment [{env}] not found in configuration")
+    return configs[env]
 
 
-def build_session_from_env(env: str, echo: bool = False) -> Session:
-    section = get_env_ini_section(env)
+def build_session_from_env(
+    env: str, echo: bool = False, local_infile: bool = False
+) -> Session:
+    config = get_env_config(env)
     return make_session(
-        host=section["host"],
-        port=int(section["port"]),
-        user=section["user"],
+        host=config.host,
+        port=config.port,
+        user=config.user,
+        password=cli_env.MYSQL_PWD,
+        schema=config.schema,
+        echo=echo,
+        local_infile=local_infile,
+    )
+
+
+def build_engine_from_env(env: str, echo: bool = False) -> Engine:
+    config = get_env_config(env)
+    return get_engine(
+        host=config.host,
+        port=config.port,
+        user=config.user,
         password=cli_env.MYSQL_PWD,
-        schema=section["schema"],
+        schema=config.schema,
         echo=echo,
     )
 
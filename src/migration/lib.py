@@ -1,21 +1,30 @@
+import datetime
 import json
 import logging
 import os
-import shlex
 import shutil
-import subprocess
 import tempfile
+import time
 from argparse import Namespace
-from typing import Dict, List, Optional, Set, Tuple
+from concurrent.futures import (FIRST_COMPLETED, Future, ThreadPoolExecutor,
+                                wait)
+from contextlib import contextmanager, nullcontext
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
 
 from sqlalchemy import text
 from tabulate import tabulate
 
 from . import auto_test_plan, consts, err, helper
 from . import migration_plan as mp
-from .db import hist_dao, model
+from . import schema_diff
+from .db import db, hist_dao, model
+from .db.lock import MigrationLock
+from .db.progress import Direction, ProgressCheckpoint
 from .env import cli_env
 from .migrator import Migrator
+from .prefetch import Prefetcher
+from .schema_cache import SchemaSnapshotCache, snapshot_key
+from .throttle import Throttle
 
 logger = logging.getLogger(__name__)
 
@@ -26,42 +35,136 @@ class CLI:
         self.mpm: mp.MigrationPlanManager = None
         self.dao: hist_dao.MigrationHistoryDAO = None
         self.migrator = migrator
+        self.lock: Optional[MigrationLock] = None
+        self.throttle: Optional[Throttle] = None
+        # the env ini file may change between commands
+        helper.refresh_env_configs()
 
     def build_dao(self) -> hist_dao.MigrationHistoryDAO:
+        self.dao = self._make_dao()
+        return self.dao
+
+    def _make_dao(self) -> hist_dao.MigrationHistoryDAO:
         session = helper.build_session_from_env(
             self.args.environment, echo=cli_env.ALLOW_ECHO_SQL
         )
-        self.dao = hist_dao.MigrationHistoryDAO(session)
-        return self.dao
+        return hist_dao.MigrationHistoryDAO(
+            session, batched=bool(cli_env.BATCHED_HISTORY), lock=self.lock
+        )
+
+    @contextmanager
+    def _migration_lock(self):
+        """
+        Hold the migration mutex of the environment,
+        the histories written meanwhile are fenced by the lock.
+        """
+        if not cli_env.MIGRATION_LOCK or self.lock is not None:
+            yield
+            return
+        engine = helper.build_engine_from_env(
+            self.args.environment, echo=cli_env.ALLOW_ECHO_SQL
+        )
+        self.lock = MigrationLock(engine, cli_env.MIGRATION_LOCK_TIMEOUT)
+        try:
+            with self.lock:
+                yield
+        finally:
+            self.lock = None
+
+    @contextmanager
+    def _throttled(self):
+        """
+        Throttle the migrations executed meanwhile, between plans and between
+        the chunks of the long running data migrations, by the load of the
+        environment. The time spent waiting is reported at the end.
+        """
+        if self.throttle is not None:
+            yield
+            return
+        self.throttle = Throttle.from_env(self.args.environment)
+        try:
+            yield
+        finally:
+            if self.throttle is not None and self.throttle.throttle_time > 0:
+                logger.info(
+                    "Migration throttled for %.1fs in total",
+                    self.throttle.throttle_time,
+                )
+            self.throttle = None
+
+    @contextmanager
+    def _prefetching(
+        self, plans: List[mp.MigrationPlan], fake: bool
+    ) -> Iterator[Optional[Prefetcher]]:
+        """
+        Prepare the plans ahead of their execution, if enabled
+        """
+        lookahead = cli_env.PREFETCH_LOOKAHEAD
+        if fake or lookahead <= 0:
+            yield None
+            return
+        try:
+            with Prefetcher(self.migrator.prepare, plans, lookahead) as prefetcher:
+                yield prefetcher
+        finally:
+            self.migrator.discard_prepared()
+
+    def _throttle_wait(self) -> None:
+        if self.throttle is not None:
+            self.throttle.wait()
 
     def _check_migration_histories(
         self, migration_histories: List[model.MigrationHistory], fix: bool = False
     ):
+        """
+        The histories are in completion order, which is not always the plan
+        order, but each plan must be applied after its dependencies.
+        The chain checksum of each successful history must match the plans
+        applied until it, so a reordered or rewritten history is found.
+        In fix mode the histories can be PROCESSING or ROLLBACKING.
+        """
         if len(migration_histories) > self.mpm.count():
             raise Exception(
                 "Unexpected migration history,"
                 f" len(migration_histories)={len(migration_histories)},"
                 f" len(migration_plans)={self.mpm.count()}"
             )
+        plan_map = {p.sig(): p for p in self.mpm.get_plans()}
+        applied = self.mpm.applied_plans()
         # the history and migration plans should match
-        for idx, hist in enumerate(migration_histories):
+        for hist in migration_histories:
             if hist.state != model.MigrationState.SUCCESSFUL:
-                # if fix mode, the last history can be PROCESSING or ROLLBACKING
-                if fix and idx == len(migration_histories) - 1:
-                    if (
-                        hist.state == model.MigrationState.PROCESSING
-                        or hist.state == model.MigrationState.ROLLBACKING
-                    ):
-                        continue
-                raise Exception(
-                    f"Migration is not successful, version={hist.ver}, name={hist.name}"
-                )
-            plan = self.mpm.get_plan_by_index(idx)
-            if not hist.can_match(plan.version, plan.name, plan.get_checksum()):
+                if not fix or hist.state not in [
+                    model.MigrationState.PROCESSING,
+                    model.MigrationState.ROLLBACKING,
+                ]:
+                    raise Exception(
+                        "Migration is not successful,"
+                        f" version={hist.ver}, name={hist.name}"
+                    )
+            plan = plan_map.get(mp.MigrationSignature(version=hist.ver, name=hist.name))
+            if plan is None or not hist.can_match(
+                plan.version, plan.name, plan.get_checksum()
+            ):
                 raise Exception(
                     f"Unexpected migration history, version={hist.ver},"
                     f" name={hist.name}, checksum={hist.checksum}"
                 )
+            for dep in plan.dependencies:
+                if dep not in applied:
+                    raise Exception(
+                        f"Unexpected migration history, version={hist.ver},"
+                        f" name={hist.name}, dependency {dep} is not applied before"
+                    )
+            if hist.state == model.MigrationState.SUCCESSFUL:
+                applied.add(plan.sig())
+                chain_checksum = applied.get_chain_checksum()
+                if hist.chain_checksum != chain_checksum:
+                    raise Exception(
+                        f"Unexpected migration history, version={hist.ver},"
+                        f" name={hist.name}, chain_checksum={hist.chain_checksum},"
+                        f" expected {chain_checksum}"
+                    )
 
     def _get_and_check_versioned_migration_histories(
         self, fix: bool = False
@@ -78,27 +181,70 @@ class CLI:
         fake = self.args.fake if "fake" in self.args else False
         operator = self.args.operator if "operator" in self.args else ""
 
+        with (
+            self._migration_lock(),
+            self._throttled(),
+            self.migrator.typescript_worker(),
+            self.migrator.python_workers(),
+        ):
+            self._fix_migrate(forward, fake, operator)
+
+    def _fix_migrate(self, forward: bool, fake: bool, operator: str):
         dao = self.build_dao()
         with dao.session.begin():
             migration_histories = self._get_and_check_versioned_migration_histories(
                 fix=True
             )
-            if (
-                len(migration_histories) == 0
-                or migration_histories[-1].state == model.MigrationState.SUCCESSFUL
-            ):
-                logger.info("No need to fix migration")
-                return
-            target_plan = self.mpm.get_plan_by_index(len(migration_histories) - 1)
-            if forward:
-                if not fake:
-                    self.migrator.forward(target_plan, self.args)
-                dao.update_succ(target_plan, operator=operator, fake=fake)
-            else:
-                if not fake:
-                    self.migrator.backward(target_plan, self.args)
-                dao.delete(target_plan, operator=operator, fake=fake)
-            dao.commit()
+            applied = self.mpm.applied_plans()
+            to_fix_plans: List[mp.MigrationPlan] = []
+            for hist in migration_histories:
+                plan, _ = self.mpm.must_get_plan_by_signature(
+                    mp.MigrationSignature(version=hist.ver, name=hist.name)
+                )
+                if hist.state == model.MigrationState.SUCCESSFUL:
+                    applied.add(plan.sig())
+                else:
+                    to_fix_plans.append(plan)
+        if len(to_fix_plans) == 0:
+            logger.info("No need to fix migration")
+            return
+        # concurrent migrations may leave several unfinished histories
+        for target_plan in to_fix_plans if forward else reversed(to_fix_plans):
+            with dao.session.begin():
+                if forward:
+                    if not fake:
+                        self._throttle_wait()
+                        self.migrator.forward(
+                            target_plan,
+                            self.args,
+                            progress=self._progress_reporter(target_plan, operator),
+                            checkpoint=self._checkpoint(
+                                dao, target_plan, Direction.FORWARD
+                            ),
+                            throttle=self.throttle,
+                        )
+                    applied.add(target_plan.sig())
+                    dao.update_succ(
+                        target_plan,
+                        operator=operator,
+                        fake=fake,
+                        chain_checksum=applied.get_chain_checksum(),
+                    )
+                else:
+                    if not fake:
+                        self._throttle_wait()
+                        self.migrator.backward(
+                            target_plan,
+                            self.args,
+                            progress=self._progress_reporter(target_plan, operator),
+                            checkpoint=self._checkpoint(
+                                dao, target_plan, Direction.BACKWARD
+                            ),
+                            throttle=self.throttle,
+                        )
+                    dao.delete(target_plan, operator=operator, fake=fake)
+                self._set_versioned_head(dao, applied)
+                dao.commit()
 
     def print_dry_run(self, plans: List[mp.MigrationPlan], is_migrate: bool):
         new_plans = plans if is_migrate else reversed(plans)
@@ -134,71 +280,349 @@ class CLI:
         )
 
     def _migrate_versioned(
-        self, ver: str, name: str, fake: bool, dry_run: bool, operator: str = ""
+        self,
+        ver: str,
+        name: str,
+        fake: bool,
+        dry_run: bool,
+        operator: str = "",
+        verify_history: bool = False,
     ) -> Tuple[List[mp.MigrationPlan], List[mp.MigrationPlan]]:
         """
         Apply versioned migration plans
         return applied plans, to execute plans
         """
         dao = self.build_dao()
+        if not verify_history and self._is_versioned_up_to_date(dao):
+            logger.info("Versioned migrations are up to date")
+            return self.mpm.get_plans()[:], []
         applied_plans: List[mp.MigrationPlan] = []
+        parallelism = cli_env.VERSIONED_PARALLELISM
         with dao.session.begin():
             versioned_migration_histories = (
                 self._get_and_check_versioned_migration_histories()
             )
-            len_applied_versioned = len(versioned_migration_histories)
-            applied_plans = self.mpm.get_plans()[:len_applied_versioned]
+            applied = self.mpm.applied_plans(
+                mp.MigrationSignature(version=hist.ver, name=hist.name)
+                for hist in versioned_migration_histories
+            )
+            applied_plans = [p for p in self.mpm.get_plans() if p.sig() in applied]
 
             # versioned migration has been applied
-            if len_applied_versioned == self.mpm.count():
+            if len(applied_plans) == self.mpm.count():
                 return applied_plans, []
-            # create new migration history if needed
-            next_plan_index = len_applied_versioned
+            # the plans not applied yet up to the target, they are not always
+            # the last plans after a concurrent migration
             if ver is None:
-                new_plans = self.mpm.must_get_plan_between(next_plan_index, None)
+                target_plans = self.mpm.get_plans()
             else:
-                new_plans = self.mpm.must_get_plan_between(
-                    next_plan_index,
-                    mp.MigrationSignature(version=ver, name=name),
+                target_plans = self.mpm.must_get_plan_between(
+                    0, mp.MigrationSignature(version=ver, name=name)
                 )
+            new_plans = [p for p in target_plans if p.sig() not in applied]
             if len(new_plans) > 0:
                 if dry_run:
                     return applied_plans, new_plans
-                dao.add_one(new_plans[0], operator=operator, fake=fake)
-                dao.commit()
+                # create new migration history if needed
+                if parallelism <= 1:
+                    dao.add_one(new_plans[0], operator=operator, fake=fake)
+                    dao.commit()
 
         dry_run_plans = new_plans[:]
-        while len(new_plans) > 0:
-            # migrate operation
-            if not fake:
-                self.migrator.forward(new_plans[0], self.args)
-            # update migration history and create new migration history if needed
-            with dao.session.begin():
-                latest_hist = dao.get_latest_versioned()
-                if latest_hist is None:
-                    raise Exception("Latest migration history not found")
-                if not latest_hist.can_match(
-                    new_plans[0].version, new_plans[0].name, new_plans[0].get_checksum()
-                ):
-                    raise Exception(
-                        f"Unexpected migration history, version={latest_hist.ver},"
-                        f" name={latest_hist.name}, checksum={latest_hist.checksum}"
-                    )
-                if latest_hist.state != model.MigrationState.PROCESSING:
-                    raise Exception(
-                        "Unexpected migration history state,"
-                        f" version={latest_hist.ver}, name={latest_hist.name},"
-                        f" state={latest_hist.state}"
+        if parallelism > 1 and len(new_plans) > 0:
+            self._migrate_versioned_parallel(
+                dao, new_plans, applied, applied_plans, parallelism, fake, operator
+            )
+            return applied_plans, dry_run_plans
+
+        fused = bool(cli_env.FUSED_SQL_MIGRATION) and not fake
+        with self._prefetching(dry_run_plans, fake) as prefetcher:
+            while len(new_plans) > 0:
+                if prefetcher is not None:
+                    prefetcher.ready(len(dry_run_plans) - len(new_plans))
+                fused_statements = (
+                    self.migrator.get_fusable_statements(new_plans[0])
+                    if fused
+                    else None
+                )
+                if not fake:
+                    self._throttle_wait()
+                # migrate operation
+                if not fake and fused_statements is None:
+                    self.migrator.forward(
+                        new_plans[0],
+                        self.args,
+                        progress=self._progress_reporter(new_plans[0], operator),
+                        checkpoint=self._checkpoint(
+                            dao, new_plans[0], Direction.FORWARD
+                        ),
+                        throttle=self.throttle,
                     )
-                dao.update_succ(new_plans[0], operator=operator, fake=fake)
-                applied_plans.append(new_plans[0])
-                new_plans = new_plans[1:]
-                if len(new_plans) > 0:
-                    dao.add_one(new_plans[0], operator=operator, fake=fake)
-                dao.commit()
+                # update migration history and create new migration history if needed
+                with dao.session.begin():
+                    batch_size = 0
+                    while True:
+                        if fused_statements is not None:
+                            # the data change commits with its migration history
+                            self.migrator.migrate_data_sql_in_session(
+                                new_plans[0], fused_statements, dao.session
+                            )
+                        self._finish_versioned_plan(
+                            dao,
+                            new_plans[0],
+                            new_plans[1] if len(new_plans) > 1 else None,
+                            applied=applied,
+                            operator=operator,
+                            fake=fake,
+                        )
+                        applied_plans.append(new_plans[0])
+                        new_plans = new_plans[1:]
+                        batch_size += 1
+                        if (
+                            fused_statements is None
+                            or len(new_plans) == 0
+                            or batch_size >= cli_env.FUSED_SQL_BATCH_LIMIT
+                        ):
+                            break
+                        fused_statements = self.migrator.get_fusable_statements(
+                            new_plans[0]
+                        )
+                        if fused_statements is None:
+                            break
+                    dao.commit()
 
         return applied_plans, dry_run_plans
 
+    def _migrate_versioned_parallel(
+        self,
+        dao: hist_dao.MigrationHistoryDAO,
+        plans: List[mp.MigrationPlan],
+        applied: mp.AppliedPlans,
+        applied_plans: List[mp.MigrationPlan],
+        parallelism: int,
+        fake: bool,
+        operator: str = "",
+    ):
+        """
+        Execute the versioned plans by a pool of workers, a plan is started
+        once all its dependencies are applied, in plan order. A schema plan
+        runs alone, since it applies a snapshot of the whole schema.
+        The histories are written by this thread only, a history is finished
+        when its plan completes, so applied_seq records the completion order.
+        After a failure no more plans are started, and the error of the first
+        failed plan is raised once the running plans are finished.
+        """
+
+        def run(
+            plan: mp.MigrationPlan, checkpoint: Optional[ProgressCheckpoint]
+        ) -> float:
+            began = time.monotonic()
+            if not fake:
+                self.migrator.forward(
+                    plan,
+                    self.args,
+                    progress=self._progress_reporter(plan, operator),
+                    checkpoint=checkpoint,
+                    throttle=self.throttle,
+                )
+            return time.monotonic() - began
+
+        pending = plans[:]
+        running: Dict[Future, mp.MigrationPlan] = {}
+        # signature -> (state, elapsed seconds)
+        results: Dict[mp.MigrationSignature, Tuple[str, Optional[float]]] = {}
+        errors: Dict[mp.MigrationSignature, Exception] = {}
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            while len(pending) > 0 or len(running) > 0:
+                for plan in pending[:] if len(errors) == 0 else []:
+                    if len(running) >= parallelism or any(
+                        p.type == mp.Type.SCHEMA for p in running.values()
+                    ):
+                        break
+                    if any(dep not in applied for dep in plan.dependencies):
+                        continue
+                    if plan.type == mp.Type.SCHEMA and len(running) > 0:
+                        # the later plans wait for the schema plan as well
+                        break
+                    if not fake:
+                        self._throttle_wait()
+                    with dao.session.begin():
+                        dao.add_one(plan, operator=operator, fake=fake)
+                        dao.commit()
+                    checkpoint = self._checkpoint(dao, plan, Direction.FORWARD)
+                    pending.remove(plan)
+                    running[pool.submit(run, plan, checkpoint)] = plan
+                if len(running) == 0:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                # the plans completed together are finished in plan order
+                for future in sorted(done, key=lambda f: plans.index(running[f])):
+                    plan = running.pop(future)
+                    try:
+                        elapsed = future.result()
+                    except Exception as e:
+                        logger.error("Versioned migration %s failed: %s", plan, e)
+                        results[plan.sig()] = ("failed", None)
+                        errors[plan.sig()] = e
+                        continue
+                    with dao.session.begin():
+                        self._finish_versioned_plan(
+                            dao,
+                            plan,
+                            None,
+                            applied=applied,
+                            operator=operator,
+                            fake=fake,
+                        )
+                        dao.commit()
+                    applied_plans.append(plan)
+                    results[plan.sig()] = ("successful", elapsed)
+
+        logger.info(
+            "Versioned migrations, parallelism=%d:\n%s",
+            parallelism,
+            tabulate(
+                [
+                    [
+                        p.version,
+                        p.name,
+                        p.type,
+                        results.get(p.sig(), ("skipped", None))[0],
+                        (
+                            f"{results[p.sig()][1]:.1f}s"
+                            if p.sig() in results and results[p.sig()][1] is not None
+                            else None
+                        ),
+                    ]
+                    for p in plans
+                ],
+                headers=["ver", "name", "type", "state", "elapsed"],
+                tablefmt="orgtbl",
+            ),
+        )
+        for plan in plans:
+            if plan.sig() in errors:
+                raise errors[plan.sig()]
+        if len(pending) > 0:
+            raise Exception(
+                f"Cannot migrate {pending[0]}, its dependencies are not applied"
+            )
+
+    def _finish_versioned_plan(
+        self,
+        dao: hist_dao.MigrationHistoryDAO,
+        plan: mp.MigrationPlan,
+        next_plan: Optional[mp.MigrationPlan],
+        applied: Optional[mp.AppliedPlans] = None,
+        operator: str = "",
+        fake: bool = False,
+    ):
+        """
+        Mark the plan as successful and create the history of the next plan.
+        The plan is added to applied, the signatures of the applied plans,
+        which are the plans before it if not given.
+        Must be called inside a transaction.
+        """
+        if not dao.batched:
+            # in batched mode the update is guarded by the state instead
+            hist = dao.get_by_sig(plan.sig())
+            if hist is None:
+                raise Exception(
+                    f"Migration history not found, version={plan.version},"
+                    f" name={plan.name}"
+                )
+            if not hist.can_match(plan.version, plan.name, plan.get_checksum()):
+                raise Exception(
+                    f"Unexpected migration history, version={hist.ver},"
+                    f" name={hist.name}, checksum={hist.checksum}"
+                )
+            if hist.state != model.MigrationState.PROCESSING:
+                raise Exception(
+                    "Unexpected migration history state,"
+                    f" version={hist.ver}, name={hist.name}, state={hist.state}"
+                )
+        if applied is None:
+            applied = mp.AppliedPlans(
+                self.mpm, prefix=self.mpm.get_plan_index(plan.sig())
+            )
+        applied.add(plan.sig())
+        dao.update_succ(
+            plan,
+            operator=operator,
+            fake=fake,
+            from_state=model.MigrationState.PROCESSING,
+            chain_checksum=applied.get_chain_checksum(),
+        )
+        self._set_versioned_head(dao, applied)
+        if next_plan is not None:
+            dao.add_one(next_plan, operator=operator, fake=fake)
+
+    def _checkpoint(
+        self,
+        dao: hist_dao.MigrationHistoryDAO,
+        plan: mp.MigrationPlan,
+        direction: Direction,
+    ) -> Optional[ProgressCheckpoint]:
+        """
+        The checkpoint of the long running data migrations, which commit
+        their progress, return None for the others
+        """
+        change = (
+            plan.change.forward
+            if direction == Direction.FORWARD
+            else plan.change.backward
+        )
+        if change is None or change.type not in [
+            mp.DataChangeType.SQL_FILE,
+            mp.DataChangeType.SQL_CHUNKED,
+            mp.DataChangeType.BULK_LOAD,
+        ]:
+            return None
+        # fix executes the migration inside the transaction of the history
+        with nullcontext() if dao.session.in_transaction() else dao.session.begin():
+            hist_id = dao.get_hist_id(plan)
+        return ProgressCheckpoint(hist_id, plan.get_checksum(), direction)
+
+    def _progress_reporter(
+        self, plan: mp.MigrationPlan, operator: str
+    ) -> Callable[[Dict], None]:
+        """
+        Record the progress of a long running migration in the history log,
+        by its own session, since the migration may run inside the transaction
+        of the migration history
+        """
+
+        def report(progress: Dict) -> None:
+            dao = hist_dao.MigrationHistoryDAO(
+                helper.build_session_from_env(
+                    self.args.environment, echo=cli_env.ALLOW_ECHO_SQL
+                ),
+                lock=self.lock,
+            )
+            try:
+                with dao.session.begin():
+                    dao.add_progress_log(plan, progress, operator=operator)
+                    dao.commit()
+            finally:
+                dao.session.close()
+
+        return report
+
+    def _set_versioned_head(
+        self,
+        dao: hist_dao.MigrationHistoryDAO,
+        applied: mp.AppliedPlans,
+    ):
+        dao.set_versioned_head(len(applied), applied.get_chain_checksum())
+
+    def _is_versioned_up_to_date(self, dao: hist_dao.MigrationHistoryDAO) -> bool:
+        """
+        Compare the versioned head with the plans by one read,
+        instead of checking all the histories
+        """
+        count = self.mpm.count()
+        return dao.get_versioned_head() == (count, self.mpm.get_chain_checksum(count))
+
     def migrate(self):
         ver = (
             self.args.version.zfill(4)
@@ -209,6 +633,9 @@ class CLI:
         fake = self.args.fake if "fake" in self.args else False
         dry_run = self.args.dry_run if "dry_run" in self.args else False
         operator = self.args.operator if "operator" in self.args else ""
+        verify_history = (
+            self.args.verify_history if "verify_history" in self.args else False
+        )
 
         if dry_run:
             logger.info("Running in dry run mode, no migration will be executed")
@@ -220,14 +647,26 @@ class CLI:
             f"Migrate options: ver={ver}, name={name}, fake={fake}, dry_run={dry_run}"
         )
 
-        # versioned migration
-        (applied_plans, dry_run_plans) = self._migrate_versioned(
-            ver, name, fake, dry_run, operator=operator
-        )
-        # repeatable migration
-        dry_run_repeatable_plans = self._migrate_repeatable(
-            applied_plans, ver, name, fake, dry_run, operator=operator
-        )
+        # dry run only reads the histories, no need to lock
+        with (
+            nullcontext() if dry_run else self._migration_lock(),
+            self._throttled(),
+            self.migrator.typescript_worker(),
+            self.migrator.python_workers(),
+        ):
+            # versioned migration
+            (applied_plans, dry_run_plans) = self._migrate_versioned(
+                ver,
+                name,
+                fake,
+                dry_run,
+                operator=operator,
+                verify_history=verify_history,
+            )
+            # repeatable migration
+            dry_run_repeatable_plans = self._migrate_repeatable(
+                applied_plans, ver, name, fake, dry_run, operator=operator
+            )
 
         if dry_run:
             logger.info("Migration plans to execute:")
@@ -256,60 +695,181 @@ class CLI:
                 )
             else:
                 applied_plans = self.mpm.get_plans()
-            to_execute_plans = self._get_to_execute_repeatable_plans(applied_plans)
+            to_execute_plans = self._get_to_execute_repeatable_plans(
+                applied_plans, self.dao.get_all_by_sig_dto()
+            )
             return to_execute_plans
 
-        to_execute_plans = self._get_to_execute_repeatable_plans(applied_histories)
+        # the histories can't be changed by others while holding the lock
+        histories = self.dao.get_all_by_sig_dto()
+        to_execute_plans = self._get_to_execute_repeatable_plans(
+            applied_histories, histories
+        )
         if len(to_execute_plans) == 0:
             logger.debug("No valid repeatable migration to execute")
             return []
 
-        dao = self.dao
-        for plan in to_execute_plans:
-            # try get the migration history
-            with dao.session.begin():
-                hist = dao.get_by_sig(plan.sig())
-                if hist is None:
-                    dao.add_one(plan, operator=operator, fake=fake)
-                else:
-                    # no need to check if state is SUCCESSFUL,
-                    #   because it is repeatable migration
-                    # just treat updating PROCESSING to PROCESSING
-                    #   as retry the migration
-                    dao.update_processing(plan, operator=operator, fake=fake)
-                dao.commit()
-            # execute the migration
-            self.migrator.forward(plan, self.args)
+        parallelism = cli_env.REPEATABLE_PARALLELISM
+        if parallelism > 1 and len(to_execute_plans) > 1:
+            self._migrate_repeatable_parallel(
+                to_execute_plans, histories, parallelism, fake, operator=operator
+            )
+            return to_execute_plans
 
-            with dao.session.begin():
-                dao.update_succ(plan, operator=operator, fake=fake)
-                dao.commit()
+        for plan in to_execute_plans:
+            self._execute_repeatable_plan(
+                self.dao, plan, histories, fake, operator=operator
+            )
         return to_execute_plans
 
+    def _execute_repeatable_plan(
+        self,
+        dao: hist_dao.MigrationHistoryDAO,
+        plan: mp.MigrationPlan,
+        histories: Dict[mp.MigrationSignature, model.MigrationHistoryDTO],
+        fake: bool,
+        operator: str = "",
+    ):
+        with dao.session.begin():
+            if plan.sig() not in histories:
+                dao.add_one(plan, operator=operator, fake=fake)
+            else:
+                # no need to check if state is SUCCESSFUL,
+                #   because it is repeatable migration
+                # just treat updating PROCESSING to PROCESSING
+                #   as retry the migration
+                if histories[plan.sig()].state == model.MigrationState.SUCCESSFUL:
+                    # a new run, not a retry
+                    dao.clear_progress(plan)
+                dao.update_processing(plan, operator=operator, fake=fake)
+            dao.commit()
+        # execute the migration
+        self._throttle_wait()
+        self.migrator.forward(
+            plan,
+            self.args,
+            progress=self._progress_reporter(plan, operator),
+            checkpoint=self._checkpoint(dao, plan, Direction.FORWARD),
+            throttle=self.throttle,
+        )
+
+        with dao.session.begin():
+            dao.update_succ(plan, operator=operator, fake=fake)
+            dao.commit()
+
+    def _migrate_repeatable_parallel(
+        self,
+        plans: List[mp.MigrationPlan],
+        histories: Dict[mp.MigrationSignature, model.MigrationHistoryDTO],
+        parallelism: int,
+        fake: bool,
+        operator: str = "",
+    ):
+        """
+        Execute the repeatable plans by a pool of workers, each worker has its
+        own session. The plans are started in order, a plan waits for the
+        running and the earlier plans sharing any of its tags.
+        After a failure no more plans are started, and the error of the first
+        failed plan is raised once the running plans are finished.
+        """
+
+        def run(plan: mp.MigrationPlan) -> float:
+            began = time.monotonic()
+            dao = self._make_dao()
+            try:
+                self._execute_repeatable_plan(
+                    dao, plan, histories, fake, operator=operator
+                )
+            finally:
+                dao.session.close()
+            return time.monotonic() - began
+
+        pending = plans[:]
+        running: Dict[Future, mp.MigrationPlan] = {}
+        # signature -> (state, elapsed seconds)
+        results: Dict[mp.MigrationSignature, Tuple[str, Optional[float]]] = {}
+        errors: Dict[mp.MigrationSignature, Exception] = {}
+        with ThreadPoolExecutor(max_workers=parallelism) as pool:
+            while len(pending) > 0 or len(running) > 0:
+                if len(errors) > 0:
+                    for plan in pending:
+                        results[plan.sig()] = ("skipped", None)
+                    pending = []
+                busy_tags: Set[str] = set()
+                for plan in running.values():
+                    busy_tags.update(plan.tags or [])
+                for plan in pending[:]:
+                    if len(running) >= parallelism:
+                        break
+                    tags = set(plan.tags or [])
+                    if len(tags & busy_tags) == 0:
+                        pending.remove(plan)
+                        running[pool.submit(run, plan)] = plan
+                    # the later plans sharing a tag wait for this one
+                    busy_tags.update(tags)
+                if len(running) == 0:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    plan = running.pop(future)
+                    try:
+                        results[plan.sig()] = ("successful", future.result())
+                    except Exception as e:
+                        logger.error("Repeatable migration %s failed: %s", plan, e)
+                        results[plan.sig()] = ("failed", None)
+                        errors[plan.sig()] = e
+
+        logger.info(
+            "Repeatable migrations, parallelism=%d:\n%s",
+            parallelism,
+            tabulate(
+                [
+                    [
+                        p.name,
+                        ",".join(p.tags or []),
+                        results[p.sig()][0],
+                        (
+                            f"{results[p.sig()][1]:.1f}s"
+                            if results[p.sig()][1] is not None
+                            else None
+                        ),
+                    ]
+                    for p in plans
+                ],
+                headers=["name", "tags", "state", "elapsed"],
+                tablefmt="orgtbl",
+            ),
+        )
+        for plan in plans:
+            if plan.sig() in errors:
+                raise errors[plan.sig()]
+
     def _get_to_execute_repeatable_plans(
-        self, applied_plans: List[mp.MigrationPlan]
+        self,
+        applied_plans: List[mp.MigrationPlan],
+        histories: Dict[mp.MigrationSignature, model.MigrationHistoryDTO],
     ) -> List[mp.MigrationPlan]:
         # get repeatable migration plans
         plans = self.mpm.get_repeatable_plans()
+        applied_sigs = {ap.sig() for ap in applied_plans}
         # check if repeatable migration can be executed
         to_execute_plans: List[mp.MigrationPlan] = []
         for p in plans:
-            if p.dependencies is not None and len(p.dependencies) > 0:
-                dep_sig = p.dependencies[0]
-                # check if dep_sig is in applied_histories
-                if not any(ap.match(dep_sig) for ap in applied_plans):
-                    logger.warning(
-                        "repeatable migration %s is not executed because dependency %s"
-                        " is not applied",
-                        p,
-                        dep_sig,
-                    )
-                    continue
+            # every dependency must be applied
+            not_applied = [d for d in p.dependencies or [] if d not in applied_sigs]
+            if len(not_applied) > 0:
+                logger.warning(
+                    "repeatable migration %s is not executed because dependency %s"
+                    " is not applied",
+                    p,
+                    ", ".join(str(d) for d in not_applied),
+                )
+                continue
 
             if p.ignore_after is not None:
                 ignore_sig = p.ignore_after
                 # check if ignore_sig is in applied_histories
-                if any(ap.match(ignore_sig) for ap in applied_plans):
+                if ignore_sig in applied_sigs:
                     logger.debug(
                         "Repeatable migration %s is not executed because ignore_after"
                         " %s is applied",
@@ -318,7 +878,7 @@ class CLI:
                     )
                     continue
 
-            hist_dto = self.dao.get_by_sig_dto(p.sig())
+            hist_dto = histories.get(p.sig())
             if (
                 hist_dto is not None
                 and hist_dto.checksum == p.get_checksum()
@@ -348,6 +908,7 @@ class CLI:
         self,
         to_rollback_plan: mp.MigrationPlan,
         inverse_dependencies: Dict[mp.MigrationSignature, List[mp.MigrationSignature]],
+        histories: Dict[mp.MigrationSignature, model.MigrationHistoryDTO],
         fake: bool = False,
         operator: str = "",
     ):
@@ -356,22 +917,29 @@ class CLI:
         dao = self.dao
         for sig in inverse_dependencies[to_rollback_plan.sig()]:
             plan = self.mpm.must_get_repeatable_plan_by_signature(sig)
+            if sig not in histories:
+                logger.debug(f"Migration history not found, so skip rollback {sig}")
+                continue
             with dao.session.begin():
-                hist = dao.get_by_sig(sig)
-                if hist is None:
-                    logger.debug(f"Migration history not found, so skip rollback {sig}")
-                    continue
                 # no need to check if state is SUCCESSFUL,
                 #   because it is repeatable migration
                 dao.update_rollback(plan, operator=operator, fake=fake)
                 dao.commit()
             # execute the migration
             if not fake:
-                self.migrator.backward(plan, self.args)
+                self._throttle_wait()
+                self.migrator.backward(
+                    plan,
+                    self.args,
+                    progress=self._progress_reporter(plan, operator),
+                    checkpoint=self._checkpoint(dao, plan, Direction.BACKWARD),
+                    throttle=self.throttle,
+                )
 
             with dao.session.begin():
                 dao.delete(plan, operator=operator, fake=fake)
                 dao.commit()
+            del histories[sig]
 
     def rollback(self):
         self.read_migration_plans()
@@ -385,33 +953,63 @@ class CLI:
             mp.MigrationSignature(ver, name)
         )
 
+        # dry run only reads the histories, no need to lock
+        with (
+            nullcontext() if dry_run else self._migration_lock(),
+            self._throttled(),
+            self.migrator.typescript_worker(),
+            self.migrator.python_workers(),
+        ):
+            self._rollback(
+                target_migration_plan_index, fake, dry_run, operator=operator
+            )
+
+    def _rollback(
+        self,
+        target_migration_plan_index: int,
+        fake: bool,
+        dry_run: bool,
+        operator: str = "",
+    ):
         dao = self.build_dao()
+        # the histories can't be changed by others while holding the lock
+        histories = dao.get_all_by_sig_dto()
         with dao.session.begin():
             migration_histories = self._get_and_check_versioned_migration_histories()
 
-            latest_migration_plan_index = len(migration_histories) - 1
-
-            if target_migration_plan_index > latest_migration_plan_index:
+            plan_index = {p.sig(): i for i, p in enumerate(self.mpm.get_plans())}
+            applied = self.mpm.applied_plans(
+                mp.MigrationSignature(version=hist.ver, name=hist.name)
+                for hist in migration_histories
+            )
+            target_plan = self.mpm.get_plan_by_index(target_migration_plan_index)
+            if target_plan.sig() not in applied:
                 raise Exception("Target migration plan is not applied yet")
-            elif target_migration_plan_index == latest_migration_plan_index:
-                return
 
-            to_rollback_versioned_plans = self.mpm.must_get_plan_between(
-                target_migration_plan_index + 1, latest_migration_plan_index
-            )
+            # the applied plans after the target in completion order,
+            # which are rolled back in reverse order, a reverse topological order
+            to_rollback_versioned_plans = [
+                self.mpm.get_plan_by_index(plan_index[sig])
+                for sig in (
+                    mp.MigrationSignature(version=hist.ver, name=hist.name)
+                    for hist in migration_histories
+                )
+                if plan_index[sig] > target_migration_plan_index
+            ]
+            if len(to_rollback_versioned_plans) == 0:
+                return
 
             # get repeatable migration plans to rollback
             to_rollback_plans_dry_run_print: List[mp.MigrationPlan] = []
             inverse_dependencies = self.mpm.get_repeatable_plan_inverse_dependencies()
             for trp in to_rollback_versioned_plans:
                 to_rollback_plans_dry_run_print.append(trp)
-                if trp.sig() in inverse_dependencies:
+                for sig in inverse_dependencies.get(trp.sig(), []):
                     # check if the repeatable migration has been applied
-                    if dao.get_by_sig(trp.sig()) is not None:
-                        for sig in inverse_dependencies[trp.sig()]:
-                            to_rollback_plans_dry_run_print.append(
-                                self.mpm.must_get_repeatable_plan_by_signature(sig)
-                            )
+                    if sig in histories:
+                        to_rollback_plans_dry_run_print.append(
+                            self.mpm.must_get_repeatable_plan_by_signature(sig)
+                        )
 
             if len(to_rollback_versioned_plans) > 0:
                 if dry_run:
@@ -423,8 +1021,13 @@ class CLI:
                     return
 
                 dao.update_rollback(
-                    to_rollback_versioned_plans[-1], operator=operator, fake=fake
+                    to_rollback_versioned_plans[-1],
+                    operator=operator,
+                    fake=fake,
+                    from_state=model.MigrationState.SUCCESSFUL,
                 )
+                applied.discard(to_rollback_versioned_plans[-1].sig())
+                self._set_versioned_head(dao, applied)
                 dao.commit()
 
         while len(to_rollback_versioned_plans) > 0:
@@ -433,41 +1036,68 @@ class CLI:
             self._rollback_repeatable_migration(
                 to_rollback_versioned_plans[-1],
                 inverse_dependencies,
+                histories,
                 fake=fake,
                 operator=operator,
             )
 
             # rollback operation
             if not fake:
-                self.migrator.backward(to_rollback_versioned_plans[-1], self.args)
+                self._throttle_wait()
+                self.migrator.backward(
+                    to_rollback_versioned_plans[-1],
+                    self.args,
+                    progress=self._progress_reporter(
+                        to_rollback_versioned_plans[-1], operator
+                    ),
+                    checkpoint=self._checkpoint(
+                        dao, to_rollback_versioned_plans[-1], Direction.BACKWARD
+                    ),
+                    throttle=self.throttle,
+                )
 
             with dao.session.begin():
-                latest_hist = dao.get_latest_versioned()
-                if latest_hist is None:
-                    raise Exception("Latest migration history not found")
-                if not latest_hist.can_match(
-                    to_rollback_versioned_plans[-1].version,
-                    to_rollback_versioned_plans[-1].name,
-                    to_rollback_versioned_plans[-1].get_checksum(),
-                ):
-                    raise Exception(
-                        f"Unexpected migration history, version={latest_hist.ver},"
-                        f" name={latest_hist.name}, checksum={latest_hist.checksum}"
-                    )
-                if latest_hist.state != model.MigrationState.ROLLBACKING:
-                    raise Exception(
-                        "Unexpected migration history state,"
-                        f" version={latest_hist.ver}, name={latest_hist.name},"
-                        f" state={latest_hist.state}"
-                    )
+                if not dao.batched:
+                    # in batched mode the delete is guarded by the state instead
+                    hist = dao.get_by_sig(to_rollback_versioned_plans[-1].sig())
+                    if hist is None:
+                        raise Exception(
+                            "Migration history not found,"
+                            f" version={to_rollback_versioned_plans[-1].version},"
+                            f" name={to_rollback_versioned_plans[-1].name}"
+                        )
+                    if not hist.can_match(
+                        to_rollback_versioned_plans[-1].version,
+                        to_rollback_versioned_plans[-1].name,
+                        to_rollback_versioned_plans[-1].get_checksum(),
+                    ):
+                        raise Exception(
+                            "Unexpected migration history,"
+                            f" version={hist.ver}, name={hist.name},"
+                            f" checksum={hist.checksum}"
+                        )
+                    if hist.state != model.MigrationState.ROLLBACKING:
+                        raise Exception(
+                            "Unexpected migration history state,"
+                            f" version={hist.ver}, name={hist.name},"
+                            f" state={hist.state}"
+                        )
                 dao.delete(
-                    to_rollback_versioned_plans[-1], operator=operator, fake=fake
+                    to_rollback_versioned_plans[-1],
+                    operator=operator,
+                    fake=fake,
+                    from_state=model.MigrationState.ROLLBACKING,
                 )
                 to_rollback_versioned_plans = to_rollback_versioned_plans[:-1]
                 if len(to_rollback_versioned_plans) > 0:
                     dao.update_rollback(
-                        to_rollback_versioned_plans[-1], operator=operator, fake=fake
+                        to_rollback_versioned_plans[-1],
+                        operator=operator,
+                        fake=fake,
+                        from_state=model.MigrationState.SUCCESSFUL,
                     )
+                    applied.discard(to_rollback_versioned_plans[-1].sig())
+                    self._set_versioned_head(dao, applied)
                 dao.commit()
 
     def _clear(self):
@@ -486,6 +1116,8 @@ class CLI:
                 dao.session.execute(text(f"drop table `{table_name}`;"))
             dao.session.execute(text("SET FOREIGN_KEY_CHECKS=1;"))
             dao.commit()
+        # the bookkeeping tables are dropped as well
+        db.forget_bootstrap(dao.session.bind)
         logger.warning("Database cleared")
 
     def read_migration_plans(self) -> mp.MigrationPlanManager:
@@ -512,6 +1144,7 @@ class CLI:
                 cli_env.TABLE_MIGRATION_HISTORY,
             ]
         )
+        helper.refresh_env_configs()
 
     def _init_migration_plan_dir(self):
         os.makedirs(
@@ -538,6 +1171,7 @@ class CLI:
                 cli_env.TABLE_MIGRATION_HISTORY,
             ]
         )
+        helper.refresh_env_configs()
 
     def _init_schema_store_dir(self):
         os.makedirs(
@@ -679,6 +1313,22 @@ class CLI:
             case mp.DataChangeType.TYPESCRIPT:
                 next_plan.change.forward.file = "your_typescript_file.ts"
                 logger.info("Sample typescript file:\n%s", cli_env.SAMPLE_MIGRATION_TS)
+            case mp.DataChangeType.SQL_CHUNKED:
+                next_plan.change.forward.sql = (
+                    "UPDATE `testtable` SET `name` = 'foo.bar' WHERE `id` >= :start"
+                    " AND `id` < :end;"
+                )
+                next_plan.change.forward.chunk = mp.ChunkConfig(
+                    table="testtable", key="id"
+                )
+            case mp.DataChangeType.BULK_LOAD:
+                next_plan.change.forward.file = "your_data_file.csv"
+                next_plan.change.forward.load = mp.LoadConfig(table="testtable")
+            case mp.DataChangeType.SYNC:
+                next_plan.change.forward.file = "your_data_file.csv"
+                next_plan.change.forward.load = mp.LoadConfig(
+                    table="testtable", key="id"
+                )
 
         return next_plan.save()
 
@@ -726,6 +1376,28 @@ class CLI:
             case mp.DataChangeType.TYPESCRIPT:
                 next_plan.change.forward.file = "your_typescript_file.ts"
                 logger.info("Sample typescript file:\n%s", cli_env.SAMPLE_MIGRATION_TS)
+            case mp.DataChangeType.SQL_CHUNKED:
+                next_plan.change.forward.sql = (
+                    "UPDATE `testtable` SET `name` = 'foo.bar' WHERE `id` >= :start"
+                    " AND `id` < :end;"
+                )
+                next_plan.change.forward.chunk = mp.ChunkConfig(
+                    table="testtable", key="id"
+                )
+            case mp.DataChangeType.BULK_LOAD:
+                next_plan.change.forward.file = "your_data_file.csv"
+                next_plan.change.forward.load = mp.LoadConfig(table="testtable")
+            case mp.DataChangeType.SYNC:
+                next_plan.change.forward.file = "your_data_file.csv"
+                next_plan.change.forward.load = mp.LoadConfig(
+                    table="testtable", key="id"
+                )
+                # delete the loaded rows by key
+                next_plan.change.backward = mp.DataBackward(
+                    type=mp.DataChangeType.BULK_LOAD,
+                    file="your_data_file.csv",
+                    load=mp.LoadConfig(table="testtable", key="id"),
+                )
 
         return next_plan.save()
 
@@ -777,7 +1449,11 @@ class CLI:
 
     def skeema(self, raw_args: List[str], cwd: str = cli_env.SDM_SCHEMA_DIR):
         # https://stackoverflow.com/questions/39872088/executing-interactive-shell-script-in-python
-        return helper.call_skeema(raw_args, cwd)
+        try:
+            return helper.call_skeema(raw_args, cwd)
+        finally:
+            # e.g. skeema add-environment writes the env ini file
+            helper.refresh_env_configs()
 
     def _print_info_as_table(
         self, prompt: str, output: List[List[str]], headers: List[str]
@@ -847,15 +1523,22 @@ class CLI:
         self.read_migration_plans()
         argtype = self._get_diff_type(env_or_version)
         if argtype == mp.DiffItemType.ENVIRONMENT:
-            self.skeema(["pull", env_or_version])
+            self._pull_environment(env_or_version, cli_env.SDM_SCHEMA_DIR)
             return
         if argtype == mp.DiffItemType.VERSION:
             schema_dir_path = os.path.join(cli_env.MIGRATION_CWD, cli_env.SCHEMA_DIR)
-            schema_dir_files = helper.files_under_dir(schema_dir_path, ".sql")
 
-            with tempfile.TemporaryDirectory() as temp_dir:
+            with (
+                tempfile.TemporaryDirectory() as temp_dir,
+                ThreadPoolExecutor(max_workers=1) as executor,
+            ):
+                # read the schema dir while copying the version from the store
+                schema_dir_future = executor.submit(
+                    helper.files_under_dir, schema_dir_path, ".sql"
+                )
                 self.dump_schema(env_or_version, argtype, temp_dir, mkdir=False)
                 ver_files = helper.files_under_dir(temp_dir, ".sql")
+                schema_dir_files = schema_dir_future.result()
 
                 # move file under temp_dir to schema dir
                 for filename, filepath in ver_files.items():
@@ -880,38 +1563,94 @@ class CLI:
         left = self.args.left
         right = self.args.right
         verbose = self.args.verbose if "verbose" in self.args else False
+        output_format = (
+            self.args.format
+            if "format" in self.args and self.args.format is not None
+            else "text"
+        )
         if left == right:
             return
         self.read_migration_plans()
-        left_type = self._get_diff_type(left)
-        right_type = self._get_diff_type(right)
+        sides = {
+            "left": (left, self._get_diff_type(left)),
+            "right": (right, self._get_diff_type(right)),
+        }
 
         with tempfile.TemporaryDirectory() as temp_dir:
-            left_dump_dir_path = os.path.join(temp_dir, "left")
-            right_dump_dir_path = os.path.join(temp_dir, "right")
-            self.dump_schema(left, left_type, left_dump_dir_path)
-            self.dump_schema(right, right_type, right_dump_dir_path)
-
-            has_diff = False
-            if not verbose:
-                try:
-                    subprocess.check_call(
-                        shlex.split("diff --recursive --brief left right"),
-                        cwd=temp_dir,
-                    )
-                except subprocess.CalledProcessError:
-                    has_diff = True
-            else:
-                try:
-                    subprocess.check_call(
-                        shlex.split("diff --color -Nr -U4 left right"),
-                        cwd=temp_dir,
-                    )
-                except subprocess.CalledProcessError:
-                    has_diff = True
+            # only the environments are dumped, the versions are compared in
+            # the schema store and HEAD in the schema dir
+            dumps = {
+                side: (diff_arg, diff_type, os.path.join(temp_dir, side))
+                for side, (diff_arg, diff_type) in sides.items()
+                if diff_type == mp.DiffItemType.ENVIRONMENT
+            }
+            if len(dumps) > 0:
+                self._dump_schemas(dumps)
+            files: Dict[str, Dict[str, schema_diff.SchemaFile]] = {}
+            for side, (diff_arg, diff_type) in sides.items():
+                match diff_type:
+                    case mp.DiffItemType.VERSION:
+                        files[side] = schema_diff.files_of_index(
+                            self.read_schema_index(
+                                self._get_schema_index_sha1(diff_arg)
+                            )
+                        )
+                    case mp.DiffItemType.HEAD:
+                        files[side] = schema_diff.files_of_dir(
+                            os.path.join(cli_env.MIGRATION_CWD, cli_env.SCHEMA_DIR)
+                        )
+                    case _:
+                        files[side] = schema_diff.files_of_dir(dumps[side][2])
+            result = schema_diff.compare(
+                left,
+                files["left"],
+                right,
+                files["right"],
+                with_diff=verbose,
+            )
+
+        print(result.to_json() if output_format == "json" else result.to_text())
+        if result.has_diff():
+            raise Exception(f"Difference found between {left} and {right}")
+
+    def _dump_schemas(self, dumps: Dict[str, Tuple[str, mp.DiffItemType, str]]) -> None:
+        """
+        Dump the schemas concurrently, side -> (diff_arg, diff_type, dump dir),
+        since dumping an environment is a skeema pull which can take minutes.
+        The time of each side is reported, and the error of the first failed
+        side is raised.
+        """
 
-            if has_diff:
-                raise Exception(f"Difference found between {left} and {right}")
+        def dump(diff_arg: str, diff_type: mp.DiffItemType, path: str) -> float:
+            began = time.monotonic()
+            self.dump_schema(diff_arg, diff_type, path)
+            return time.monotonic() - began
+
+        with ThreadPoolExecutor(
+            max_workers=len(dumps), thread_name_prefix="sdm-dump"
+        ) as executor:
+            futures = {
+                side: executor.submit(dump, diff_arg, diff_type, path)
+                for side, (diff_arg, diff_type, path) in dumps.items()
+            }
+            wait(futures.values())
+        output = []
+        for side, future in futures.items():
+            diff_arg, diff_type, _ = dumps[side]
+            failed = future.exception() is not None
+            output.append(
+                [
+                    side,
+                    diff_arg,
+                    str(diff_type),
+                    "failed" if failed else f"{future.result():.2f}s",
+                ]
+            )
+        self._print_info_as_table(
+            "Dumped schemas:", output, ["side", "name", "type", "time"]
+        )
+        for future in futures.values():
+            future.result()
 
     def dump_schema(
         self,
@@ -933,37 +1672,70 @@ class CLI:
                     )
             return
         if diff_type == mp.DiffItemType.VERSION:
-            if diff_arg.isdigit():
-                diff_arg = diff_arg.zfill(4)
-                target_plan, _ = self.mpm.must_get_plan_by_signature(
-                    mp.MigrationSignature(diff_arg, None)
-                )
-            else:
-                split = diff_arg.split("_")
-                ver = split[0]
-                name = "_".join(split[1:])
-                target_plan, _ = self.mpm.must_get_plan_by_signature(
-                    mp.MigrationSignature(ver, name)
-                )
-
-            if target_plan.type != mp.Type.SCHEMA:
-                raise Exception(f"Not schema migration plan, version={diff_arg}")
-            index_sha1 = target_plan.change.forward.id
+            index_sha1 = self._get_schema_index_sha1(diff_arg)
             self.copy_schema_by_index(index_sha1, dump_dir_path)
             return
         if diff_type == mp.DiffItemType.ENVIRONMENT:
-            env_ini = helper.parse_env_ini()
             env = diff_arg
-            if not env_ini.has_section(env):
+            if env not in helper.load_env_configs():
                 raise Exception(f"Environment not found, name={env}")
             skeema_file_path = os.path.join(
                 cli_env.MIGRATION_CWD, cli_env.SCHEMA_DIR, ".skeema"
             )
             shutil.copy(skeema_file_path, dump_dir_path)
-            helper.call_skeema(["pull", env], cwd=dump_dir_path)
+            self._pull_environment(env, dump_dir_path)
             os.remove(os.path.join(dump_dir_path, ".skeema"))
             return
 
+    def _pull_environment(self, env: str, schema_dir: str) -> None:
+        """
+        skeema pull the environment into schema_dir, which has the .skeema file.
+        With SCHEMA_SNAPSHOT_CACHE, the last pulled schema of the environment is
+        reused while the fingerprint of its structure is unchanged.
+        """
+        if cli_env.SCHEMA_SNAPSHOT_CACHE <= 0:
+            helper.call_skeema(["pull", env], cwd=schema_dir)
+            return
+        engine = helper.build_engine_from_env(env)
+        skeema_file_path = os.path.join(schema_dir, ".skeema")
+        cache = SchemaSnapshotCache(
+            os.path.join(cli_env.MIGRATION_CWD, cli_env.CACHE_DIR, "schema")
+        )
+        key = snapshot_key(engine, skeema_file_path)
+        if key is None:
+            helper.call_skeema(["pull", env], cwd=schema_dir)
+            return
+        if cache.restore(env, key, schema_dir):
+            logger.info("Reused the schema snapshot of %s, key=%s", env, key)
+            return
+        helper.call_skeema(["pull", env], cwd=schema_dir)
+        # the schema may change while pulling, the snapshot is not saved then
+        if snapshot_key(engine, skeema_file_path) != key:
+            logger.info("Schema of %s changed while pulling, not cached", env)
+            return
+        cache.save(env, key, schema_dir)
+
+    def _get_schema_index_sha1(self, diff_arg: str) -> str:
+        """
+        the schema index of the version, <version> or <version>_<name>
+        """
+        if diff_arg.isdigit():
+            diff_arg = diff_arg.zfill(4)
+            target_plan, _ = self.mpm.must_get_plan_by_signature(
+                mp.MigrationSignature(diff_arg, None)
+            )
+        else:
+            split = diff_arg.split("_")
+            ver = split[0]
+            name = "_".join(split[1:])
+            target_plan, _ = self.mpm.must_get_plan_by_signature(
+                mp.MigrationSignature(ver, name)
+            )
+
+        if target_plan.type != mp.Type.SCHEMA:
+            raise Exception(f"Not schema migration plan, version={diff_arg}")
+        return target_plan.change.forward.id
+
     def _get_diff_type(self, name: str) -> mp.DiffItemType:
         if name == "HEAD":
             return mp.DiffItemType.HEAD
@@ -1058,6 +1830,58 @@ class CLI:
 
         return list(unexpected_paths)
 
+    def clean_history_log(self) -> int:
+        """
+        Move the logs older than keep_days into the archive table in batches,
+        return the number of archived logs
+        """
+        keep_days = self.args.keep_days if "keep_days" in self.args else 90
+        batch_size = self.args.batch_size if "batch_size" in self.args else 1000
+        sleep = self.args.sleep if "sleep" in self.args else 0
+        dry_run = self.args.dry_run if "dry_run" in self.args else False
+        before = datetime.datetime.utcnow() - datetime.timedelta(days=keep_days)
+
+        dao = self.build_dao()
+        if dry_run:
+            count = dao.count_logs_before(before)
+            logger.info("Found %d logs created before %s", count, before)
+            return count
+
+        total = 0
+        while True:
+            archived = dao.archive_logs(before, batch_size)
+            total += archived
+            if archived > 0:
+                logger.info("Archived %d logs, total=%d", archived, total)
+            if archived < batch_size:
+                break
+            if sleep > 0:
+                time.sleep(sleep)
+        logger.info("Archived %d logs created before %s", total, before)
+        return total
+
+    def dedup_history_snapshot(self) -> int:
+        """
+        Backfill the snapshot references of the logs written before
+        DEDUP_HISTORY_SNAPSHOT, return the number of updated logs
+        """
+        batch_size = self.args.batch_size if "batch_size" in self.args else 1000
+        sleep = self.args.sleep if "sleep" in self.args else 0
+
+        dao = self.build_dao()
+        total = 0
+        while True:
+            updated = dao.dedup_log_snapshots(batch_size)
+            total += updated
+            if updated > 0:
+                logger.info("Deduplicated %d log snapshots, total=%d", updated, total)
+            if updated < batch_size:
+                break
+            if sleep > 0:
+                time.sleep(sleep)
+        logger.info("Deduplicated %d log snapshots", total)
+        return total
+
     # This method performs a basic check on the integrity of the migration plans.
     # It reads the migration plans and checks that:
     #   - For schema migrations, the index file and linked SQL file exist.
@@ -1162,6 +1986,46 @@ class CLI:
                 if change.sql is None or change.sql == "":
                     raise err.IntegrityError(f"sql is empty, {plan}")
 
+            if change.type == mp.DataChangeType.SQL_CHUNKED:
+                if change.sql is None or change.sql == "":
+                    raise err.IntegrityError(f"sql is empty, {plan}")
+                if ":start" not in change.sql or ":end" not in change.sql:
+                    raise err.IntegrityError(
+                        f"sql of sql_chunked should contain :start and :end, {plan}"
+                    )
+                if (
+                    change.chunk is None
+                    or not change.chunk.table
+                    or not change.chunk.key
+                ):
+                    raise err.IntegrityError(
+                        f"chunk table and key are required by sql_chunked, {plan}"
+                    )
+                if change.chunk.min_chunk_size <= 0 or (
+                    change.chunk.max_chunk_size < change.chunk.min_chunk_size
+                ):
+                    raise err.IntegrityError(f"invalid chunk size, {plan}")
+
+            if change.type == mp.DataChangeType.BULK_LOAD:
+                check_data_file(change.file)
+                if change.load is None or not change.load.table:
+                    raise err.IntegrityError(f"load table is required, {plan}")
+                if change.load.batch_size <= 0:
+                    raise err.IntegrityError(f"invalid batch size, {plan}")
+                if isinstance(change, mp.DataBackward) and not change.load.key:
+                    raise err.IntegrityError(
+                        f"load key is required by the backward of bulk_load, {plan}"
+                    )
+
+            if change.type == mp.DataChangeType.SYNC:
+                check_data_file(change.file)
+                if change.load is None or not change.load.table or not change.load.key:
+                    raise err.IntegrityError(
+                        f"load table and key are required by sync, {plan}"
+                    )
+                if change.load.batch_size <= 0:
+                    raise err.IntegrityError(f"invalid batch size, {plan}")
+
             if (
                 change.type == mp.DataChangeType.SQL_FILE
                 or change.type == mp.DataChangeType.PYTHON
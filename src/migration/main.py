@@ -122,6 +122,57 @@ def parse_clean_args(parser: argparse.ArgumentParser):
         action="store_true",
         help="skip integrity check before clean",
     )
+    parse_history_log = subparsers.add_parser(
+        Command.CLEAN_HISTORY_LOG,
+        help="move old migration history logs into the archive table",
+    )
+    parse_history_log.add_argument(
+        "environment",
+        help="environment name",
+    )
+    parse_history_log.add_argument(
+        "--keep-days",
+        type=int,
+        default=90,
+        help="keep the logs created in the recent days",
+    )
+    parse_history_log.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="number of logs moved in one transaction",
+    )
+    parse_history_log.add_argument(
+        "--sleep",
+        type=float,
+        default=0,
+        help="seconds to sleep between batches",
+    )
+    parse_history_log.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="dry run mode, only count the logs to be archived",
+    )
+    parse_history_snapshot = subparsers.add_parser(
+        Command.CLEAN_HISTORY_SNAPSHOT,
+        help="move the snapshots of old migration history logs into the snapshot table",
+    )
+    parse_history_snapshot.add_argument(
+        "environment",
+        help="environment name",
+    )
+    parse_history_snapshot.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="number of logs updated in one transaction",
+    )
+    parse_history_snapshot.add_argument(
+        "--sleep",
+        type=float,
+        default=0,
+        help="seconds to sleep between batches",
+    )
 
 
 def parse_pull_args(parser: argparse.ArgumentParser):
@@ -170,7 +221,13 @@ def parse_diff_args(parser: argparse.ArgumentParser):
         "-v",
         "--verbose",
         action="store_true",
-        help="verbose",
+        help="verbose, show the unified diff of each changed file",
+    )
+    parser.add_argument(
+        "--format",
+        choices=["text", "json"],
+        default="text",
+        help="output format",
     )
 
 
@@ -195,7 +252,7 @@ def parse_make_data_migration_args(parser: argparse.ArgumentParser):
         "type",
         help=(
             "available types:"
-            f" {','.join(['sql', 'sql_file', 'python', 'shell', 'typescript'])}"
+            " sql,sql_file,python,shell,typescript,sql_chunked,bulk_load,sync"
         ),
     )
     parser.add_argument(
@@ -240,6 +297,12 @@ def parse_fix_args(parser: argparse.ArgumentParser):
         action="store_true",
         help="fake rollback without executing sql",
     )
+    parser.add_argument(
+        "--resume-from",
+        type=int,
+        required=False,
+        help="resume the sql_file migration from the statement index (1-based)",
+    )
     parser.add_argument(
         "-o",
         "--operator",
@@ -314,6 +377,11 @@ def parse_migrate_args(parser: argparse.ArgumentParser):
         action="store_true",
         help="dry run",
     )
+    parser.add_argument(
+        "--verify-history",
+        action="store_true",
+        help="check every migration history against the plans",
+    )
     parser.add_argument(
         "-o",
         "--operator",
@@ -391,6 +459,8 @@ class Command(StrEnum):
 
     CLEAN = "clean"
     CLEAN_SCHEMA_STORE = "store"
+    CLEAN_HISTORY_LOG = "log"
+    CLEAN_HISTORY_SNAPSHOT = "snapshot"
 
     TEST = "test"
     ALIAS_TEST = "t"
@@ -498,7 +568,9 @@ def parse_args(args):
     )
     parse_pull_args(parser_pull)
 
-    parser_clean = subparsers.add_parser(Command.CLEAN, help="clean schema store")
+    parser_clean = subparsers.add_parser(
+        Command.CLEAN, help="clean schema store or migration history log"
+    )
     parse_clean_args(parser_clean)
 
     parser_test = subparsers.add_parser(Command.TEST, help="test migration plans")
@@ -557,6 +629,10 @@ def main(raw_args):
                             "Found %d unexpected files in schema store"
                             % len(unexpected_files)
                         )
+                case Command.CLEAN_HISTORY_LOG:
+                    cli.clean_history_log()
+                case Command.CLEAN_HISTORY_SNAPSHOT:
+                    cli.dedup_history_snapshot()
         case Command.TEST:
             match args.subcommand:
                 case Command.TEST_GEN:
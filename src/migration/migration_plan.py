@@ -4,7 +4,7 @@ import os
 import re
 from dataclasses import dataclass
 from enum import StrEnum
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 import dacite
 import networkx as nx
@@ -13,6 +13,7 @@ from migration import err
 from migration.env import cli_env
 
 from . import helper
+from .db.model import chain_checksum
 
 logger = logging.getLogger(__name__)
 
@@ -32,6 +33,9 @@ class DataChangeType(StrEnum):
     PYTHON = "python"
     SHELL = "shell"
     TYPESCRIPT = "typescript"
+    SQL_CHUNKED = "sql_chunked"
+    BULK_LOAD = "bulk_load"
+    SYNC = "sync"
 
     @classmethod
     def is_valid(cls, x):
@@ -41,9 +45,92 @@ class DataChangeType(StrEnum):
             or x == cls.PYTHON
             or x == cls.SHELL
             or x == cls.TYPESCRIPT
+            or x == cls.SQL_CHUNKED
+            or x == cls.BULK_LOAD
+            or x == cls.SYNC
         )
 
 
+@dataclass
+class ChunkConfig:
+    """
+    The sql of a sql_chunked change is executed once per chunk of the table,
+    with the bind parameters :start (inclusive) and :end (exclusive) set to
+    the key range of the chunk, e.g.
+    UPDATE `t` SET `a` = 1 WHERE `id` >= :start AND `id` < :end
+    The key column must be an integer, usually the primary key.
+    """
+
+    table: str
+    key: str
+    chunk_size: int = 1000
+    min_chunk_size: int = 10
+    max_chunk_size: int = 100000
+    # the chunk size is adjusted to make each chunk take about the time
+    target_chunk_time: float | int = 0.5
+    # seconds to sleep between chunks
+    pause: float | int = 0
+
+    def to_dict(self) -> Dict:
+        return {
+            "table": self.table,
+            "key": self.key,
+            "chunk_size": self.chunk_size,
+            "min_chunk_size": self.min_chunk_size,
+            "max_chunk_size": self.max_chunk_size,
+            "target_chunk_time": self.target_chunk_time,
+            "pause": self.pause,
+        }
+
+    def next_chunk_size(self, chunk_size: int, elapsed: float) -> int:
+        # change the size at most by half or double each time
+        factor = self.target_chunk_time / elapsed if elapsed > 0 else 2
+        factor = min(max(factor, 0.5), 2)
+        return min(
+            max(int(chunk_size * factor), self.min_chunk_size), self.max_chunk_size
+        )
+
+
+@dataclass
+class LoadConfig:
+    """
+    The file of a bulk_load change is a CSV (or TSV, by the .tsv extension)
+    file loaded into the table, the value \\N is loaded as NULL.
+    As backward, the rows whose key is in the file are deleted.
+    The file of a sync change is the desired rows of the table, identified by
+    the key.
+    """
+
+    table: str
+    # the columns of the file, read from the header if not set
+    columns: Optional[List[str] | None] = None
+    # the first line of the file is the header
+    header: bool = True
+    # the key column, required by sync and the backward of bulk_load
+    key: Optional[str | None] = None
+    # number of rows per INSERT/DELETE, when LOAD DATA LOCAL INFILE is not used,
+    #   and number of keys per compared chunk of sync
+    batch_size: int = 1000
+    # use LOAD DATA LOCAL INFILE if the server allows it
+    local_infile: bool = True
+
+    def to_dict(self) -> Dict:
+        obj = {
+            "table": self.table,
+            "header": self.header,
+            "batch_size": self.batch_size,
+            "local_infile": self.local_infile,
+        }
+        if self.columns is not None:
+            obj["columns"] = self.columns
+        if self.key is not None:
+            obj["key"] = self.key
+        return obj
+
+    def delimiter(self, file: str) -> str:
+        return "\t" if file.lower().endswith(".tsv") else ","
+
+
 @dataclass
 class ConditionCheck:
     type: str  # DataChangeType
@@ -98,6 +185,8 @@ class DataForward:
     precheck: Optional[ConditionCheck | None] = None
     postcheck: Optional[ConditionCheck | None] = None
     envs: Optional[List[str] | None] = None
+    chunk: Optional[ChunkConfig | None] = None  # only for sql_chunked
+    load: Optional[LoadConfig | None] = None  # only for bulk_load and sync
 
     def to_dict(self) -> Dict:
         obj = {
@@ -106,6 +195,14 @@ class DataForward:
         match self.type:
             case DataChangeType.SQL:
                 obj["sql"] = self.sql
+            case DataChangeType.SQL_CHUNKED:
+                obj["sql"] = self.sql
+                if self.chunk is not None:
+                    obj["chunk"] = self.chunk.to_dict()
+            case DataChangeType.BULK_LOAD | DataChangeType.SYNC:
+                obj["file"] = self.file
+                if self.load is not None:
+                    obj["load"] = self.load.to_dict()
             case (
                 DataChangeType.SQL_FILE
                 | DataChangeType.PYTHON
@@ -122,7 +219,7 @@ class DataForward:
         return obj
 
     def to_str_for_print(self) -> str:
-        if self.type == DataChangeType.SQL:
+        if self.type == DataChangeType.SQL or self.type == DataChangeType.SQL_CHUNKED:
             # to match the length if index sha1
             return helper.truncate_str(self.sql, max_len=40)
         elif (
@@ -130,6 +227,8 @@ class DataForward:
             or self.type == DataChangeType.PYTHON
             or self.type == DataChangeType.SHELL
             or self.type == DataChangeType.TYPESCRIPT
+            or self.type == DataChangeType.BULK_LOAD
+            or self.type == DataChangeType.SYNC
         ):
             return self.file
         else:
@@ -237,6 +336,8 @@ class MigrationPlan:
     change: Change
     dependencies: List[MigrationSignature]
     ignore_after: Optional[MigrationSignature | None] = None
+    # repeatable plans sharing a tag are not executed concurrently
+    tags: Optional[List[str] | None] = None
 
     _checksum: Optional[str | None] = None  # the value is not saved to file
     _checksum_match: Optional[bool | None] = None  # the value is not saved to file
@@ -261,6 +362,8 @@ class MigrationPlan:
         }
         if self.ignore_after is not None:
             obj["ignore_after"] = self.ignore_after.to_dict()
+        if self.tags is not None and len(self.tags) > 0:
+            obj["tags"] = self.tags
         return obj
 
     def is_rollbackable(self) -> bool:
@@ -282,6 +385,8 @@ class MigrationPlan:
                         | DataChangeType.PYTHON
                         | DataChangeType.SHELL
                         | DataChangeType.TYPESCRIPT
+                        | DataChangeType.BULK_LOAD
+                        | DataChangeType.SYNC
                     ):
                         sha1.update_file([os.path.join(data_dir, forward.file)])
                 if forward.envs is not None:
@@ -294,6 +399,8 @@ class MigrationPlan:
                             | DataChangeType.PYTHON
                             | DataChangeType.SHELL
                             | DataChangeType.TYPESCRIPT
+                            | DataChangeType.BULK_LOAD
+                            | DataChangeType.SYNC
                         ):
                             sha1.update_file([os.path.join(data_dir, backward.file)])
                     if backward.envs is not None:
@@ -352,9 +459,56 @@ _default_sort_migration_plans_by = SortAlg.DEPENDENCY
 _sort_migration_plans_by = _default_sort_migration_plans_by
 
 
+class AppliedPlans:
+    """
+    The applied versioned plans, with their chain checksum in plan order.
+    The plans are applied in plan order, except when they are migrated
+    concurrently, so the first plans are kept as a count, whose chain
+    checksum is cached by the manager, and only the few plans applied
+    ahead of them are chained again.
+    """
+
+    def __init__(self, mpm: "MigrationPlanManager", prefix: int = 0):
+        self._mpm = mpm
+        # the first n plans are applied
+        self._prefix = prefix
+        # indexes of the applied plans after the first n
+        self._ahead: Set[int] = set()
+
+    def __contains__(self, sig: object) -> bool:
+        index = self._mpm._plan_index.get(sig)
+        return index is not None and (index < self._prefix or index in self._ahead)
+
+    def __len__(self) -> int:
+        return self._prefix + len(self._ahead)
+
+    def add(self, sig: MigrationSignature):
+        self._ahead.add(self._mpm.get_plan_index(sig))
+        while self._prefix in self._ahead:
+            self._ahead.remove(self._prefix)
+            self._prefix += 1
+
+    def discard(self, sig: MigrationSignature):
+        index = self._mpm.get_plan_index(sig)
+        if index < self._prefix:
+            self._ahead.update(range(index + 1, self._prefix))
+            self._prefix = index
+        else:
+            self._ahead.discard(index)
+
+    def get_chain_checksum(self) -> str:
+        checksum = self._mpm.get_chain_checksum(self._prefix)
+        for index in sorted(self._ahead):
+            checksum = chain_checksum(checksum, self._mpm.plans[index].get_checksum())
+        return checksum
+
+
 class MigrationPlanManager:
     def __init__(self):
         self.plans, self.repeatable_plans = self._read_migration_plans()
+        # chain checksums of the first n plans, computed lazily
+        self._chain_checksums: List[str] = [""]
+        self._plan_index = {p.sig(): i for i, p in enumerate(self.plans)}
 
     def _read_migration_plans(self) -> Tuple[List[MigrationPlan], List[MigrationPlan]]:
         plans = []
@@ -389,11 +543,9 @@ class MigrationPlanManager:
             plan_map[p.sig()] = p
 
         for p in repeatable_plans:
-            if len(p.dependencies) == 0:
-                continue
-            dep = p.dependencies[0]
-            if dep not in plan_map:
-                raise err.IntegrityError(f"Cannot find dependency {dep} for {p}")
+            for dep in p.dependencies:
+                if dep not in plan_map:
+                    raise err.IntegrityError(f"Cannot find dependency {dep} for {p}")
 
     @staticmethod
     def _sort_plans(plans: List[MigrationPlan]) -> List[MigrationPlan]:
@@ -419,12 +571,10 @@ class MigrationPlanManager:
                 if p.match(InitialMigrationSignature):
                     continue
                 raise err.IntegrityError(f"{p} has no dependency")
-            # For now only support one dependency,
-            # the other dependencies will be ignored
-            dep = p.dependencies[0]
-            if dep not in plan_map:
-                raise err.IntegrityError(f"Cannot find dependency {dep} for {p}")
-            G.add_edge(dep, p.sig())
+            for dep in p.dependencies:
+                if dep not in plan_map:
+                    raise err.IntegrityError(f"Cannot find dependency {dep} for {p}")
+                G.add_edge(dep, p.sig())
 
         # Check for cycles in the graph
         try:
@@ -433,26 +583,24 @@ class MigrationPlanManager:
         except nx.exception.NetworkXNoCycle:
             pass
 
-        sorted_plans = []
-        # Iterate over all nodes in the graph starting from InitialMigrationSignature
-        node: MigrationSignature
-        for node in nx.algorithms.traversal.depth_first_search.dfs_preorder_nodes(
-            G, InitialMigrationSignature
-        ):
-            out_degree = G.out_degree(node)
-            if out_degree == 0 and len(sorted_plans) != len(plans) - 1:
-                # skip the last node
-                raise err.IntegrityError(f"Cannot find next migration plan for {node}")
-            if out_degree > 1:
+        # The plans form a DAG, the independent plans are ordered by version
+        # so that the order is stable
+        sorted_plans = [
+            plan_map[node]
+            for node in nx.lexicographical_topological_sort(
+                G, key=lambda sig: (sig.version, sig.name or "")
+            )
+        ]
+
+        # Each schema plan applies a snapshot of the whole schema,
+        # so the schema plans must be ordered by the dependencies
+        schema_plans = [p for p in sorted_plans if p.type == Type.SCHEMA]
+        for prev_plan, plan in zip(schema_plans, schema_plans[1:]):
+            if not nx.has_path(G, prev_plan.sig(), plan.sig()):
                 raise err.IntegrityError(
-                    f"Found multiple next migration plans for {node}"
+                    f"Schema migration plan {plan} does not depend on {prev_plan},"
+                    " found multiple next schema migration plans"
                 )
-            sorted_plans.append(plan_map[node])
-
-        if len(sorted_plans) != len(plans):
-            raise Exception(
-                f"Found {len(sorted_plans)} sorted_plans but expected {len(plans)}"
-            )
 
         return sorted_plans
 
@@ -462,6 +610,31 @@ class MigrationPlanManager:
     def get_plans(self) -> List[MigrationPlan]:
         return self.plans
 
+    def get_chain_checksum(self, count: int) -> str:
+        """
+        return the chain checksum of the first count plans
+        """
+        while len(self._chain_checksums) <= count:
+            plan = self.plans[len(self._chain_checksums) - 1]
+            self._chain_checksums.append(
+                chain_checksum(self._chain_checksums[-1], plan.get_checksum())
+            )
+        return self._chain_checksums[count]
+
+    def get_plan_index(self, signature: MigrationSignature) -> int:
+        index = self._plan_index.get(signature)
+        if index is None:
+            raise Exception(f"Cannot find plan for signature {signature}")
+        return index
+
+    def applied_plans(
+        self, signatures: Iterable[MigrationSignature] = ()
+    ) -> "AppliedPlans":
+        applied = AppliedPlans(self)
+        for sig in signatures:
+            applied.add(sig)
+        return applied
+
     def get_repeatable_plans(self) -> List[MigrationPlan]:
         return self.repeatable_plans
 
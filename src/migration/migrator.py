@@ -1,23 +1,199 @@
-import importlib.util
+import csv
 import logging
 import os
 import shlex
 import shutil
 import subprocess
 import tempfile
+import threading
+import time
 from argparse import Namespace
-from typing import Optional
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 
-from sqlalchemy import text
+from sqlalchemy import Connection, column, delete, insert, table, text
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.orm import Session
 
 from . import consts, err, helper
 from . import migration_plan as mp
+from . import sql_statement
+from .db.progress import ProgressCheckpoint
 from .env import cli_env
+from .node_worker import NodeWorker
+from .python_worker import PythonWorkerPool, load_python_module
+from .throttle import Throttle
 
 logger = logging.getLogger(__name__)
 
+# seconds between the progress logs of long running migrations
+PROGRESS_INTERVAL = 5
+
+# receives the progress of a long running migration
+ProgressCallback = Callable[[Dict], None]
+
+# the value loaded as NULL by bulk_load
+NULL_VALUE = "\\N"
+# LOAD DATA LOCAL INFILE is disabled by the server or the client
+LOCAL_INFILE_DISABLED_ERRORS = [1148, 2068, 3948]
+
+
+@contextmanager
+def open_load_file(
+    path: str, load: mp.LoadConfig
+) -> Iterator[Tuple[List[str], Iterator[List[Optional[str]]]]]:
+    """
+    yield the columns and the rows of the file of a bulk_load change
+    """
+    with open(path, newline="", encoding="utf-8") as f:
+        reader = csv.reader(f, delimiter=load.delimiter(path))
+        columns = load.columns
+        if load.header:
+            header = next(reader, [])
+            if columns is None:
+                columns = [c.strip() for c in header]
+        if columns is None or len(columns) == 0:
+            raise Exception(f"The columns of {path} are not found")
+
+        def rows() -> Iterator[List[Optional[str]]]:
+            for row in reader:
+                if len(row) == 0:
+                    continue
+                if len(row) != len(columns):
+                    raise Exception(
+                        f"Expected {len(columns)} values at line {reader.line_num}"
+                        f" of {path}, got {len(row)}"
+                    )
+                yield [None if v == NULL_VALUE else v for v in row]
+
+        yield columns, rows()
+
+
+# the files of the migration cwd affecting the typescript build
+TYPESCRIPT_BUILD_FILES = ["package.json", "package-lock.json", "tsconfig.json"]
+
+
+def typescript_build_key(ts_file_path: str, index_ts: str) -> str:
+    """
+    The key of the compiled js of a typescript migration, which covers the
+    migration, the index.ts, every ts file under the data dir, since the
+    migration may import them, and the build configuration
+    """
+    sha1 = helper.SHA1Helper()
+    sha1.update_str(["index.ts\0", index_ts, "\0migration.ts\0"])
+    sha1.update_file([ts_file_path])
+    data_dir = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR)
+    ts_files = [
+        os.path.join(root, name)
+        for root, _, files in os.walk(data_dir)
+        for name in files
+        if name.endswith(".ts")
+    ]
+    for path in sorted(ts_files):
+        sha1.update_str([f"\0{os.path.relpath(path, data_dir)}\0"])
+        sha1.update_file([path])
+    for name in TYPESCRIPT_BUILD_FILES:
+        path = os.path.join(cli_env.MIGRATION_CWD, name)
+        if os.path.exists(path):
+            sha1.update_str([f"\0{name}\0"])
+            sha1.update_file([path])
+    return sha1.hexdigest()
+
 
 class Migrator:
+    def __init__(self) -> None:
+        # the node worker of the current migration run, if enabled
+        self._node_worker: Optional[NodeWorker] = None
+        # the python worker pool of the current migration run, if enabled
+        self._python_pool: Optional[PythonWorkerPool] = None
+        # schema workspaces materialized ahead of their plans, by index sha1
+        self._schema_workspaces: Dict[str, tempfile.TemporaryDirectory] = {}
+        self._schema_workspaces_mutex = threading.Lock()
+
+    @contextmanager
+    def typescript_worker(self) -> Iterator[None]:
+        """
+        Run the typescript migrations of a migration run by one node worker,
+        the worker is started by the first typescript migration
+        """
+        if not cli_env.TYPESCRIPT_WORKER or self._node_worker is not None:
+            yield
+            return
+        self._node_worker = NodeWorker(cli_env.MIGRATION_CWD)
+        try:
+            yield
+        finally:
+            worker, self._node_worker = self._node_worker, None
+            worker.close()
+
+    @contextmanager
+    def python_workers(self) -> Iterator[None]:
+        """
+        Run the python migrations of a migration run by a pool of worker
+        processes, the workers are started on demand
+        """
+        if cli_env.PYTHON_WORKERS <= 0 or self._python_pool is not None:
+            yield
+            return
+        self._python_pool = PythonWorkerPool(
+            cli_env.PYTHON_WORKERS,
+            memory_limit=cli_env.PYTHON_WORKER_MEMORY_LIMIT * 1024 * 1024,
+            timeout=cli_env.PYTHON_WORKER_TIMEOUT,
+        )
+        try:
+            yield
+        finally:
+            pool, self._python_pool = self._python_pool, None
+            pool.close()
+
+    def prepare(self, migration_plan: mp.MigrationPlan) -> None:
+        """
+        The preparation of the plan without side effects on the database, so
+        that it can run ahead of the execution: computes the checksum,
+        materializes the schema workspace, builds the typescript and imports
+        the python files of the change and its condition checks.
+        """
+        migration_plan.get_checksum()
+        forward = migration_plan.change.forward
+        files: List[Tuple[str, Optional[str]]] = []
+        if migration_plan.type == mp.Type.SCHEMA:
+            with self._schema_workspaces_mutex:
+                prepared = forward.id in self._schema_workspaces
+            if not prepared:
+                workspace = self._make_schema_workspace(forward.id)
+                with self._schema_workspaces_mutex:
+                    stored = self._schema_workspaces.setdefault(forward.id, workspace)
+                if stored is not workspace:
+                    workspace.cleanup()
+        if migration_plan.type in [mp.Type.DATA, mp.Type.REPEATABLE]:
+            files.append((forward.type, forward.file))
+        for check in [forward.precheck, forward.postcheck]:
+            if check is not None:
+                files.append((check.type, check.file))
+        for change_type, file in files:
+            if file is None:
+                continue
+            path = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, file)
+            # the temporary build is removed right away without the cache
+            if change_type == mp.DataChangeType.TYPESCRIPT and (
+                cli_env.TYPESCRIPT_BUILD_CACHE
+            ):
+                with self.typescript_build(path):
+                    pass
+            # the workers import the modules themselves
+            if change_type == mp.DataChangeType.PYTHON and self._python_pool is None:
+                load_python_module(path)
+
+    def discard_prepared(self) -> None:
+        """
+        Remove the schema workspaces prepared for the plans not executed
+        """
+        with self._schema_workspaces_mutex:
+            workspaces = list(self._schema_workspaces.values())
+            self._schema_workspaces.clear()
+        for workspace in workspaces:
+            workspace.cleanup()
+
     def check_condition(
         self,
         condition: mp.ConditionCheck,
@@ -53,7 +229,14 @@ class Migrator:
                     checksum_match=checksum_match,
                 )
 
-    def forward(self, migration_plan: mp.MigrationPlan, args: Namespace):
+    def forward(
+        self,
+        migration_plan: mp.MigrationPlan,
+        args: Namespace,
+        progress: Optional[ProgressCallback] = None,
+        checkpoint: Optional[ProgressCheckpoint] = None,
+        throttle: Optional[Throttle] = None,
+    ):
         logger.info(f"Executing {migration_plan}")
         forward = migration_plan.change.forward
 
@@ -75,13 +258,35 @@ class Migrator:
             if forward.type == mp.DataChangeType.SQL:
                 self.migrate_data_sql(forward.sql, args)
             if forward.type == mp.DataChangeType.SQL_FILE:
-                self.migrate_data_sql_file(forward.file, args)
+                self.migrate_data_sql_file(
+                    forward.file, args, checkpoint=checkpoint, throttle=throttle
+                )
             if forward.type == mp.DataChangeType.PYTHON:
                 self.migrate_data_python(forward.file, args)
             if forward.type == mp.DataChangeType.SHELL:
                 self.migrate_data_shell(forward.file, args)
             if forward.type == mp.DataChangeType.TYPESCRIPT:
                 self.migrate_data_typescript(forward.file, args)
+            if forward.type == mp.DataChangeType.SQL_CHUNKED:
+                self.migrate_data_sql_chunked(
+                    forward,
+                    args,
+                    progress=progress,
+                    checkpoint=checkpoint,
+                    throttle=throttle,
+                )
+            if forward.type == mp.DataChangeType.SYNC:
+                self.migrate_data_sync(
+                    forward, args, progress=progress, throttle=throttle
+                )
+            if forward.type == mp.DataChangeType.BULK_LOAD:
+                self.migrate_data_bulk_load(
+                    forward,
+                    args,
+                    progress=progress,
+                    checkpoint=checkpoint,
+                    throttle=throttle,
+                )
 
         # postcheck
         if forward.postcheck is not None:
@@ -90,7 +295,14 @@ class Migrator:
                     f"postcheck failed for {migration_plan}"
                 )
 
-    def backward(self, migration_plan: mp.MigrationPlan, args: Namespace):
+    def backward(
+        self,
+        migration_plan: mp.MigrationPlan,
+        args: Namespace,
+        progress: Optional[ProgressCallback] = None,
+        checkpoint: Optional[ProgressCheckpoint] = None,
+        throttle: Optional[Throttle] = None,
+    ):
         logger.info(f"Rollbacking {migration_plan}")
         backward = migration_plan.change.backward
         if backward is None:
@@ -111,13 +323,31 @@ class Migrator:
             if backward.type == mp.DataChangeType.SQL:
                 self.migrate_data_sql(backward.sql, args)
             if backward.type == mp.DataChangeType.SQL_FILE:
-                self.migrate_data_sql_file(backward.file, args)
+                self.migrate_data_sql_file(
+                    backward.file, args, checkpoint=checkpoint, throttle=throttle
+                )
             if backward.type == mp.DataChangeType.PYTHON:
                 self.migrate_data_python(backward.file, args)
             if backward.type == mp.DataChangeType.SHELL:
                 self.migrate_data_shell(backward.file, args)
             if backward.type == mp.DataChangeType.TYPESCRIPT:
                 self.migrate_data_typescript(backward.file, args)
+            if backward.type == mp.DataChangeType.SQL_CHUNKED:
+                self.migrate_data_sql_chunked(
+                    backward,
+                    args,
+                    progress=progress,
+                    checkpoint=checkpoint,
+                    throttle=throttle,
+                )
+            if backward.type == mp.DataChangeType.SYNC:
+                self.migrate_data_sync(
+                    backward, args, progress=progress, throttle=throttle
+                )
+            if backward.type == mp.DataChangeType.BULK_LOAD:
+                self.rollback_data_bulk_load(
+                    backward, args, checkpoint=checkpoint, throttle=throttle
+                )
 
         # postcheck
         if backward.postcheck is not None:
@@ -151,18 +381,9 @@ class Migrator:
         shell_file_path = os.path.join(
             cli_env.MIGRATION_CWD, cli_env.DATA_DIR, shell_file
         )
-        section = helper.get_env_ini_section(args.environment)
+        config = helper.get_env_config(args.environment)
         cmd = f"sh {shell_file_path}"
-        env = helper.get_env_with_update(
-            {
-                "MYSQL_PWD": cli_env.MYSQL_PWD,
-                "HOST": section["host"],
-                "PORT": section["port"],
-                "USER": section["user"],
-                "SCHEMA": section["schema"],
-                consts.ENV_SDM_DATA_DIR: cli_env.SDM_DATA_DIR,
-            }
-        )
+        env = config.subprocess_env({consts.ENV_SDM_DATA_DIR: cli_env.SDM_DATA_DIR})
         if expected is not None:
             env[consts.ENV_SDM_EXPECTED] = str(expected)
         if checksum_match is not None:
@@ -188,6 +409,65 @@ class Migrator:
             return False
         return True
 
+    def _build_typescript(self, ts_file_path: str, index_ts: str, build_dir: str):
+        src_path = os.path.join(build_dir, "src")
+        os.makedirs(src_path)
+        # copy ts file to build directory
+        with open(os.path.join(src_path, "index.ts"), "w") as f:
+            f.write(index_ts)
+        shutil.copy(
+            ts_file_path,
+            os.path.join(src_path, "migration.ts"),  # import by index.ts
+        )
+        # build js file
+        subprocess.check_call(
+            shlex.split(f"{cli_env.NPM_CMD_PATH} run build"), cwd=build_dir
+        )
+
+    @contextmanager
+    def typescript_build(self, ts_file_path: str) -> Iterator[str]:
+        """
+        yield the directory of the compiled js of the typescript migration.
+        The build is cached under CACHE_DIR by typescript_build_key, a cache hit
+        runs node without npm run build.
+        The build directory is under the migration cwd, so that npm finds
+        package.json and node finds node_modules.
+        """
+        index_ts = cli_env.SAMPLE_INDEX_TS % (
+            "true" if cli_env.ALLOW_ECHO_SQL else "false"
+        )
+        if not cli_env.TYPESCRIPT_BUILD_CACHE:
+            with tempfile.TemporaryDirectory(dir=cli_env.MIGRATION_CWD) as temp_dir:
+                self._build_typescript(ts_file_path, index_ts, temp_dir)
+                yield temp_dir
+            return
+
+        cache_dir = os.path.join(cli_env.MIGRATION_CWD, cli_env.CACHE_DIR, "typescript")
+        build_dir = os.path.join(
+            cache_dir, typescript_build_key(ts_file_path, index_ts)
+        )
+        if os.path.exists(os.path.join(build_dir, "src", "index.js")):
+            logger.debug("Using the cached build of %s, %s", ts_file_path, build_dir)
+            yield build_dir
+            return
+
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix="tmp-", dir=cache_dir)
+        try:
+            self._build_typescript(ts_file_path, index_ts, temp_dir)
+            # keep the js only, the build compiles every ts file under the cwd
+            for name in ["index.ts", "migration.ts"]:
+                os.remove(os.path.join(temp_dir, "src", name))
+            try:
+                os.rename(temp_dir, build_dir)
+            except OSError:
+                # built by another migration at the same time
+                shutil.rmtree(temp_dir, ignore_errors=True)
+        except Exception:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            raise
+        yield build_dir
+
     def migrate_data_typescript(
         self,
         ts_file: str,
@@ -195,36 +475,26 @@ class Migrator:
         expected: Optional[int] = None,
         checksum_match: Optional[bool] = None,
     ) -> int:
-        section = helper.get_env_ini_section(args.environment)
+        config = helper.get_env_config(args.environment)
         ts_file_path = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, ts_file)
-        # create temporary directory under migration cwd/tmp
-        with tempfile.TemporaryDirectory(dir=cli_env.MIGRATION_CWD) as temp_dir:
-            src_path = os.path.join(temp_dir, "src")
-            os.makedirs(src_path)
-            # copy ts file to temp directory
-            with open(os.path.join(src_path, "index.ts"), "w") as f:
-                f.write(
-                    cli_env.SAMPLE_INDEX_TS
-                    % ("true" if cli_env.ALLOW_ECHO_SQL else "false")
+        with self.typescript_build(ts_file_path) as build_dir:
+            if self._node_worker is not None:
+                args_obj = {consts.ENV_SDM_DATA_DIR: cli_env.SDM_DATA_DIR}
+                if checksum_match is not None:
+                    args_obj[consts.ENV_SDM_CHECKSUM_MATCH] = (
+                        "1" if checksum_match else "0"
+                    )
+                result = self._node_worker.run(
+                    os.path.join(build_dir, "src", "migration.js"),
+                    config,
+                    args_obj,
+                    logging=bool(cli_env.ALLOW_ECHO_SQL),
                 )
-            shutil.copy(
-                ts_file_path,
-                os.path.join(src_path, "migration.ts"),  # import by index.ts
-            )
-            # build js file
-            subprocess.check_call(
-                shlex.split(f"{cli_env.NPM_CMD_PATH} run build"), cwd=temp_dir
-            )
-            env = helper.get_env_with_update(
-                {
-                    "MYSQL_PWD": cli_env.MYSQL_PWD,
-                    "HOST": section["host"],
-                    "PORT": section["port"],
-                    "USER": section["user"],
-                    "SCHEMA": section["schema"],
-                    consts.ENV_SDM_DATA_DIR: cli_env.SDM_DATA_DIR,
-                }
-            )
+                if expected is not None and result != expected:
+                    raise Exception(f"Expected {expected} but got {result}")
+                return 0
+
+            env = config.subprocess_env({consts.ENV_SDM_DATA_DIR: cli_env.SDM_DATA_DIR})
             if expected is not None:
                 env[consts.ENV_SDM_EXPECTED] = str(expected)
             if checksum_match is not None:
@@ -233,7 +503,7 @@ class Migrator:
             # run js file
             subprocess.check_call(
                 [cli_env.NODE_CMD_PATH, "src/index.js"],
-                cwd=temp_dir,
+                cwd=build_dir,
                 env=env,
             )
             return 0
@@ -256,23 +526,231 @@ class Migrator:
         python_file_path = os.path.join(
             cli_env.MIGRATION_CWD, cli_env.DATA_DIR, python_file
         )
-        spec = importlib.util.spec_from_file_location("run_python", python_file_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        session = helper.build_session_from_env(
-            args.environment, echo=cli_env.ALLOW_ECHO_SQL
-        )
         obj = {
             consts.ENV_SDM_DATA_DIR: cli_env.SDM_DATA_DIR,
         }
         if checksum_match is not None:
             obj[consts.ENV_SDM_CHECKSUM_MATCH] = "1" if checksum_match else "0"
-        return module.run(session, args=obj)
+        if self._python_pool is not None:
+            config = helper.get_env_config(args.environment)
+            return self._python_pool.run(
+                python_file_path,
+                {
+                    "host": config.host,
+                    "port": config.port,
+                    "user": config.user,
+                    "password": cli_env.MYSQL_PWD,
+                    "schema": config.schema,
+                },
+                obj,
+                echo=bool(cli_env.ALLOW_ECHO_SQL),
+            )
+        module = load_python_module(python_file_path)
+        # the session borrows a connection of the shared engine, and returns
+        # it to the pool when the migration finishes
+        with helper.build_session_from_env(
+            args.environment, echo=cli_env.ALLOW_ECHO_SQL
+        ) as session:
+            return module.run(session, args=obj)
 
-    def migrate_data_sql_file(self, sql_file: str, args: Namespace):
-        with open(os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, sql_file)) as f:
-            sql = f.read()
-        self.migrate_data_sql(sql, args)
+    def get_fusable_statements(
+        self, migration_plan: mp.MigrationPlan
+    ) -> Optional[List[Tuple[int, str]]]:
+        """
+        return the (line number, statement) of the plan if it can be executed
+        in the same transaction as its migration history, otherwise None
+        """
+        if migration_plan.type != mp.Type.DATA:
+            return None
+        forward = migration_plan.change.forward
+        # condition checks are executed in other sessions,
+        #   they can not see the uncommitted changes
+        if forward.precheck is not None or forward.postcheck is not None:
+            return None
+        match forward.type:
+            case mp.DataChangeType.SQL:
+                statements = self._fusable_statements(
+                    migration_plan, forward.sql.splitlines(keepends=True)
+                )
+            case mp.DataChangeType.SQL_FILE:
+                path = os.path.join(
+                    cli_env.MIGRATION_CWD, cli_env.DATA_DIR, forward.file
+                )
+                # committed in chunks, resumable and streamed
+                if cli_env.SQL_FILE_COMMIT_EVERY > 0:
+                    return None
+                if os.path.getsize(path) > cli_env.FUSED_SQL_MAX_BYTES:
+                    logger.info(f"{migration_plan} is too large, not fused")
+                    return None
+                with open(path) as f:
+                    statements = self._fusable_statements(migration_plan, f)
+            case _:
+                return None
+        return statements
+
+    def _fusable_statements(
+        self, migration_plan: mp.MigrationPlan, lines: Iterable[str]
+    ) -> Optional[List[Tuple[int, str]]]:
+        statements: List[Tuple[int, str]] = []
+        size = 0
+        for line_no, statement in sql_statement.iter_numbered_statements(lines):
+            if sql_statement.is_implicit_commit(statement):
+                logger.info(
+                    f"{migration_plan} contains implicit commit statements, not fused"
+                )
+                return None
+            size += len(statement)
+            if (
+                len(statements) >= cli_env.FUSED_SQL_MAX_STATEMENTS
+                or size > cli_env.FUSED_SQL_MAX_BYTES
+            ):
+                logger.info(f"{migration_plan} is too large, not fused")
+                return None
+            statements.append((line_no, statement))
+        return statements
+
+    def migrate_data_sql_in_session(
+        self,
+        migration_plan: mp.MigrationPlan,
+        statements: List[Tuple[int, str]],
+        session: Session,
+    ):
+        """
+        Execute the statements one by one in the session of the migration
+        history, so that the error of every statement is raised
+        """
+        logger.info(f"Executing {migration_plan} (fused)")
+        rows = 0
+        for index, (line_no, statement) in enumerate(statements, start=1):
+            try:
+                # no bind parameters, "%" is escaped for the driver
+                result = session.connection().exec_driver_sql(
+                    statement.replace("%", "%%")
+                )
+            except Exception as e:
+                raise err.SQLStatementError(
+                    f"Failed to execute statement #{index} at line {line_no} of"
+                    f" {migration_plan}:"
+                    f" {helper.truncate_str(statement, max_len=200)}",
+                    index,
+                    line_no,
+                ) from e
+            rows += max(result.rowcount, 0)
+        logger.info(
+            f"Migrated {migration_plan}, statements={len(statements)}, rows={rows}"
+        )
+
+    def migrate_data_sql_file(
+        self,
+        sql_file: str,
+        args: Namespace,
+        checkpoint: Optional[ProgressCheckpoint] = None,
+        throttle: Optional[Throttle] = None,
+    ):
+        """
+        Execute the statements in the file one by one, the file is streamed,
+        so only the current statement is kept in memory.
+        The statements are executed in one transaction, unless
+        SQL_FILE_COMMIT_EVERY is set, in which case the migration can be
+        resumed from the first uncommitted statement, by the checkpoint
+        or by --resume-from, and the migration is throttled between commits.
+        """
+        resume_from = (
+            args.resume_from
+            if "resume_from" in args and args.resume_from is not None
+            else None
+        )
+        commit_every = cli_env.SQL_FILE_COMMIT_EVERY
+        path = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, sql_file)
+        file_size = max(os.path.getsize(path), 1)
+        session = helper.build_session_from_env(
+            args.environment, echo=cli_env.ALLOW_ECHO_SQL
+        )
+        rows = 0
+        if checkpoint is not None:
+            saved = checkpoint.load(session)
+            session.commit()
+            if (
+                resume_from is None
+                and saved is not None
+                and saved["statement_index"] is not None
+            ):
+                resume_from = saved["statement_index"] + 1
+                rows = saved["rows"]
+        if resume_from is None:
+            resume_from = 1
+        if resume_from > 1:
+            logger.info(f"Resuming {sql_file} from statement #{resume_from}")
+
+        def save_checkpoint(index: int) -> None:
+            if checkpoint is not None:
+                checkpoint.save(session, rows=rows, statement_index=index)
+
+        read_size = 0
+        committed = resume_from - 1
+        index = 0
+        last_report = time.monotonic()
+        with open(path, "rb") as f:
+
+            def read_lines():
+                nonlocal read_size
+                for raw in f:
+                    read_size += len(raw)
+                    yield raw.decode()
+
+            try:
+                for index, (line_no, statement) in enumerate(
+                    sql_statement.iter_numbered_statements(read_lines()), start=1
+                ):
+                    if index < resume_from:
+                        continue
+                    try:
+                        # no bind parameters, "%" is escaped for the driver
+                        result = session.connection().exec_driver_sql(
+                            statement.replace("%", "%%")
+                        )
+                        rows += max(result.rowcount, 0)
+                    except Exception as e:
+                        message = (
+                            f"Failed to execute statement #{index} at line"
+                            f" {line_no} of {sql_file}:"
+                            f" {helper.truncate_str(statement, max_len=200)}"
+                        )
+                        if committed > 0 and checkpoint is not None:
+                            message += (
+                                f", statements before #{committed + 1} are"
+                                " committed, `sdm fix` resumes from"
+                                f" #{committed + 1}"
+                            )
+                        elif committed > 0:
+                            message += (
+                                f", statements before #{committed + 1} are"
+                                " committed, resume by `sdm fix migrate"
+                                f" {args.environment} --resume-from"
+                                f" {committed + 1}`"
+                            )
+                        raise err.SQLStatementError(message, index, line_no) from e
+                    if commit_every > 0 and (index - committed) >= commit_every:
+                        save_checkpoint(index)
+                        session.commit()
+                        committed = index
+                        if throttle is not None:
+                            throttle.wait()
+                    if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                        last_report = time.monotonic()
+                        logger.info(
+                            f"Executed {index} statements of {sql_file},"
+                            f" {min(read_size * 100 / file_size, 100):.1f}%"
+                        )
+                if index > committed:
+                    save_checkpoint(index)
+                session.commit()
+            except Exception:
+                session.rollback()
+                raise
+            finally:
+                session.close()
+        logger.info(f"Migrated SQL file {sql_file}, statements={index}, rows={rows}")
 
     def migrate_data_sql(self, sql: str, args: Namespace):
         session = helper.build_session_from_env(
@@ -285,6 +763,511 @@ class Migrator:
                 f" result.rowcount={result.rowcount}"
             )
 
+    def migrate_data_sql_chunked(
+        self,
+        change: mp.DataForward,
+        args: Namespace,
+        progress: Optional[ProgressCallback] = None,
+        checkpoint: Optional[ProgressCheckpoint] = None,
+        throttle: Optional[Throttle] = None,
+    ):
+        """
+        Walk the key range of the table in chunks, each chunk is executed
+        in its own transaction, so that the locks are held briefly.
+        The chunk boundaries are found by the key index, and the chunk size
+        is adjusted by the measured latency.
+        The checkpoint is saved with each chunk, the migration resumes after
+        the last migrated key.
+        The chunk size is halved whenever the migration is throttled.
+        """
+        chunk = change.chunk
+        table = f"`{chunk.table}`"
+        key = f"`{chunk.key}`"
+        session = helper.build_session_from_env(
+            args.environment, echo=cli_env.ALLOW_ECHO_SQL
+        )
+        stmt = text(change.sql)
+        boundary_stmt = text(
+            f"SELECT {key} FROM {table} WHERE {key} >= :start ORDER BY {key}"
+            " LIMIT 1 OFFSET :offset"
+        )
+        try:
+            min_key, max_key = session.execute(
+                text(f"SELECT MIN({key}), MAX({key}) FROM {table}")
+            ).one()
+            session.commit()
+            if min_key is None:
+                logger.info(f"Table {chunk.table} is empty, nothing to migrate")
+                return
+
+            chunk_size = chunk.chunk_size
+            start = min_key
+            state = {
+                "table": chunk.table,
+                "min_key": min_key,
+                "max_key": max_key,
+                "last_key": None,
+                "chunks": 0,
+                "rows": 0,
+                "throttle_time": 0.0,
+            }
+            if checkpoint is not None:
+                saved = checkpoint.load(session)
+                session.commit()
+                if saved is not None and saved["last_key"] is not None:
+                    state["last_key"] = int(saved["last_key"])
+                    state["rows"] = saved["rows"]
+                    start = max(start, state["last_key"] + 1)
+                    logger.info(
+                        f"Resuming {chunk.table} after {key}={state['last_key']}"
+                    )
+            last_report = time.monotonic()
+            while start <= max_key:
+                if throttle is not None:
+                    waited = throttle.wait()
+                    if waited > 0:
+                        state["throttle_time"] += waited
+                        chunk_size = max(chunk.min_chunk_size, chunk_size // 2)
+                began = time.monotonic()
+                # the first key of the next chunk, keys after max_key are
+                #   inserted after the migration started, they are not migrated
+                end = session.execute(
+                    boundary_stmt, {"start": start, "offset": chunk_size}
+                ).scalar_one_or_none()
+                if end is None or end > max_key:
+                    end = max_key + 1
+                result = session.execute(stmt, {"start": start, "end": end})
+                state["last_key"] = end - 1
+                state["chunks"] += 1
+                state["rows"] += max(result.rowcount, 0)
+                state["chunk_size"] = chunk_size
+                if checkpoint is not None:
+                    checkpoint.save(
+                        session, rows=state["rows"], last_key=str(state["last_key"])
+                    )
+                session.commit()
+                elapsed = time.monotonic() - began
+
+                start = end
+                chunk_size = chunk.next_chunk_size(chunk_size, elapsed)
+
+                done = start > max_key
+                if done or time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    logger.info(
+                        f"Migrated {chunk.table} up to {key}={state['last_key']}"
+                        f" of {max_key}, chunks={state['chunks']},"
+                        f" rows={state['rows']}, chunk_size={chunk_size},"
+                        f" throttle_time={state['throttle_time']:.1f}s"
+                    )
+                    if progress is not None:
+                        progress(dict(state))
+                if not done and chunk.pause > 0:
+                    time.sleep(chunk.pause)
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def migrate_data_bulk_load(
+        self,
+        change: mp.DataForward,
+        args: Namespace,
+        progress: Optional[ProgressCallback] = None,
+        checkpoint: Optional[ProgressCheckpoint] = None,
+        throttle: Optional[Throttle] = None,
+    ):
+        """
+        Load the file into the table by LOAD DATA LOCAL INFILE if the server
+        allows it, otherwise by multi-row INSERTs of batch_size rows.
+        Each batch is committed with the checkpoint, the migration resumes after
+        the last committed row.
+        """
+        load = change.load
+        path = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, change.file)
+        session = helper.build_session_from_env(
+            args.environment,
+            echo=cli_env.ALLOW_ECHO_SQL,
+            local_infile=load.local_infile,
+        )
+        state = {"table": load.table, "method": "insert", "rows": 0}
+        try:
+            if checkpoint is not None:
+                saved = checkpoint.load(session)
+                session.commit()
+                if saved is not None:
+                    state["rows"] = saved["rows"]
+                    logger.info(f"Resuming {change.file} after {state['rows']} rows")
+            if (
+                state["rows"] == 0
+                and load.local_infile
+                and self._load_data_local_infile(session, path, load, state)
+            ):
+                if checkpoint is not None:
+                    checkpoint.save(session, rows=state["rows"])
+                session.commit()
+            else:
+                self._insert_load_file(
+                    session, path, load, state, progress, checkpoint, throttle
+                )
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        logger.info(
+            f"Loaded {change.file} into {load.table}, rows={state['rows']},"
+            f" method={state['method']}"
+        )
+        if progress is not None:
+            progress(dict(state))
+
+    def _load_data_local_infile(
+        self, session: Session, path: str, load: mp.LoadConfig, state: Dict
+    ) -> bool:
+        """
+        return False if LOAD DATA LOCAL INFILE is not allowed
+        """
+        if not session.execute(text("SELECT @@GLOBAL.local_infile")).scalar_one():
+            logger.info("local_infile is disabled by the server, load by INSERT")
+            return False
+        with open_load_file(path, load) as (columns, rows):
+            expected = sum(1 for _ in rows)
+        with open(path, "rb") as f:
+            line_end = "\r\n" if f.readline().endswith(b"\r\n") else "\n"
+
+        def quote(name: str) -> str:
+            # the values are bound by the driver, so "%" is escaped
+            return f"`{name}`".replace("%", "%%")
+
+        variables = [f"@v{i}" for i in range(len(columns))]
+        sql = (
+            f"LOAD DATA LOCAL INFILE %s INTO TABLE {quote(load.table)}"
+            " CHARACTER SET utf8mb4 FIELDS TERMINATED BY %s"
+            " OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' LINES TERMINATED BY %s"
+            + (" IGNORE 1 LINES" if load.header else "")
+            + f" ({', '.join(variables)}) SET "
+            + ", ".join(
+                f"{quote(c)} = NULLIF({v}, %s)" for c, v in zip(columns, variables)
+            )
+        )
+        params = (path, load.delimiter(path), line_end) + (NULL_VALUE,) * len(columns)
+        try:
+            result = session.connection().exec_driver_sql(sql, params)
+        except DBAPIError as e:
+            if e.orig is None or e.orig.args[0] not in LOCAL_INFILE_DISABLED_ERRORS:
+                raise
+            session.rollback()
+            logger.info(f"LOAD DATA LOCAL INFILE is not allowed, load by INSERT: {e}")
+            return False
+        # with LOCAL, the invalid rows are skipped with warnings instead of errors
+        if result.rowcount != expected:
+            warnings = session.execute(text("SHOW WARNINGS LIMIT 5")).all()
+            raise Exception(
+                f"Loaded {result.rowcount} rows of {expected} from {path},"
+                f" warnings={[tuple(w) for w in warnings]}"
+            )
+        state["method"] = "load_data"
+        state["rows"] = result.rowcount
+        return True
+
+    def _insert_load_file(
+        self,
+        session: Session,
+        path: str,
+        load: mp.LoadConfig,
+        state: Dict,
+        progress: Optional[ProgressCallback],
+        checkpoint: Optional[ProgressCheckpoint],
+        throttle: Optional[Throttle],
+    ):
+        with open_load_file(path, load) as (columns, rows):
+            target = table(load.table, *[column(c) for c in columns])
+            skip = state["rows"]
+            batch: List[Dict] = []
+            last_report = time.monotonic()
+
+            def flush() -> None:
+                session.execute(insert(target).values(batch))
+                state["rows"] += len(batch)
+                batch.clear()
+                if checkpoint is not None:
+                    checkpoint.save(session, rows=state["rows"])
+                session.commit()
+                if throttle is not None:
+                    throttle.wait()
+
+            for index, row in enumerate(rows):
+                if index < skip:
+                    continue
+                batch.append(dict(zip(columns, row)))
+                if len(batch) >= load.batch_size:
+                    flush()
+                if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                    last_report = time.monotonic()
+                    logger.info(f"Loaded {state['rows']} rows into {load.table}")
+                    if progress is not None:
+                        progress(dict(state))
+            if len(batch) > 0:
+                flush()
+
+    def rollback_data_bulk_load(
+        self,
+        change: mp.DataBackward,
+        args: Namespace,
+        checkpoint: Optional[ProgressCheckpoint] = None,
+        throttle: Optional[Throttle] = None,
+    ):
+        """
+        Delete the rows whose key is in the file, batch_size keys at a time.
+        Each batch is committed with the checkpoint, the rollback resumes after
+        the keys of the last committed batch.
+        """
+        load = change.load
+        path = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, change.file)
+        session = helper.build_session_from_env(
+            args.environment, echo=cli_env.ALLOW_ECHO_SQL
+        )
+        done, deleted = 0, 0
+        try:
+            if checkpoint is not None:
+                saved = checkpoint.load(session)
+                session.commit()
+                if saved is not None:
+                    done = saved["rows"]
+            with open_load_file(path, load) as (columns, rows):
+                target = table(load.table, column(load.key))
+                key_index = columns.index(load.key)
+                skip = done
+                keys: List[Optional[str]] = []
+
+                def flush() -> None:
+                    nonlocal done, deleted
+                    result = session.execute(
+                        delete(target).where(target.c[load.key].in_(keys))
+                    )
+                    done += len(keys)
+                    deleted += max(result.rowcount, 0)
+                    keys.clear()
+                    if checkpoint is not None:
+                        checkpoint.save(session, rows=done)
+                    session.commit()
+                    if throttle is not None:
+                        throttle.wait()
+
+                for index, row in enumerate(rows):
+                    if index < skip:
+                        continue
+                    keys.append(row[key_index])
+                    if len(keys) >= load.batch_size:
+                        flush()
+                if len(keys) > 0:
+                    flush()
+        except Exception:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+        logger.info(
+            f"Deleted the rows of {change.file} from {load.table}, keys={done},"
+            f" rows={deleted}"
+        )
+
+    def migrate_data_sync(
+        self,
+        change: mp.DataForward,
+        args: Namespace,
+        progress: Optional[ProgressCallback] = None,
+        throttle: Optional[Throttle] = None,
+    ):
+        """
+        Make the table equal to the file, only the different rows are written.
+        The file is streamed into a temporary table like the table, so the
+        values of both sides are converted to the column types by the server.
+        Then both are merged in key order by chunks of batch_size keys of the
+        file, a chunk whose rows have the same hash on both sides is skipped,
+        the rows of the other chunks are compared and written by the server.
+        Neither the file nor the table is read into memory.
+        """
+        load = change.load
+        path = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, change.file)
+        # one staging table per connection, dropped after the sync
+        staging = f"_sdm_sync_{helper.sha1_encode([load.table])[:12]}"
+        state = {
+            "table": load.table,
+            "chunks": 0,
+            "skipped_chunks": 0,
+            "inserted": 0,
+            "updated": 0,
+            "deleted": 0,
+        }
+        engine = helper.build_engine_from_env(
+            args.environment, echo=cli_env.ALLOW_ECHO_SQL
+        )
+        with engine.connect() as conn:
+            conn.execute(
+                text(f"CREATE TEMPORARY TABLE `{staging}` LIKE `{load.table}`")
+            )
+            try:
+                columns = self._stage_sync_file(conn, path, load, staging)
+                conn.commit()
+                self._merge_sync_chunks(
+                    conn, load, columns, staging, state, progress, throttle
+                )
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                try:
+                    conn.execute(text(f"DROP TEMPORARY TABLE IF EXISTS `{staging}`"))
+                    conn.commit()
+                except DBAPIError:
+                    # the temporary table goes with the connection
+                    conn.invalidate()
+        logger.info(
+            f"Synced {change.file} to {load.table}, chunks={state['chunks']},"
+            f" skipped_chunks={state['skipped_chunks']},"
+            f" inserted={state['inserted']}, updated={state['updated']},"
+            f" deleted={state['deleted']}"
+        )
+        if progress is not None:
+            progress(dict(state))
+
+    def _stage_sync_file(
+        self, conn: Connection, path: str, load: mp.LoadConfig, staging: str
+    ) -> List[str]:
+        """
+        Insert the rows of the file into the staging table,
+        batch_size rows at a time, return the columns of the file
+        """
+        with open_load_file(path, load) as (columns, rows):
+            if load.key not in columns:
+                raise Exception(f"Key {load.key} is not a column of {path}")
+            target = table(staging, *[column(c) for c in columns])
+            batch: List[Dict] = []
+
+            def flush() -> None:
+                try:
+                    conn.execute(insert(target).values(batch))
+                except IntegrityError as e:
+                    raise Exception(f"Duplicate key in {path}: {e.orig}") from e
+                batch.clear()
+
+            for row in rows:
+                batch.append(dict(zip(columns, row)))
+                if len(batch) >= load.batch_size:
+                    flush()
+            if len(batch) > 0:
+                flush()
+        return columns
+
+    def _merge_sync_chunks(
+        self,
+        conn: Connection,
+        load: mp.LoadConfig,
+        columns: List[str],
+        staging: str,
+        state: Dict,
+        progress: Optional[ProgressCallback],
+        throttle: Optional[Throttle],
+    ):
+        """
+        Each chunk is a key range (lo, hi] holding batch_size keys of the
+        staging table, the first and the last chunks are unbounded, so that
+        every row of the table is in a chunk. The values are compared by the
+        bytes of the same column types, so e.g. 1.5 and 1.50 of a DECIMAL(5,2)
+        are the same, and a change of letter case is found.
+        """
+        key = f"`{load.key}`"
+        # the values are hashed as text, NULL as NULL_VALUE
+        values = ", ".join(f"IFNULL(CAST(x.`{c}` AS CHAR), :null)" for c in columns)
+        same = " AND ".join(
+            f"CAST(x.`{c}` AS BINARY) <=> CAST(s.`{c}` AS BINARY)" for c in columns
+        )
+        sets = ", ".join(f"x.`{c}` = s.`{c}`" for c in columns if c != load.key)
+        names = ", ".join(f"`{c}`" for c in columns)
+        staged_names = ", ".join(f"s.`{c}`" for c in columns)
+
+        def in_chunk(alias: str, bounds: Dict) -> str:
+            conditions = []
+            if "lo" in bounds:
+                conditions.append(f"{alias}.{key} > :lo")
+            if "hi" in bounds:
+                conditions.append(f"{alias}.{key} <= :hi")
+            return " AND ".join(conditions) if len(conditions) > 0 else "TRUE"
+
+        def chunk_hash(name: str, bounds: Dict) -> Tuple[int, int]:
+            count, digest = conn.execute(
+                text(
+                    "SELECT COUNT(*), BIT_XOR(CAST(CONV(SUBSTRING(MD5(CONCAT_WS(CHAR(31"
+                    f" USING utf8mb4), {values})), 1, 16), 16, 10) AS UNSIGNED)) FROM"
+                    f" `{name}` x WHERE {in_chunk('x', bounds)}"
+                ),
+                {**bounds, "null": NULL_VALUE},
+            ).one()
+            return count, int(digest or 0)
+
+        lo = None
+        last_report = time.monotonic()
+        while True:
+            bounds = {} if lo is None else {"lo": lo}
+            # the last key of the chunk, and whether any key follows it
+            ends = conn.execute(
+                text(
+                    f"SELECT {key} FROM `{staging}` s WHERE {in_chunk('s', bounds)}"
+                    f" ORDER BY {key} LIMIT 2 OFFSET {load.batch_size - 1}"
+                ),
+                bounds,
+            ).all()
+            if len(ends) == 2:
+                bounds["hi"] = ends[0][0]
+            state["chunks"] += 1
+            if chunk_hash(staging, bounds) == chunk_hash(load.table, bounds):
+                conn.commit()
+                state["skipped_chunks"] += 1
+            else:
+                if sets != "":
+                    result = conn.execute(
+                        text(
+                            f"UPDATE `{load.table}` x JOIN `{staging}` s ON"
+                            f" x.{key} = s.{key} SET {sets} WHERE"
+                            f" {in_chunk('s', bounds)} AND NOT ({same})"
+                        ),
+                        bounds,
+                    )
+                    state["updated"] += max(result.rowcount, 0)
+                result = conn.execute(
+                    text(
+                        f"INSERT INTO `{load.table}` ({names}) SELECT {staged_names}"
+                        f" FROM `{staging}` s LEFT JOIN `{load.table}` x ON"
+                        f" x.{key} = s.{key} WHERE {in_chunk('s', bounds)} AND"
+                        f" x.{key} IS NULL"
+                    ),
+                    bounds,
+                )
+                state["inserted"] += max(result.rowcount, 0)
+                result = conn.execute(
+                    text(
+                        f"DELETE x FROM `{load.table}` x LEFT JOIN `{staging}` s ON"
+                        f" s.{key} = x.{key} WHERE {in_chunk('x', bounds)} AND"
+                        f" s.{key} IS NULL"
+                    ),
+                    bounds,
+                )
+                state["deleted"] += max(result.rowcount, 0)
+                conn.commit()
+                if throttle is not None:
+                    throttle.wait()
+            if time.monotonic() - last_report >= PROGRESS_INTERVAL:
+                last_report = time.monotonic()
+                logger.info(f"Synced {state['chunks']} chunks of {load.table}")
+                if progress is not None:
+                    progress(dict(state))
+            if "hi" not in bounds:
+                break
+            lo = bounds["hi"]
+
     def check_condition_sql_file(
         self, sql_file: str, expected: int, args: Namespace
     ) -> bool:
@@ -304,23 +1287,42 @@ class Migrator:
             )
             return result[0] == expected
 
-    def move_schema_to(self, sha1: str, args: Namespace, allow_unsafe: bool = False):
+    def _make_schema_workspace(self, sha1: str) -> tempfile.TemporaryDirectory:
+        """
+        A temporary directory with the schema files of the index and .skeema
+        """
         index_file = helper.sha1_to_path(sha1)
         with open(index_file, "r") as f:
             lines = f.readlines()
-        with tempfile.TemporaryDirectory() as temp_dir:
-            os.makedirs(os.path.join(temp_dir, cli_env.SCHEMA_DIR), exist_ok=False)
+        workspace = tempfile.TemporaryDirectory()
+        try:
+            os.makedirs(
+                os.path.join(workspace.name, cli_env.SCHEMA_DIR), exist_ok=False
+            )
             shutil.copy(
                 os.path.join(cli_env.MIGRATION_CWD, cli_env.SCHEMA_DIR, ".skeema"),
-                os.path.join(temp_dir, cli_env.SCHEMA_DIR, ".skeema"),
+                os.path.join(workspace.name, cli_env.SCHEMA_DIR, ".skeema"),
             )
             for line in lines:
                 [sha1, sql_filename] = line.split(":")
                 sql_filepath = helper.sha1_to_path(sha1)
                 shutil.copy(
                     sql_filepath,
-                    os.path.join(temp_dir, cli_env.SCHEMA_DIR, sql_filename.strip()),
+                    os.path.join(
+                        workspace.name, cli_env.SCHEMA_DIR, sql_filename.strip()
+                    ),
                 )
+        except Exception:
+            workspace.cleanup()
+            raise
+        return workspace
+
+    def move_schema_to(self, sha1: str, args: Namespace, allow_unsafe: bool = False):
+        with self._schema_workspaces_mutex:
+            workspace = self._schema_workspaces.pop(sha1, None)
+        if workspace is None:
+            workspace = self._make_schema_workspace(sha1)
+        with workspace as temp_dir:
             skeema_args = [
                 "push",
                 args.environment,
@@ -328,4 +1330,3 @@ class Migrator:
             if cli_env.ALLOW_UNSAFE or allow_unsafe:
                 skeema_args.extend(["--allow-unsafe"])
             helper.call_skeema(raw_args=skeema_args, cwd=temp_dir)
-        pass
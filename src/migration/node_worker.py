@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import subprocess
+import threading
+from typing import Dict, Optional
+
+from . import consts, helper
+from .env import cli_env
+
+logger = logging.getLogger(__name__)
+
+# The worker reads one JSON request per line from stdin, and writes one JSON
+# response per line to stdout, the requests are executed one by one.
+#   request: {"id", "module", "connection", "logging", "args"}
+#   response: {"id", "code", "result"} or {"id", "code", "error"}
+# The output of the migrations is redirected to stderr.
+WORKER_JS = """const readline = require("readline")
+
+const send = process.stdout.write.bind(process.stdout)
+process.stdout.write = process.stderr.write.bind(process.stderr)
+
+// one data source, and its connection pool, per environment
+const dataSources = new Map()
+
+async function getDataSource(req, entities) {
+  const { DataSource } = require("typeorm")
+  const c = req.connection
+  const key = [c.host, c.port, c.username, c.database, req.logging].join("\\0")
+  let ds = dataSources.get(key)
+  if (ds === undefined) {
+    ds = new DataSource({
+      type: "mysql",
+      ...c,
+      synchronize: false,
+      logging: req.logging,
+      entities: entities,
+      subscribers: [],
+      migrations: [],
+    })
+    await ds.initialize()
+    dataSources.set(key, ds)
+  } else {
+    // keep the connection pool, replace the entities of the last migration
+    ds.setOptions({ entities: entities })
+    await ds.buildMetadatas()
+  }
+  return ds
+}
+
+async function handle(req) {
+  const migration = require(req.module)
+  const ds = await getDataSource(req, migration.Entities)
+  return await migration.Run(ds, req.args)
+}
+
+let queue = Promise.resolve()
+const rl = readline.createInterface({ input: process.stdin })
+rl.on("line", (line) => {
+  const req = JSON.parse(line)
+  queue = queue.then(async () => {
+    try {
+      const result = await handle(req)
+      send(JSON.stringify({ id: req.id, code: 0, result: result }) + "\\n")
+    } catch (e) {
+      console.error(e)
+      const error = e instanceof Error ? e.stack || e.message : String(e)
+      send(JSON.stringify({ id: req.id, code: 1, error: error }) + "\\n")
+    }
+  })
+})
+rl.on("close", () => {
+  queue.then(async () => {
+    for (const ds of dataSources.values()) {
+      await ds.destroy()
+    }
+    process.exit(0)
+  })
+})
+"""
+
+
+class NodeWorker:
+    """
+    A long-lived node process running the compiled typescript migrations, so
+    that node, typeorm and the connection pool of each environment are
+    loaded once per migration run instead of once per migration.
+
+    The invocations share the process: a migration module is loaded once and
+    its module state is kept, the entities are rebuilt for each invocation.
+    The invocations are executed one at a time. If the worker exits, e.g. a
+    migration calls process.exit, the invocation fails and the next one
+    starts a new worker.
+    """
+
+    def __init__(self, cwd: str) -> None:
+        # node resolves typeorm from the node_modules of the cwd
+        self.cwd = cwd
+        self._proc: Optional[subprocess.Popen] = None
+        self._next_id = 0
+        self._mutex = threading.Lock()
+
+    def _write_script(self) -> str:
+        script_dir = os.path.join(self.cwd, cli_env.CACHE_DIR, "typescript")
+        script_path = os.path.join(
+            script_dir, f"worker-{helper.sha1_encode([WORKER_JS])[:12]}.js"
+        )
+        if not os.path.exists(script_path):
+            os.makedirs(script_dir, exist_ok=True)
+            temp_path = f"{script_path}.{os.getpid()}"
+            with open(temp_path, "w") as f:
+                f.write(WORKER_JS)
+            os.replace(temp_path, script_path)
+        return script_path
+
+    def _start(self, config: helper.EnvConfig) -> subprocess.Popen:
+        script_path = self._write_script()
+        logger.debug("Starting node worker, %s", script_path)
+        return subprocess.Popen(
+            [cli_env.NODE_CMD_PATH, script_path],
+            cwd=self.cwd,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            text=True,
+            env=config.subprocess_env({consts.ENV_SDM_DATA_DIR: cli_env.SDM_DATA_DIR}),
+        )
+
+    def run(
+        self,
+        module: str,
+        config: helper.EnvConfig,
+        args: Dict,
+        logging: bool = False,
+    ) -> int:
+        """
+        Run the migration module on the environment,
+        return the result of its Run function
+        """
+        with self._mutex:
+            if self._proc is None or self._proc.poll() is not None:
+                self._proc = self._start(config)
+            self._next_id += 1
+            request = {
+                "id": self._next_id,
+                "module": module,
+                "connection": {
+                    "host": config.host,
+                    "port": config.port,
+                    "username": config.user,
+                    "password": cli_env.MYSQL_PWD,
+                    "database": config.schema,
+                },
+                "logging": logging,
+                "args": args,
+            }
+            try:
+                self._proc.stdin.write(json.dumps(request) + "\n")
+                self._proc.stdin.flush()
+                line = self._proc.stdout.readline()
+            except OSError:
+                line = ""
+            if line == "":
+                code = self._proc.wait()
+                self._proc = None
+                raise Exception(
+                    f"Node worker exited with code {code} while running {module}"
+                )
+            response = json.loads(line)
+            if response["id"] != request["id"]:
+                raise Exception(
+                    "Unexpected response of node worker, expected id"
+                    f" {request['id']}, got {response['id']}"
+                )
+            if response["code"] != 0:
+                raise Exception(
+                    f"Typescript migration {module} failed: {response['error']}"
+                )
+            return response["result"]
+
+    def close(self) -> None:
+        with self._mutex:
+            if self._proc is None:
+                return
+            proc, self._proc = self._proc, None
+            try:
+                # the worker closes the connection pools and exits on EOF
+                proc.stdin.close()
+                proc.wait(timeout=10)
+            except (OSError, subprocess.TimeoutExpired):
+                logger.warning("Node worker does not exit, killing it")
+                proc.kill()
+                proc.wait()
@@ -0,0 +1,95 @@
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from . import migration_plan as mp
+
+logger = logging.getLogger(__name__)
+
+
+class Prefetcher:
+    """
+    Prepare the upcoming plans in background threads while the current plan
+    executes, at most lookahead plans ahead of it.
+    The preparation has no side effects on the database, the plans are
+    still executed one by one by the caller, which calls ready() before
+    executing a plan. A failed preparation is only logged, the plan is
+    prepared again by its execution, which raises the error.
+    """
+
+    def __init__(
+        self,
+        prepare: Callable[[mp.MigrationPlan], None],
+        plans: List[mp.MigrationPlan],
+        lookahead: int,
+    ) -> None:
+        self.prepare = prepare
+        self.plans = plans
+        self.lookahead = lookahead
+        # seconds spent preparing the plans, in total
+        self.prepare_time = 0.0
+        # seconds the execution waited for the preparation, in total
+        self.wait_time = 0.0
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(lookahead, 1), thread_name_prefix="sdm-prefetch"
+        )
+        self._futures: Dict[int, Future] = {}
+        self._next = 0
+        self._mutex = threading.Lock()
+
+    def _prepare(self, plan: mp.MigrationPlan) -> None:
+        began = time.monotonic()
+        try:
+            self.prepare(plan)
+        finally:
+            with self._mutex:
+                self.prepare_time += time.monotonic() - began
+
+    def ready(self, index: int) -> None:
+        """
+        Block until the plan of index is prepared, and start preparing the
+        plans up to index + lookahead
+        """
+        while self._next < len(self.plans) and self._next <= index + self.lookahead:
+            self._futures[self._next] = self._executor.submit(
+                self._prepare, self.plans[self._next]
+            )
+            self._next += 1
+        future = self._futures.pop(index, None)
+        if future is None:
+            return
+        began = time.monotonic()
+        try:
+            future.result()
+        except Exception:
+            logger.warning(
+                "Failed to prepare %s ahead", self.plans[index], exc_info=True
+            )
+        self.wait_time += time.monotonic() - began
+
+    def hidden_time(self) -> float:
+        """
+        seconds of preparation overlapped with the execution
+        """
+        return max(self.prepare_time - self.wait_time, 0)
+
+    def close(self) -> None:
+        for future in self._futures.values():
+            future.cancel()
+        self._executor.shutdown(wait=True)
+        self._futures.clear()
+        if self._next > 0:
+            logger.info(
+                "Prepared %d plans ahead in %.2fs, %.2fs hidden behind the execution",
+                self._next,
+                self.prepare_time,
+                self.hidden_time(),
+            )
+
+    def __enter__(self) -> "Prefetcher":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
@@ -0,0 +1,178 @@
+import importlib.util
+import logging
+import multiprocessing
+import resource
+import threading
+import traceback
+from multiprocessing.connection import Connection
+from multiprocessing.process import BaseProcess
+from types import ModuleType
+from typing import Any, Dict, List, Tuple
+
+from . import err, helper
+from .db import db
+
+logger = logging.getLogger(__name__)
+
+# python migration modules by path and checksum, so that a migration and its
+# condition checks are imported once per process
+_python_modules: Dict[Tuple[str, str], ModuleType] = {}
+_python_modules_lock = threading.Lock()
+
+# seconds to wait for an idle worker to exit
+CLOSE_TIMEOUT = 10
+
+
+def load_python_module(path: str) -> ModuleType:
+    """
+    Import the python migration, the module is imported again only after the
+    file changes
+    """
+    sha1 = helper.SHA1Helper()
+    sha1.update_file([path])
+    key = (path, sha1.hexdigest())
+    with _python_modules_lock:
+        module = _python_modules.get(key)
+        if module is None:
+            spec = importlib.util.spec_from_file_location("run_python", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+            _python_modules[key] = module
+        return module
+
+
+def _worker_main(conn: Connection, memory_limit: int) -> None:
+    if memory_limit > 0:
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            # the pool is closed
+            return
+        try:
+            module = load_python_module(task["path"])
+            with db.make_session(
+                **task["connection"], echo=task["echo"], create_all_tables=False
+            ) as session:
+                result = module.run(session, args=task["args"])
+            conn.send((0, result))
+        except Exception:
+            conn.send((1, traceback.format_exc()))
+
+
+Worker = Tuple[BaseProcess, Connection]
+
+
+class PythonWorkerPool:
+    """
+    Run python migrations in a pool of worker processes, so that a leaky or
+    CPU-heavy migration doesn't slow down or crash sdm, and the migrations
+    started by the parallel schedulers run on multiple cores.
+
+    A worker runs one migration at a time, and keeps the imported modules
+    between migrations. A worker whose address space exceeds memory_limit
+    bytes fails the migration by MemoryError. A migration running longer than
+    timeout seconds fails and its worker is killed. A worker which exits or
+    is killed is replaced by a new one.
+    """
+
+    def __init__(self, size: int, memory_limit: int = 0, timeout: float = 0) -> None:
+        self.size = size
+        # 0 means unlimited
+        self.memory_limit = memory_limit
+        self.timeout = timeout
+        # the workers don't inherit the connections and threads of sdm
+        self._context = multiprocessing.get_context("spawn")
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle: List[Worker] = []
+        self._mutex = threading.Lock()
+
+    def _start(self) -> Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        proc = self._context.Process(
+            target=_worker_main,
+            args=(child_conn, self.memory_limit),
+            name="sdm-python-worker",
+            daemon=True,
+        )
+        proc.start()
+        child_conn.close()
+        logger.debug("Started python worker, pid=%d", proc.pid)
+        return proc, parent_conn
+
+    def _acquire(self) -> Worker:
+        with self._mutex:
+            while len(self._idle) > 0:
+                proc, conn = self._idle.pop()
+                if proc.is_alive():
+                    return proc, conn
+                conn.close()
+        return self._start()
+
+    def _stop(self, worker: Worker) -> None:
+        proc, conn = worker
+        if proc.is_alive():
+            proc.kill()
+        proc.join()
+        conn.close()
+
+    def run(
+        self,
+        path: str,
+        connection: Dict[str, Any],
+        args: Dict[str, str],
+        echo: bool = False,
+    ) -> int:
+        """
+        Run the python migration by a worker, return the result of its run
+        function. connection holds the arguments of db.make_session.
+        """
+        with self._slots:
+            worker = self._acquire()
+            proc, conn = worker
+            reusable = False
+            try:
+                try:
+                    conn.send(
+                        {
+                            "path": path,
+                            "connection": connection,
+                            "args": args,
+                            "echo": echo,
+                        }
+                    )
+                    if self.timeout > 0 and not conn.poll(self.timeout):
+                        raise err.PythonWorkerError(
+                            f"Python migration {path} timed out after"
+                            f" {self.timeout}s, killed worker pid={proc.pid}"
+                        )
+                    code, result = conn.recv()
+                except (EOFError, OSError):
+                    proc.join()
+                    raise err.PythonWorkerError(
+                        f"Python worker exited with code {proc.exitcode} while"
+                        f" running {path}"
+                    )
+                reusable = True
+            finally:
+                if reusable:
+                    with self._mutex:
+                        self._idle.append(worker)
+                else:
+                    self._stop(worker)
+        if code != 0:
+            raise err.PythonWorkerError(f"Python migration {path} failed: {result}")
+        return result
+
+    def close(self) -> None:
+        with self._mutex:
+            idle, self._idle = self._idle, []
+        for proc, conn in idle:
+            # the worker exits on EOF
+            conn.close()
+            proc.join(CLOSE_TIMEOUT)
+            if proc.is_alive():
+                logger.warning("Python worker does not exit, killing it")
+                proc.kill()
+                proc.join()
@@ -0,0 +1,268 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import Connection, Engine, text
+from sqlalchemy.exc import DBAPIError
+
+from . import helper
+
+logger = logging.getLogger(__name__)
+
+# information_schema tables describing the structure of a schema,
+#   (table, schema column, columns hashed per row)
+# Data changes don't change them, e.g. TABLE_ROWS and UPDATE_TIME are left out.
+FINGERPRINT_SOURCES: List[Tuple[str, str, List[str]]] = [
+    (
+        "SCHEMATA",
+        "SCHEMA_NAME",
+        ["DEFAULT_CHARACTER_SET_NAME", "DEFAULT_COLLATION_NAME"],
+    ),
+    (
+        "TABLES",
+        "TABLE_SCHEMA",
+        [
+            "TABLE_NAME",
+            "TABLE_TYPE",
+            "ENGINE",
+            "ROW_FORMAT",
+            "TABLE_COLLATION",
+            "CREATE_OPTIONS",
+            "TABLE_COMMENT",
+        ],
+    ),
+    (
+        "COLUMNS",
+        "TABLE_SCHEMA",
+        [
+            "TABLE_NAME",
+            "COLUMN_NAME",
+            "ORDINAL_POSITION",
+            "COLUMN_DEFAULT",
+            "IS_NULLABLE",
+            "COLUMN_TYPE",
+            "CHARACTER_SET_NAME",
+            "COLLATION_NAME",
+            "EXTRA",
+            "COLUMN_COMMENT",
+            "GENERATION_EXPRESSION",
+        ],
+    ),
+    (
+        "STATISTICS",
+        "TABLE_SCHEMA",
+        [
+            "TABLE_NAME",
+            "INDEX_NAME",
+            "SEQ_IN_INDEX",
+            "COLUMN_NAME",
+            "NON_UNIQUE",
+            "SUB_PART",
+            "INDEX_TYPE",
+            "INDEX_COMMENT",
+        ],
+    ),
+    (
+        "KEY_COLUMN_USAGE",
+        "TABLE_SCHEMA",
+        [
+            "CONSTRAINT_NAME",
+            "TABLE_NAME",
+            "COLUMN_NAME",
+            "ORDINAL_POSITION",
+            "REFERENCED_TABLE_SCHEMA",
+            "REFERENCED_TABLE_NAME",
+            "REFERENCED_COLUMN_NAME",
+        ],
+    ),
+    (
+        "REFERENTIAL_CONSTRAINTS",
+        "CONSTRAINT_SCHEMA",
+        ["CONSTRAINT_NAME", "TABLE_NAME", "UPDATE_RULE", "DELETE_RULE"],
+    ),
+    (
+        "PARTITIONS",
+        "TABLE_SCHEMA",
+        [
+            "TABLE_NAME",
+            "PARTITION_NAME",
+            "SUBPARTITION_NAME",
+            "PARTITION_METHOD",
+            "PARTITION_EXPRESSION",
+            "PARTITION_DESCRIPTION",
+        ],
+    ),
+    (
+        "ROUTINES",
+        "ROUTINE_SCHEMA",
+        ["ROUTINE_NAME", "ROUTINE_TYPE", "DEFINER", "CREATED", "LAST_ALTERED"],
+    ),
+    (
+        "TRIGGERS",
+        "TRIGGER_SCHEMA",
+        ["TRIGGER_NAME", "EVENT_OBJECT_TABLE", "DEFINER", "CREATED"],
+    ),
+    ("VIEWS", "TABLE_SCHEMA", ["TABLE_NAME", "VIEW_DEFINITION", "DEFINER"]),
+    (
+        "TABLE_CONSTRAINTS",
+        "CONSTRAINT_SCHEMA",
+        ["CONSTRAINT_NAME", "TABLE_NAME", "CONSTRAINT_TYPE", "ENFORCED"],
+    ),
+    ("CHECK_CONSTRAINTS", "CONSTRAINT_SCHEMA", ["CONSTRAINT_NAME", "CHECK_CLAUSE"]),
+    (
+        "EVENTS",
+        "EVENT_SCHEMA",
+        ["EVENT_NAME", "DEFINER", "STATUS", "CREATED", "LAST_ALTERED"],
+    ),
+]
+
+# NULL in the hashed rows
+NULL_VALUE = "\\N"
+
+# the sources available on a server by engine url, a server without a source
+# or a column doesn't have the feature, e.g. CHECK_CONSTRAINTS and ENFORCED
+# before mysql 8.0.16
+_available_sources: Dict[str, List[Tuple[str, str, List[str]]]] = {}
+_available_sources_lock = threading.Lock()
+
+
+def available_sources(conn: Connection) -> List[Tuple[str, str, List[str]]]:
+    key = conn.engine.url.render_as_string(hide_password=False)
+    with _available_sources_lock:
+        if key in _available_sources:
+            return _available_sources[key]
+    rows = conn.execute(
+        text(
+            "SELECT UPPER(TABLE_NAME), UPPER(COLUMN_NAME) FROM"
+            " information_schema.COLUMNS WHERE TABLE_SCHEMA = 'information_schema'"
+        )
+    ).all()
+    columns_of: Dict[str, Set[str]] = {}
+    for table, column in rows:
+        columns_of.setdefault(table, set()).add(column)
+    res = []
+    for table, schema_column, columns in FINGERPRINT_SOURCES:
+        existing = columns_of.get(table, set())
+        if schema_column not in existing:
+            logger.debug("information_schema.%s is not available", table)
+            continue
+        res.append((table, schema_column, [c for c in columns if c in existing]))
+    with _available_sources_lock:
+        _available_sources[key] = res
+    return res
+
+
+def fingerprint_sql(
+    sources: List[Tuple[str, str, List[str]]] = FINGERPRINT_SOURCES,
+) -> str:
+    """
+    One query returning, per source, the number of rows and the xor of the
+    64-bit hashes of the rows, like the chunk hash of sync
+    """
+    parts = []
+    for table, schema_column, columns in sources:
+        values = ", ".join(f"IFNULL(CAST(`{c}` AS CHAR), :null)" for c in columns)
+        parts.append(
+            "(SELECT CONCAT(COUNT(*), ':',"
+            " BIT_XOR(CAST(CONV(SUBSTRING(MD5(CONCAT_WS(CHAR(31 USING utf8mb4),"
+            f" {values})), 1, 16), 16, 10) AS UNSIGNED))) FROM"
+            f" information_schema.`{table}` WHERE `{schema_column}` = :schema)"
+        )
+    return "SELECT CONCAT_WS(',', " + ", ".join(parts) + ")"
+
+
+def schema_fingerprint(engine: Engine) -> Optional[str]:
+    """
+    return None if the schema can't be fingerprinted,
+    the snapshot is not cached then
+    """
+    try:
+        with engine.connect() as conn:
+            value = conn.execute(
+                text(fingerprint_sql(available_sources(conn))),
+                {"schema": engine.url.database, "null": NULL_VALUE},
+            ).scalar_one()
+    except DBAPIError as e:
+        logger.warning(
+            "Failed to fingerprint schema %s, not cached: %s",
+            engine.url.database,
+            e.orig,
+        )
+        return None
+    return helper.sha1_encode([value])
+
+
+def snapshot_key(engine: Engine, skeema_file_path: str) -> Optional[str]:
+    """
+    The key of a schema snapshot, which covers the structure of the schema
+    and the skeema options which format the snapshot,
+    return None if the schema can't be fingerprinted
+    """
+    fingerprint = schema_fingerprint(engine)
+    if fingerprint is None:
+        return None
+    sha1 = helper.SHA1Helper()
+    sha1.update_str([fingerprint, "\0"])
+    sha1.update_file([skeema_file_path])
+    return sha1.hexdigest()
+
+
+def _sql_files(dir_path: str) -> List[str]:
+    return [name for name in os.listdir(dir_path) if name.endswith(".sql")]
+
+
+class SchemaSnapshotCache:
+    """
+    The last pulled schema snapshot of each environment,
+    under cache_dir/<env>/<key>
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+
+    def _path(self, env: str, key: Optional[str] = None) -> str:
+        if key is None:
+            return os.path.join(self.cache_dir, env)
+        return os.path.join(self.cache_dir, env, key)
+
+    def restore(self, env: str, key: str, schema_dir: str) -> bool:
+        """
+        Replace the .sql files of schema_dir by the snapshot,
+        return False if the snapshot of the key is not cached
+        """
+        snapshot_dir = self._path(env, key)
+        if not os.path.isdir(snapshot_dir):
+            return False
+        for name in _sql_files(schema_dir):
+            os.remove(os.path.join(schema_dir, name))
+        for name in _sql_files(snapshot_dir):
+            shutil.copy(
+                os.path.join(snapshot_dir, name), os.path.join(schema_dir, name)
+            )
+        return True
+
+    def save(self, env: str, key: str, schema_dir: str) -> None:
+        """
+        Save the .sql files of schema_dir as the snapshot of the environment,
+        replacing its previous snapshot
+        """
+        env_dir = self._path(env)
+        os.makedirs(env_dir, exist_ok=True)
+        temp_dir = tempfile.mkdtemp(prefix="tmp-", dir=env_dir)
+        try:
+            for name in _sql_files(schema_dir):
+                shutil.copy(
+                    os.path.join(schema_dir, name), os.path.join(temp_dir, name)
+                )
+            os.rename(temp_dir, self._path(env, key))
+        except OSError:
+            # saved by another process meanwhile
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            if not os.path.isdir(self._path(env, key)):
+                raise
+        for name in os.listdir(env_dir):
+            if name != key:
+                shutil.rmtree(os.path.join(env_dir, name), ignore_errors=True)
@@ -0,0 +1,191 @@
+import difflib
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from tabulate import tabulate
+
+from . import helper
+
+CREATE_TABLE_RE = re.compile(
+    r"CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?`?([\w$]+)`?", re.IGNORECASE
+)
+
+# the states of a file, from the left side to the right side
+ADDED = "added"
+REMOVED = "removed"
+CHANGED = "changed"
+
+
+@dataclass(frozen=True)
+class SchemaFile:
+    sha1: str
+    # a file of a dump, or of the schema store
+    path: str
+
+    def read_lines(self) -> List[str]:
+        with open(self.path) as f:
+            return f.read().splitlines(keepends=True)
+
+
+def files_of_dir(dir_path: str) -> Dict[str, SchemaFile]:
+    """
+    the .sql files of a directory, by file name
+    """
+    res: Dict[str, SchemaFile] = {}
+    for name in os.listdir(dir_path):
+        if not name.endswith(".sql"):
+            continue
+        path = os.path.join(dir_path, name)
+        with open(path) as f:
+            res[name] = SchemaFile(sha1=helper.sha1_encode([f.read()]), path=path)
+    return res
+
+
+def files_of_index(index: List[Tuple[str, str]]) -> Dict[str, SchemaFile]:
+    """
+    the files of a schema index, (sha1, file name), read from the schema store
+    """
+    return {
+        name: SchemaFile(sha1=sha1, path=helper.sha1_to_path(sha1))
+        for sha1, name in index
+    }
+
+
+def table_names(lines: List[str]) -> List[str]:
+    return CREATE_TABLE_RE.findall("".join(lines))
+
+
+@dataclass
+class FileDiff:
+    name: str
+    state: str
+    # the tables created by the file on either side
+    tables: List[str]
+    added_lines: int
+    removed_lines: int
+    # unified diff, only kept if requested
+    diff: Optional[str] = None
+
+    def to_dict(self) -> Dict:
+        obj = {
+            "name": self.name,
+            "state": self.state,
+            "tables": self.tables,
+            "added_lines": self.added_lines,
+            "removed_lines": self.removed_lines,
+        }
+        if self.diff is not None:
+            obj["diff"] = self.diff
+        return obj
+
+
+@dataclass
+class SchemaDiff:
+    left: str
+    right: str
+    files: List[FileDiff] = field(default_factory=list)
+    # number of files identical on both sides
+    identical: int = 0
+
+    def has_diff(self) -> bool:
+        return len(self.files) > 0
+
+    def to_dict(self) -> Dict:
+        return {
+            "left": self.left,
+            "right": self.right,
+            "identical": self.identical,
+            "files": [f.to_dict() for f in self.files],
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.to_dict(), indent=4)
+
+    def to_text(self) -> str:
+        if not self.has_diff():
+            return (
+                f"No difference between {self.left} and {self.right},"
+                f" {self.identical} identical files"
+            )
+        lines = [
+            (
+                f"{len(self.files)} files differ between {self.left} and {self.right},"
+                f" {self.identical} identical files"
+            ),
+            tabulate(
+                [
+                    [
+                        f.name,
+                        f.state,
+                        ",".join(f.tables),
+                        f"+{f.added_lines}",
+                        f"-{f.removed_lines}",
+                    ]
+                    for f in self.files
+                ],
+                headers=["file", "state", "tables", "added", "removed"],
+                tablefmt="orgtbl",
+            ),
+        ]
+        for f in self.files:
+            if f.diff is not None:
+                lines.append(f.diff.rstrip("\n"))
+        return "\n".join(lines)
+
+
+def compare(
+    left: str,
+    left_files: Dict[str, SchemaFile],
+    right: str,
+    right_files: Dict[str, SchemaFile],
+    with_diff: bool = False,
+) -> SchemaDiff:
+    """
+    Compare the files of two schemas, the files with the same sha1 are
+    identical, only the other files are read and diffed
+    """
+    res = SchemaDiff(left=left, right=right)
+    for name in sorted(left_files.keys() | right_files.keys()):
+        left_file = left_files.get(name)
+        right_file = right_files.get(name)
+        if left_file is not None and right_file is not None:
+            if left_file.sha1 == right_file.sha1:
+                res.identical += 1
+                continue
+            state = CHANGED
+        else:
+            state = ADDED if left_file is None else REMOVED
+        left_lines = left_file.read_lines() if left_file is not None else []
+        right_lines = right_file.read_lines() if right_file is not None else []
+        diff_lines = list(
+            difflib.unified_diff(
+                left_lines, right_lines, f"left/{name}", f"right/{name}", n=4
+            )
+        )
+        # lines not ending with a newline, e.g. the last line of a file
+        diff_lines = [
+            line if line.endswith("\n") else line + "\n" for line in diff_lines
+        ]
+        tables = table_names(left_lines) + table_names(right_lines)
+        res.files.append(
+            FileDiff(
+                name=name,
+                state=state,
+                tables=sorted(set(tables)),
+                added_lines=sum(
+                    1
+                    for line in diff_lines
+                    if line.startswith("+") and not line.startswith("+++")
+                ),
+                removed_lines=sum(
+                    1
+                    for line in diff_lines
+                    if line.startswith("-") and not line.startswith("---")
+                ),
+                diff="".join(diff_lines) if with_diff else None,
+            )
+        )
+    return res
@@ -0,0 +1,292 @@
+import re
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# Statements which cause an implicit commit, or otherwise break out of the
+# current transaction, identified by their first keyword.
+# https://dev.mysql.com/doc/refman/8.0/en/implicit-commit.html
+IMPLICIT_COMMIT_KEYWORDS = {
+    "ALTER",
+    "ANALYZE",
+    "BEGIN",
+    "CACHE",
+    "CALL",  # the procedure may commit
+    "CHECK",
+    "COMMIT",
+    "CREATE",
+    "DROP",
+    "EXECUTE",  # a prepared statement, may be DDL
+    "FLUSH",
+    "GRANT",
+    "INSTALL",
+    "LOAD",
+    "LOCK",
+    "OPTIMIZE",
+    "PREPARE",  # the prepared statement may be DDL
+    "RENAME",
+    "REPAIR",
+    "RESET",
+    "REVOKE",
+    "ROLLBACK",
+    "START",
+    "TRUNCATE",
+    "UNINSTALL",
+    "UNLOCK",
+    "USE",  # changes the schema of the connection
+    "XA",
+}
+
+_QUOTES = "'\"`"
+_WORD = re.compile(r"[A-Za-z_]+")
+_CODE_WORD = re.compile(r"[A-Za-z0-9_$]+")
+_MYSQL_VERSION_COMMENT = re.compile(r"/\*!\d*")
+# the DELIMITER command of mysql client, e.g. "DELIMITER $$"
+_DELIMITER_COMMAND = re.compile(r"^\s*DELIMITER\s+(\S+)\s*$", re.IGNORECASE)
+
+# The bodies of these stored programs may contain ";" without DELIMITER,
+#   the BEGIN ... END blocks are tracked to find the end of the statement.
+ROUTINE_KEYWORDS = {"PROCEDURE", "FUNCTION", "TRIGGER", "EVENT"}
+# "END IF", "END LOOP" ... close the blocks which are not counted
+_UNCOUNTED_END_KEYWORDS = {"IF", "LOOP", "WHILE", "REPEAT"}
+
+
+class StatementSplitter:
+    """
+    Split SQL text into statements, the text is fed line by line so that
+    arbitrarily large files can be split with bounded memory.
+    Quotes, comments, the DELIMITER command and the bodies of stored programs
+    are respected.
+    """
+
+    def __init__(self, delimiter: str = ";"):
+        self.delimiter = delimiter
+        # number of lines fed
+        self.line_no = 0
+        self._buf: List[str] = []
+        self._has_code = False
+        self._start_line = 0
+        self._quote: Optional[str] = None
+        self._block_comment = False
+        self._special = self._compile_special()
+        self._reset_block()
+
+    def _reset_block(self) -> None:
+        self._words = 0
+        self._create = False
+        self._routine = False
+        self._depth = 0
+        self._pending_end = False
+
+    def _compile_special(self) -> re.Pattern:
+        return re.compile(
+            "|".join(
+                [re.escape(c) for c in _QUOTES]
+                + [r"#", r"--", r"/\*", re.escape(self.delimiter)]
+            )
+        )
+
+    def feed(self, line: str) -> List[str]:
+        """
+        feed one line (including the line break), return the completed statements
+        """
+        return [statement for _, statement in self.feed_numbered(line)]
+
+    def feed_numbered(self, line: str) -> List[Tuple[int, str]]:
+        """
+        same as feed, but return (start line number, statement)
+        """
+        self.line_no += 1
+        statements: List[Tuple[int, str]] = []
+        if self._quote is None and not self._block_comment and not self._has_code:
+            m = _DELIMITER_COMMAND.match(line)
+            if m is not None:
+                # client command, not sent to the server
+                self.delimiter = m.group(1)
+                self._special = self._compile_special()
+                return statements
+        i = 0
+        n = len(line)
+        while i < n:
+            if self._block_comment:
+                end = line.find("*/", i)
+                if end == -1:
+                    self._buf.append(line[i:])
+                    break
+                self._buf.append(line[i : end + 2])
+                self._block_comment = False
+                i = end + 2
+                continue
+            if self._quote is not None:
+                i = self._consume_quoted(line, i)
+                continue
+            m = self._special.search(line, i)
+            if m is None:
+                self._append_code(line[i:])
+                break
+            self._append_code(line[i : m.start()])
+            token = m.group(0)
+            i = m.end()
+            if token in _QUOTES:
+                self._quote = token
+                self._append_code(token)
+            elif token == "#":
+                self._buf.append(line[m.start() :])
+                break
+            elif token == "--":
+                if i < n and line[i] not in " \t\r\n":
+                    # "--" is only a comment if followed by whitespace
+                    self._append_code(token)
+                    continue
+                self._buf.append(line[m.start() :])
+                break
+            elif token == "/*":
+                self._block_comment = True
+                self._buf.append(token)
+                if i < n and line[i] == "!":
+                    # mysql executable comment, e.g. /*!40000 ALTER TABLE ... */
+                    self._has_code = True
+            else:
+                if self._in_routine_body():
+                    self._append_code(token)
+                    continue
+                statement = self._pop_statement()
+                if statement is not None:
+                    statements.append(statement)
+        return statements
+
+    def _consume_quoted(self, line: str, i: int) -> int:
+        n = len(line)
+        while i < n:
+            c = line[i]
+            if c == "\\" and self._quote != "`":
+                self._buf.append(line[i : i + 2])
+                i += 2
+                continue
+            if c == self._quote:
+                if i + 1 < n and line[i + 1] == self._quote:
+                    # doubled quote
+                    self._buf.append(line[i : i + 2])
+                    i += 2
+                    continue
+                self._buf.append(c)
+                self._quote = None
+                return i + 1
+            self._buf.append(c)
+            i += 1
+        return i
+
+    def _append_code(self, s: str) -> None:
+        if s == "":
+            return
+        self._buf.append(s)
+        if not self._has_code and not s.isspace():
+            self._has_code = True
+            self._start_line = self.line_no
+        if self.delimiter == ";":
+            # with a custom delimiter, the bodies are delimited explicitly
+            self._track_blocks(s)
+
+    def _track_blocks(self, s: str) -> None:
+        for m in _CODE_WORD.finditer(s):
+            word = m.group(0).upper()
+            self._words += 1
+            if self._pending_end:
+                self._pending_end = False
+                if word in _UNCOUNTED_END_KEYWORDS:
+                    continue
+                self._depth -= 1
+                if word == "CASE":
+                    # END CASE
+                    continue
+            if self._words == 1:
+                self._create = word == "CREATE"
+            elif not self._routine:
+                self._routine = self._create and word in ROUTINE_KEYWORDS
+            elif word in ("BEGIN", "CASE"):
+                self._depth += 1
+            elif word == "END":
+                self._pending_end = True
+
+    def _in_routine_body(self) -> bool:
+        if self._pending_end:
+            self._pending_end = False
+            self._depth -= 1
+        return self._routine and self._depth > 0
+
+    def _pop_statement(self) -> Optional[Tuple[int, str]]:
+        statement = "".join(self._buf).strip()
+        has_code = self._has_code
+        self._buf = []
+        self._has_code = False
+        self._reset_block()
+        return (self._start_line, statement) if has_code else None
+
+    def finish(self) -> Optional[str]:
+        """
+        return the last statement which is not terminated by the delimiter
+        """
+        last = self.finish_numbered()
+        return last[1] if last is not None else None
+
+    def finish_numbered(self) -> Optional[Tuple[int, str]]:
+        return self._pop_statement()
+
+
+def iter_numbered_statements(lines: Iterable[str]) -> Iterator[Tuple[int, str]]:
+    """
+    yield (start line number, statement), only the current statement is
+    kept in memory
+    """
+    splitter = StatementSplitter()
+    for line in lines:
+        for numbered in splitter.feed_numbered(line):
+            yield numbered
+    last = splitter.finish_numbered()
+    if last is not None:
+        yield last
+
+
+def iter_statements(lines: Iterable[str]) -> Iterator[str]:
+    for _, statement in iter_numbered_statements(lines):
+        yield statement
+
+
+def split_statements(sql: str) -> List[str]:
+    return list(iter_statements(sql.splitlines(keepends=True)))
+
+
+def first_keyword(statement: str) -> str:
+    """
+    return the first keyword in upper case, comments are skipped
+    """
+    s = _MYSQL_VERSION_COMMENT.sub(" ", statement)
+    i = 0
+    n = len(s)
+    while i < n:
+        if s[i].isspace() or s[i] == "(":
+            i += 1
+        elif s.startswith("--", i) or s[i] == "#":
+            end = s.find("\n", i)
+            i = n if end == -1 else end + 1
+        elif s.startswith("/*", i):
+            end = s.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+        else:
+            m = _WORD.match(s, i)
+            return m.group(0).upper() if m else ""
+    return ""
+
+
+def is_implicit_commit(statement: str) -> bool:
+    keyword = first_keyword(statement)
+    if keyword in IMPLICIT_COMMIT_KEYWORDS:
+        return True
+    if keyword == "SET":
+        # SET autocommit = 1 commits, SET TRANSACTION is not allowed
+        #   inside a transaction
+        upper = statement.upper()
+        return "AUTOCOMMIT" in upper or "TRANSACTION" in upper
+    return False
+
+
+def has_implicit_commit(sql: str) -> bool:
+    return any(is_implicit_commit(s) for s in split_statements(sql))
@@ -0,0 +1,72 @@
+import logging
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence
+
+from sqlalchemy import Row, column, table, text
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# helpers for python migrations moving many rows with bounded memory
+DEFAULT_BATCH_SIZE = 1000
+
+
+def stream_rows(
+    session: Session,
+    sql: str,
+    params: Optional[Dict[str, Any]] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+) -> Iterator[Sequence[Row]]:
+    """
+    Yield the rows of the query in batches of batch_size rows, read by a
+    server-side cursor, so that at most one batch is held in memory.
+    The query is executed on its own connection from the engine of the
+    session, the session can write while the rows are streamed.
+    """
+    with session.get_bind().connect() as conn:
+        result = conn.execution_options(
+            stream_results=True, yield_per=batch_size
+        ).execute(text(sql), params or {})
+        for rows in result.partitions():
+            yield rows
+
+
+def upsert_rows(
+    session: Session,
+    table_name: str,
+    rows: Iterable[Dict[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    update_columns: Optional[List[str]] = None,
+) -> int:
+    """
+    INSERT ... ON DUPLICATE KEY UPDATE the rows, batch_size rows per
+    executemany, and commit each batch, so that the rows can be generated
+    lazily, e.g. from stream_rows.
+    The columns are the keys of the first row, update_columns defaults to all
+    of them. return the number of rows written.
+    """
+    count = 0
+    batch: List[Dict[str, Any]] = []
+    stmt = None
+    for row in rows:
+        if stmt is None:
+            columns = list(row.keys())
+            stmt = mysql.insert(table(table_name, *[column(c) for c in columns]))
+            stmt = stmt.on_duplicate_key_update(
+                {
+                    c: stmt.inserted[c]
+                    for c in (update_columns if update_columns else columns)
+                }
+            )
+        batch.append(row)
+        if len(batch) >= batch_size:
+            session.execute(stmt, batch)
+            session.commit()
+            count += len(batch)
+            batch.clear()
+            logger.debug("Upserted %d rows into %s", count, table_name)
+    if len(batch) > 0:
+        session.execute(stmt, batch)
+        session.commit()
+        count += len(batch)
+    return count
@@ -0,0 +1,192 @@
+import logging
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+
+from sqlalchemy import Engine, text
+from sqlalchemy.exc import DBAPIError
+
+from . import err, helper
+from .db import db
+from .env import cli_env
+
+logger = logging.getLogger(__name__)
+
+
+def parse_replicas(replicas: str) -> List[Tuple[str, int]]:
+    """
+    parse "host1:port1,host2" to [(host1, port1), (host2, 3306)]
+    """
+    res: List[Tuple[str, int]] = []
+    for replica in replicas.split(","):
+        replica = replica.strip()
+        if replica == "":
+            continue
+        host, _, port = replica.partition(":")
+        res.append((host, int(port) if port != "" else 3306))
+    return res
+
+
+class Throttle:
+    """
+    Pause the migration while the replicas lag behind or the primary is busy.
+    The migration calls wait() between plans and between chunks, the load is
+    checked at most once per check_interval while it is healthy.
+    """
+
+    def __init__(
+        self,
+        primary: Engine,
+        replicas: List[Engine],
+        max_replica_lag: int = 0,
+        max_threads_running: int = 0,
+        check_interval: float = 1,
+        max_wait: int = 600,
+    ) -> None:
+        self.primary = primary
+        self.replicas = replicas
+        # 0 means not checked
+        self.max_replica_lag = max_replica_lag
+        self.max_threads_running = max_threads_running
+        self.check_interval = check_interval
+        # negative value means waiting forever
+        self.max_wait = max_wait
+        # seconds spent waiting, in total
+        self.throttle_time = 0.0
+        self._last_check: Optional[float] = None
+        # the workers of parallel migrations wait together
+        self._mutex = threading.Lock()
+        # replicas which turn out not to be replicas
+        self._not_replicas: Set[str] = set()
+
+    @classmethod
+    def from_env(cls, env: str) -> Optional["Throttle"]:
+        """
+        return None if throttling is not configured
+        """
+        if cli_env.THROTTLE_MAX_REPLICA_LAG <= 0 and (
+            cli_env.THROTTLE_MAX_THREADS_RUNNING <= 0
+        ):
+            return None
+        config = helper.get_env_config(env)
+        primary = db.get_engine(
+            host=config.host,
+            port=config.port,
+            user=config.user,
+            password=cli_env.MYSQL_PWD,
+            schema=config.schema,
+        )
+        replicas = [
+            db.get_engine(
+                host=host,
+                port=port,
+                user=config.user,
+                password=cli_env.MYSQL_PWD,
+                schema=config.schema,
+            )
+            for host, port in parse_replicas(cli_env.THROTTLE_REPLICAS)
+        ]
+        return cls(
+            primary,
+            replicas,
+            max_replica_lag=cli_env.THROTTLE_MAX_REPLICA_LAG,
+            max_threads_running=cli_env.THROTTLE_MAX_THREADS_RUNNING,
+            check_interval=cli_env.THROTTLE_CHECK_INTERVAL,
+            max_wait=cli_env.THROTTLE_MAX_WAIT,
+        )
+
+    def replica_lag(self, replica: Engine) -> Optional[int]:
+        """
+        return None if the server is not a replica
+        """
+        with replica.connect() as conn:
+            try:
+                row = conn.execute(text("SHOW REPLICA STATUS")).one_or_none()
+            except DBAPIError:
+                # before mysql 8.0.22
+                row = conn.execute(text("SHOW SLAVE STATUS")).one_or_none()
+        if row is None:
+            return None
+        status = row._mapping
+        lag = (
+            status["Seconds_Behind_Source"]
+            if "Seconds_Behind_Source" in status
+            else status["Seconds_Behind_Master"]
+        )
+        # NULL means the replication is not running, the lag is unknown
+        return int(lag) if lag is not None else -1
+
+    def threads_running(self) -> int:
+        with self.primary.connect() as conn:
+            row = conn.execute(text("SHOW GLOBAL STATUS LIKE 'Threads_running'")).one()
+        return int(row[1])
+
+    def check(self) -> Optional[str]:
+        """
+        return the reason to throttle, None if the servers are healthy
+        """
+        if self.max_threads_running > 0:
+            threads_running = self.threads_running()
+            if threads_running > self.max_threads_running:
+                return (
+                    f"Threads_running={threads_running} of the primary exceeds"
+                    f" {self.max_threads_running}"
+                )
+        if self.max_replica_lag > 0:
+            for replica in self.replicas:
+                lag = self.replica_lag(replica)
+                if lag is None:
+                    if str(replica.url) not in self._not_replicas:
+                        self._not_replicas.add(str(replica.url))
+                        logger.warning(
+                            "%s:%s is not a replica, its lag is not checked",
+                            replica.url.host,
+                            replica.url.port,
+                        )
+                    continue
+                if lag < 0:
+                    return (
+                        f"Replication of {replica.url.host}:{replica.url.port} is"
+                        " not running"
+                    )
+                if lag > self.max_replica_lag:
+                    return (
+                        f"Replica {replica.url.host}:{replica.url.port} lags"
+                        f" {lag}s behind, exceeds {self.max_replica_lag}s"
+                    )
+        return None
+
+    def wait(self) -> float:
+        """
+        Block until the servers are healthy,
+        return the seconds waited, 0 if not throttled.
+        """
+        with self._mutex:
+            return self._wait()
+
+    def _wait(self) -> float:
+        began = time.monotonic()
+        if (
+            self._last_check is not None
+            and began - self._last_check < self.check_interval
+        ):
+            return 0
+        reason = self.check()
+        if reason is None:
+            self._last_check = time.monotonic()
+            return 0
+        while reason is not None:
+            waited = time.monotonic() - began
+            if self.max_wait >= 0 and waited >= self.max_wait:
+                self.throttle_time += waited
+                raise err.ThrottleError(
+                    f"Throttled for {waited:.1f}s, exceeds {self.max_wait}s: {reason}"
+                )
+            logger.info("Throttling the migration, %s", reason)
+            time.sleep(self.check_interval)
+            reason = self.check()
+        self._last_check = time.monotonic()
+        waited = self._last_check - began
+        self.throttle_time += waited
+        logger.info("Resuming the migration after throttled for %.1fs", waited)
+        return waited
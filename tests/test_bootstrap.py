@@ -0,0 +1,57 @@
+import logging
+
+from sqlalchemy import event, text
+
+from migration import helper
+from migration.db import db, model, upgrade
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+def test_bootstrap_once_per_engine(sort_plan_by_version):
+    logger.info("=== start === test_bootstrap_once_per_engine")
+    tc.init_workspace()
+
+    cli = tc.make_cli()
+    dao = cli.build_dao()
+    with dao.session.begin():
+        version = upgrade.read_bookkeeping_version(dao.session.connection())
+        assert version == model.BOOKKEEPING_VERSION
+
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = dao.session.bind
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        session = helper.build_session_from_env("dev")
+        assert session.bind is engine
+        # the bookkeeping tables are not checked again
+        assert statements == []
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_bootstrap_upgrade_when_version_changes(sort_plan_by_version):
+    logger.info("=== start === test_bootstrap_upgrade_when_version_changes")
+    tc.init_workspace()
+
+    cli = tc.make_cli()
+    dao = cli.build_dao()
+    with dao.session.begin():
+        dao.session.execute(
+            text(f"delete from {model.MigrationHistoryMeta.__tablename__};")
+        )
+        dao.commit()
+    db.forget_bootstrap(dao.session.bind)
+
+    dao = cli.build_dao()
+    with dao.session.begin():
+        version = upgrade.read_bookkeeping_version(dao.session.connection())
+        assert version == model.BOOKKEEPING_VERSION
+        hists = dao.get_all()
+        assert len(hists) == 1
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+
+import pytest
+from sqlalchemy import select, text
+
+from migration import migration_plan as mp
+from migration.db import db, hist_dao, model
+from migration.env import cli_env
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture(params=[0, 1], ids=["insert", "load_data"])
+def local_infile(request):
+    # the dev environment
+    session = db.make_session(
+        host=cli_env.UNITTEST_MYSQL_HOST2,
+        port=cli_env.UNITTEST_MYSQL_PORT2,
+        user="root",
+        password=cli_env.MYSQL_PWD,
+        schema="mysql",
+        create_all_tables=False,
+    )
+    value = session.execute(text("SELECT @@GLOBAL.local_infile")).scalar_one()
+    session.execute(text(f"SET GLOBAL local_infile = {request.param}"))
+    yield request.param
+    session.execute(text(f"SET GLOBAL local_infile = {value}"))
+    session.close()
+
+
+def make_bulk_load_plan(content: str, batch_size: int = 7) -> mp.MigrationPlan:
+    with open(
+        os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, "test_data.csv"), "w"
+    ) as f:
+        f.write(content)
+    cli = tc.make_cli({"name": "load_test_data", "type": "bulk_load"})
+    cli.make_data_migration()
+    data_plan = cli.read_migration_plans().get_plan_by_index(-1)
+    data_plan.change.forward.file = "test_data.csv"
+    data_plan.change.forward.load.batch_size = batch_size
+    data_plan.change.backward.file = "test_data.csv"
+    data_plan.change.backward.load.batch_size = batch_size
+    data_plan.save()
+    return data_plan
+
+
+def get_last_progress(cli) -> dict:
+    logs = cli.dao.session.scalars(
+        select(model.MigrationHistoryLog)
+        .where(model.MigrationHistoryLog.operation == hist_dao.Operation.PROGRESS)
+        .order_by(model.MigrationHistoryLog.id)
+    ).all()
+    return json.loads(logs[-1].get_snapshot())
+
+
+def test_bulk_load(sort_plan_by_version, local_infile):
+    logger.info("=== start === test_bulk_load")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1000, 'kept');",
+        "delete from testtable where id = 1000;",
+    )
+    rows = "".join(f'{i},"name,{i}"\n' for i in range(1, 50))
+    make_bulk_load_plan(f"id,name\n{rows}50,\\N\n")
+
+    cli = tc.migrate_dev()
+    tc.check_len_hists_row(cli, len_hists=4, len_row=51)
+    with cli.dao.session.begin():
+        session = cli.dao.session
+        assert (
+            session.execute(text("select name from testtable where id = 7;")).scalar()
+            == "name,7"
+        )
+        assert (
+            session.execute(text("select name from testtable where id = 50;")).scalar()
+            is None
+        )
+        progress = get_last_progress(cli)
+        assert progress["rows"] == 50
+        assert progress["method"] == ("load_data" if local_infile else "insert")
+
+    # the loaded rows are deleted by key
+    cli = tc.make_cli({"environment": "dev", "version": "0002"})
+    cli.rollback()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=1)
+
+
+def test_bulk_load_resume(sort_plan_by_version, local_infile):
+    logger.info("=== start === test_bulk_load_resume")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (10, 'conflict');",
+        "delete from testtable where id = 10;",
+    )
+    rows = "".join(f"{i},seed\n" for i in range(1, 21))
+    make_bulk_load_plan(f"id,name\n{rows}")
+
+    with pytest.raises(Exception):
+        tc.migrate_dev()
+    cli = tc.make_cli()
+    cli.build_dao()
+    # LOAD DATA is atomic, the batches before the conflict are committed
+    tc.check_len_hists_row(cli, len_hists=4, len_row=1 if local_infile else 8)
+    with cli.dao.session.begin():
+        cli.dao.session.execute(text("delete from testtable where id = 10;"))
+
+    cli = tc.make_cli({"environment": "dev", "subcommand": "migrate"})
+    cli.fix_migrate()
+    tc.check_len_hists_row(cli, len_hists=4, len_row=20)
@@ -0,0 +1,124 @@
+import json
+import logging
+
+import pytest
+from sqlalchemy import select, text
+
+from migration import migration_plan as mp
+from migration.db import hist_dao, model
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+def make_chunked_plan() -> mp.MigrationPlan:
+    cli = tc.make_cli({"name": "update_test_data", "type": "sql_chunked"})
+    cli.make_data_migration()
+    data_plan = cli.read_migration_plans().get_plan_by_index(-1)
+    data_plan.change.forward.sql = (
+        "UPDATE testtable SET name = 'updated' WHERE id >= :start AND id < :end"
+    )
+    data_plan.change.forward.chunk = mp.ChunkConfig(
+        table="testtable", key="id", chunk_size=7, min_chunk_size=1
+    )
+    data_plan.change.backward = mp.DataBackward(
+        type=mp.DataChangeType.SQL_CHUNKED,
+        sql="UPDATE testtable SET name = 'seed' WHERE id >= :start AND id < :end",
+        chunk=mp.ChunkConfig(table="testtable", key="id", chunk_size=20),
+    )
+    data_plan.save()
+    return data_plan
+
+
+def test_chunked_migration(sort_plan_by_version):
+    logger.info("=== start === test_chunked_migration")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    # sparse keys
+    values = ", ".join(f"({i * 3}, 'seed')" for i in range(1, 51))
+    tc.make_data_migration_plan(
+        f"insert into testtable (id, name) values {values};",
+        "delete from testtable;",
+    )
+    make_chunked_plan()
+
+    cli = tc.migrate_dev()
+    with cli.dao.session.begin():
+        session = cli.dao.session
+        rows = session.execute(text("select name from testtable;")).all()
+        assert len(rows) == 50
+        assert all(row[0] == "updated" for row in rows)
+
+        logs = session.scalars(
+            select(model.MigrationHistoryLog)
+            .where(model.MigrationHistoryLog.operation == hist_dao.Operation.PROGRESS)
+            .order_by(model.MigrationHistoryLog.id)
+        ).all()
+        assert len(logs) > 0
+        last_progress = json.loads(logs[-1].get_snapshot())
+        assert last_progress["rows"] == 50
+        assert last_progress["last_key"] == 150
+
+    cli = tc.make_cli({"environment": "dev", "version": "0002"})
+    cli.rollback()
+    with cli.dao.session.begin():
+        rows = cli.dao.session.execute(text("select name from testtable;")).all()
+        assert all(row[0] == "seed" for row in rows)
+
+
+def test_chunked_migration_resume(sort_plan_by_version):
+    logger.info("=== start === test_chunked_migration_resume")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    values = ", ".join(f"({i}, 'seed')" for i in range(1, 51))
+    tc.make_data_migration_plan(
+        f"insert into testtable (id, name) values {values};",
+        "delete from testtable;",
+    )
+    tc.make_data_migration_plan(
+        "create table testtable2 (id int primary key, name varchar(255));",
+        "drop table testtable2;",
+    )
+    # the copy fails at the conflicting row
+    tc.make_data_migration_plan(
+        "insert into testtable2 (id, name) values (30, 'conflict');",
+        "delete from testtable2;",
+    )
+    tc.migrate_dev()
+    cli = tc.make_cli({"name": "copy_test_data", "type": "sql_chunked"})
+    cli.make_data_migration()
+    data_plan = cli.read_migration_plans().get_plan_by_index(-1)
+    data_plan.change.forward.sql = (
+        "INSERT INTO testtable2 (id, name) SELECT id, name FROM testtable"
+        " WHERE id >= :start AND id < :end"
+    )
+    data_plan.change.forward.chunk = mp.ChunkConfig(
+        table="testtable",
+        key="id",
+        chunk_size=10,
+        min_chunk_size=10,
+        max_chunk_size=10,
+    )
+    data_plan.save()
+
+    with pytest.raises(Exception):
+        tc.migrate_dev()
+    cli = tc.make_cli()
+    cli.build_dao()
+    with cli.dao.session.begin():
+        session = cli.dao.session
+        progress = session.scalars(select(model.MigrationHistoryProgress)).one()
+        assert int(progress.last_key) == 20
+        assert progress.rows == 20
+        session.execute(text("delete from testtable2 where id = 30;"))
+
+    # the committed chunks are not copied again
+    cli = tc.make_cli({"environment": "dev", "subcommand": "migrate"})
+    cli.fix_migrate()
+    with cli.dao.session.begin():
+        session = cli.dao.session
+        assert session.execute(text("select count(*) from testtable2;")).scalar() == 50
+        progress = session.scalars(select(model.MigrationHistoryProgress)).one()
+        assert int(progress.last_key) == 50
+        assert progress.rows == 50
@@ -0,0 +1,122 @@
+import logging
+
+import pytest
+from sqlalchemy import text
+
+from migration import migration_plan as mp
+from migration.db import model
+from migration.env import cli_env
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+def make_plans(forward_sql: str = "insert into testtable (id, name) values (3, 'c')"):
+    """
+    0001 <- 0002 (slow)
+         <- 0003
+    0002, 0003 <- 0004
+    """
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) select 2, 'b' from (select sleep(1)) t",
+        "delete from testtable where id = 2",
+    )
+    plan = tc.make_data_migration_plan(
+        forward_sql, "delete from testtable where id = 3"
+    )
+    plan.dependencies = [mp.MigrationSignature(version="0001", name="new_test_table")]
+    plan.save()
+    plan = tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (4, 'd')",
+        "delete from testtable where id = 4",
+    )
+    plan.dependencies = [
+        mp.MigrationSignature(version="0002", name="insert_test_data"),
+        mp.MigrationSignature(version="0003", name="insert_test_data"),
+    ]
+    plan.save()
+
+
+def get_applied_vers(cli) -> list:
+    with cli.dao.session.begin():
+        return [h.ver for h in cli.dao.get_all_versioned()]
+
+
+def test_dag_migration(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_dag_migration")
+    monkeypatch.setattr(cli_env, "VERSIONED_PARALLELISM", 3)
+    make_plans()
+
+    cli = tc.migrate_dev()
+    tc.check_len_hists_row(cli, len_hists=5, len_row=3)
+    # the histories are in completion order
+    assert get_applied_vers(cli) == ["0000", "0001", "0003", "0002", "0004"]
+    assert cli.dao.get_versioned_head() == (5, cli.mpm.get_chain_checksum(5))
+
+    # rollback in reverse completion order
+    cli = tc.make_cli({"environment": "dev", "version": "0001"})
+    cli.rollback()
+    tc.check_len_hists_row(cli, len_hists=2, len_row=0)
+    assert cli.dao.get_versioned_head() == (2, cli.mpm.get_chain_checksum(2))
+
+    # migrate to the target and its dependencies only
+    cli = tc.make_cli({"environment": "dev", "version": "0003"})
+    cli.migrate()
+    tc.check_len_hists_row(cli, len_hists=4, len_row=2)
+
+
+def execute_sql(sql: str):
+    cli = tc.make_cli()
+    cli.build_dao()
+    with cli.dao.session.begin():
+        cli.dao.session.execute(text(sql))
+    cli.dao.session.close()
+
+
+def test_dag_migration_failure(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_dag_migration_failure")
+    monkeypatch.setattr(cli_env, "VERSIONED_PARALLELISM", 3)
+    make_plans()
+    cli = tc.make_cli({"environment": "dev", "version": "0001"})
+    cli.migrate()
+    # 0003 fails because of the duplicate key
+    execute_sql("insert into testtable (id, name) values (3, 'x')")
+
+    with pytest.raises(Exception):
+        tc.migrate_dev()
+    cli = tc.make_cli()
+    cli.build_dao()
+    with cli.dao.session.begin():
+        states = {h.ver: h.state for h in cli.dao.get_all_versioned()}
+    # the running plan is finished, the dependent plan is not started
+    assert states["0002"] == model.MigrationState.SUCCESSFUL
+    assert states["0003"] == model.MigrationState.PROCESSING
+    assert "0004" not in states
+
+    execute_sql("delete from testtable where id = 3")
+    cli = tc.make_cli()
+    cli.fix_migrate()
+    tc.migrate_and_check(len_hists=5, len_row=3)
+
+
+def test_dag_repeatable_migration(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_dag_repeatable_migration")
+    monkeypatch.setattr(cli_env, "VERSIONED_PARALLELISM", 3)
+    make_plans()
+    tc.make_repeatable_migration_plan(
+        dependencies=[
+            mp.MigrationSignature(version="0002", name="insert_test_data"),
+            mp.MigrationSignature(version="0003", name="insert_test_data"),
+        ]
+    )
+
+    # the second dependency 0003 is not applied
+    cli = tc.make_cli({"environment": "dev", "version": "0002"})
+    cli.migrate()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=1)
+
+    cli = tc.migrate_dev()
+    tc.check_len_hists_row(cli, len_hists=6, len_row=4)
@@ -0,0 +1,128 @@
+import logging
+
+import pytest
+from sqlalchemy import text
+
+from migration import err
+from migration.db import model
+from migration.env import cli_env
+
+from . import testcommon as tc
+from .test_sql_file import make_sql_file_plan
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def fused(monkeypatch):
+    monkeypatch.setattr(cli_env, "FUSED_SQL_MIGRATION", 1)
+    monkeypatch.setattr(cli_env, "FUSED_SQL_BATCH_LIMIT", 10)
+
+
+def test_fused_migration(sort_plan_by_version, fused):
+    logger.info("=== start === test_fused_migration")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');",
+        "delete from testtable where id = 1;",
+    )
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (2, 'foo.baz');",
+        "delete from testtable where id = 2;",
+    )
+    # contains DDL, fallback to the safe path
+    tc.make_data_migration_plan(
+        "create table testtable2 (id int primary key);",
+        "drop table testtable2;",
+    )
+
+    cli = tc.migrate_dev()
+    assert cli.migrator.get_fusable_statements(cli.mpm.get_plan_by_index(2)) is not None
+    assert cli.migrator.get_fusable_statements(cli.mpm.get_plan_by_index(4)) is None
+    tc.check_len_hists_row(cli, len_hists=5, len_row=2)
+    with cli.dao.session.begin():
+        cli.dao.session.execute(text("select id from testtable2;")).all()
+
+
+def test_fused_migration_rollback_whole_batch(sort_plan_by_version, fused):
+    logger.info("=== start === test_fused_migration_rollback_whole_batch")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.migrate_dev()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');",
+        "delete from testtable where id = 1;",
+    )
+    # duplicate primary key
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.baz');",
+        "delete from testtable where id = 1;",
+    )
+
+    with pytest.raises(Exception):
+        tc.migrate_dev()
+
+    # the batch is rolled back together with its histories
+    cli = tc.make_cli()
+    cli.build_dao()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=0)
+    with cli.dao.session.begin():
+        hist = cli.dao.get_latest()
+        assert hist.ver == "0002"
+        assert hist.state == model.MigrationState.PROCESSING
+
+
+def test_fused_migration_statements(sort_plan_by_version, fused):
+    logger.info("=== start === test_fused_migration_statements")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.migrate_dev()
+    # the second statement fails, the first one is rolled back with it
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');\n"
+        "insert into testtable (id, name) values (1, 'foo.baz');",
+        "delete from testtable where id = 1;",
+    )
+    # dynamic DDL is never fused
+    tc.make_data_migration_plan(
+        "set @ddl = 'create table testtable2 (id int primary key)';\n"
+        "prepare stmt from @ddl;\nexecute stmt;",
+        "drop table testtable2;",
+    )
+
+    cli = tc.make_cli()
+    cli.read_migration_plans()
+    assert cli.migrator.get_fusable_statements(cli.mpm.get_plan_by_index(2)) == [
+        (1, "insert into testtable (id, name) values (1, 'foo.bar')"),
+        (2, "insert into testtable (id, name) values (1, 'foo.baz')"),
+    ]
+    assert cli.migrator.get_fusable_statements(cli.mpm.get_plan_by_index(3)) is None
+
+    with pytest.raises(err.SQLStatementError, match="statement #2 at line 2"):
+        tc.migrate_dev()
+    cli = tc.make_cli()
+    cli.build_dao()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=0)
+
+
+def test_fused_migration_too_large(sort_plan_by_version, fused, monkeypatch):
+    logger.info("=== start === test_fused_migration_too_large")
+    monkeypatch.setattr(cli_env, "FUSED_SQL_MAX_STATEMENTS", 2)
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    # over the cap, streamed by the sql_file migration instead
+    make_sql_file_plan("""insert into testtable (id, name) values (1, 'a');
+insert into testtable (id, name) values (2, 'b');
+insert into testtable (id, name) values (3, 'c');
+""")
+
+    cli = tc.make_cli()
+    cli.read_migration_plans()
+    assert cli.migrator.get_fusable_statements(cli.mpm.get_plan_by_index(2)) is None
+    monkeypatch.setattr(cli_env, "FUSED_SQL_MAX_STATEMENTS", 1000)
+    monkeypatch.setattr(cli_env, "FUSED_SQL_MAX_BYTES", 64)
+    assert cli.migrator.get_fusable_statements(cli.mpm.get_plan_by_index(2)) is None
+
+    cli = tc.migrate_dev()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=3)
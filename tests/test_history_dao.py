@@ -0,0 +1,140 @@
+import logging
+from contextlib import contextmanager
+
+import pytest
+from sqlalchemy import event
+
+from migration.db import model
+from migration.env import cli_env
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def collect_statements(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def make_plans():
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');",
+        "delete from testtable where id = 1;",
+    )
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (2, 'foo.baz');",
+        "delete from testtable where id = 2;",
+    )
+    cli = tc.make_cli()
+    cli.read_migration_plans()
+    return cli
+
+
+def test_statements_per_plan(sort_plan_by_version):
+    logger.info("=== start === test_statements_per_plan")
+    cli = make_plans()
+    plans = cli.mpm.get_plans()
+
+    # batched: UPDATE history, INSERT next history, INSERT IGNORE snapshot
+    #   of the next plan, INSERT logs, UPSERT versioned head
+    dao = cli.build_dao()
+    dao.batched = True
+    with dao.session.begin():
+        dao.add_one(plans[1])
+        dao.commit()
+    with collect_statements(dao.session.bind) as statements:
+        with dao.session.begin():
+            cli._finish_versioned_plan(dao, plans[1], plans[2])
+            dao.commit()
+    assert len(statements) == 5
+
+    # legacy: SELECT history, SELECT FOR UPDATE, UPDATE history,
+    #   INSERT next history, INSERT IGNORE snapshots, INSERT log, INSERT log,
+    #   UPSERT versioned head
+    dao = cli.build_dao()
+    dao.batched = False
+    with collect_statements(dao.session.bind) as statements:
+        with dao.session.begin():
+            cli._finish_versioned_plan(dao, plans[2], plans[3])
+            dao.commit()
+    assert len(statements) == 8
+
+    with dao.session.begin():
+        hists = dao.get_all()
+        assert [h.state for h in hists] == [
+            model.MigrationState.SUCCESSFUL,
+            model.MigrationState.SUCCESSFUL,
+            model.MigrationState.SUCCESSFUL,
+            model.MigrationState.PROCESSING,
+        ]
+
+
+def test_batched_update_checks_state(sort_plan_by_version):
+    logger.info("=== start === test_batched_update_checks_state")
+    cli = make_plans()
+    plans = cli.mpm.get_plans()
+
+    dao = cli.build_dao()
+    dao.batched = True
+    with pytest.raises(Exception):
+        with dao.session.begin():
+            # the history of plans[1] does not exist yet
+            cli._finish_versioned_plan(dao, plans[1], plans[2])
+            dao.commit()
+
+
+def test_batched_migrate_and_rollback(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_batched_migrate_and_rollback")
+    make_plans()
+    monkeypatch.setattr(cli_env, "BATCHED_HISTORY", 1)
+
+    tc.migrate_and_check(len_hists=4, len_row=2)
+
+    cli = tc.make_cli({"environment": "dev", "version": "0001"})
+    cli.rollback()
+    assert cli.dao.batched
+    tc.check_len_hists_row(cli, len_hists=2, len_row=0)
+
+
+def test_repeatable_planning_prefetches_histories(sort_plan_by_version):
+    logger.info("=== start === test_repeatable_planning_prefetches_histories")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    for i in range(5):
+        tc.make_repeatable_migration_plan(
+            name=f"seed_data_{i}",
+            forward_sql=f"insert into testtable (id, name) values ({i}, 'seed')",
+            backward_sql=f"delete from testtable where id = {i}",
+        )
+    tc.migrate_and_check(len_hists=7, len_row=5)
+
+    cli = tc.make_cli()
+    cli.read_migration_plans()
+    dao = cli.build_dao()
+    applied_plans = cli.mpm.get_plans()
+    with collect_statements(dao.session.bind) as statements:
+        histories = dao.get_all_by_sig_dto()
+        to_execute_plans = cli._get_to_execute_repeatable_plans(
+            applied_plans, histories
+        )
+    # SELECT histories, COMMIT is not a cursor statement
+    assert len(statements) == 1
+    assert len(histories) == 7
+    assert to_execute_plans == []
+
+    # the repeatable plans are rolled back with their dependency
+    cli = tc.make_cli({"environment": "dev", "version": "0000"})
+    cli.rollback()
+    tc.check_len_hists_row(cli, len_hists=1, len_row=0)
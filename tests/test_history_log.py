@@ -0,0 +1,134 @@
+import datetime
+import json
+import logging
+
+from sqlalchemy import func, inspect, select, update
+
+from migration.db import model
+from migration.env import cli_env
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+def test_history_log_compressed(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_history_log_compressed")
+    monkeypatch.setattr(cli_env, "DEDUP_HISTORY_SNAPSHOT", 0)
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    cli = tc.migrate_dev()
+
+    with cli.dao.session.begin():
+        indexes = inspect(cli.dao.session.connection()).get_indexes(
+            cli_env.TABLE_MIGRATION_HISTORY_LOG
+        )
+        assert "idx_hist_id_created" in [i["name"] for i in indexes]
+        logs = cli.dao.session.scalars(select(model.MigrationHistoryLog)).all()
+        assert len(logs) > 0
+        for log in logs:
+            assert log.snapshot == ""
+            assert log.snapshot_z is not None
+            assert json.loads(log.get_snapshot())["version"] == "0001"
+
+
+def test_clean_history_log(sort_plan_by_version):
+    logger.info("=== start === test_clean_history_log")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');",
+        "delete from testtable where id = 1;",
+    )
+    cli = tc.migrate_dev()
+
+    with cli.dao.session.begin():
+        len_logs = cli.dao.session.scalar(
+            select(func.count()).select_from(model.MigrationHistoryLog)
+        )
+        cli.dao.session.execute(
+            update(model.MigrationHistoryLog).values(
+                created=datetime.datetime.utcnow() - datetime.timedelta(days=100)
+            )
+        )
+    cli.dao.commit()
+
+    args = {"environment": "dev", "keep_days": 90, "batch_size": 1}
+    cli = tc.make_cli({**args, "dry_run": True})
+    assert cli.clean_history_log() == len_logs
+    cli = tc.make_cli(args)
+    assert cli.clean_history_log() == len_logs
+
+    with cli.dao.session.begin():
+        session = cli.dao.session
+        assert (
+            session.scalar(select(func.count()).select_from(model.MigrationHistoryLog))
+            == 0
+        )
+        archives = session.scalars(select(model.MigrationHistoryLogArchive)).all()
+        assert len(archives) == len_logs
+        assert all(a.archived is not None for a in archives)
+    # the archived logs are not counted again
+    assert cli.clean_history_log() == 0
+
+
+def test_history_log_dedup(sort_plan_by_version):
+    logger.info("=== start === test_history_log_dedup")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');",
+        "delete from testtable where id = 1;",
+    )
+    cli = tc.migrate_dev()
+
+    with cli.dao.session.begin():
+        session = cli.dao.session
+        logs = session.scalars(
+            select(model.MigrationHistoryLog).order_by(model.MigrationHistoryLog.id)
+        ).all()
+        # create and update_succ of each plan share the snapshot
+        assert len(logs) == 4
+        assert all(log.snapshot == "" and log.snapshot_z is None for log in logs)
+        assert (
+            session.scalar(
+                select(func.count()).select_from(model.MigrationHistorySnapshot)
+            )
+            == 2
+        )
+        assert json.loads(cli.dao.get_log_snapshot(logs[0]))["version"] == "0001"
+
+
+def test_dedup_history_snapshot(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_dedup_history_snapshot")
+    monkeypatch.setattr(cli_env, "DEDUP_HISTORY_SNAPSHOT", 0)
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');",
+        "delete from testtable where id = 1;",
+    )
+    cli = tc.migrate_dev()
+    with cli.dao.session.begin():
+        snapshots = [
+            log.get_snapshot()
+            for log in cli.dao.session.scalars(
+                select(model.MigrationHistoryLog).order_by(model.MigrationHistoryLog.id)
+            ).all()
+        ]
+
+    monkeypatch.setattr(cli_env, "DEDUP_HISTORY_SNAPSHOT", 1)
+    cli = tc.make_cli({"environment": "dev", "batch_size": 1})
+    assert cli.dedup_history_snapshot() == len(snapshots)
+    assert cli.dedup_history_snapshot() == 0
+
+    with cli.dao.session.begin():
+        session = cli.dao.session
+        logs = session.scalars(
+            select(model.MigrationHistoryLog).order_by(model.MigrationHistoryLog.id)
+        ).all()
+        assert all(log.snapshot_id is not None for log in logs)
+        assert [cli.dao.get_log_snapshot(log) for log in logs] == snapshots
+        assert session.scalar(
+            select(func.count()).select_from(model.MigrationHistorySnapshot)
+        ) == len(set(snapshots))
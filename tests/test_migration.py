@@ -1,7 +1,10 @@
 import logging
+import os
 
 from sqlalchemy import text
 
+from migration.env import cli_env
+
 from . import testcommon as tc
 
 logger = logging.getLogger(__name__)
@@ -70,3 +73,47 @@ def test_migrate_happy_flow(sort_plan_by_version):
     dao = cli.dao
     hists = dao.get_all_dto()
     assert len(hists) == 4
+
+
+def test_migrate_prefetch(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_migrate_prefetch")
+    monkeypatch.setattr(cli_env, "PREFETCH_LOOKAHEAD", 2)
+    tc.init_workspace()
+    # 0001 and 0004 are schema plans, their workspaces are prepared ahead
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');",
+        "delete from testtable where id = 1;",
+    )
+    with open(
+        os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, "insert.py"), "w"
+    ) as f:
+        f.write("""from sqlalchemy import text
+
+def run(session, args):
+    with session.begin():
+        session.execute(text("insert into testtable (id, name) values (2, 'foo');"))
+""")
+    cli = tc.make_cli({"name": "insert_python", "type": "python"})
+    cli.make_data_migration()
+    data_plan = cli.read_migration_plans().get_plan_by_index(-1)
+    data_plan.change.forward.file = "insert.py"
+    data_plan.save()
+    with open(
+        os.path.join(cli_env.MIGRATION_CWD, cli_env.SCHEMA_DIR, "testtable.sql"), "w"
+    ) as f:
+        f.write(
+            "create table testtable (id int primary key, name varchar(255), note"
+            " varchar(255));"
+        )
+    cli = tc.make_cli({"name": "add_note"})
+    cli.make_schema_migration()
+
+    cli = tc.migrate_dev()
+    with cli.dao.session.begin():
+        assert len(cli.dao.get_all()) == 5
+        rows = cli.dao.session.execute(
+            text("select id, note from testtable order by id;")
+        ).all()
+        assert [tuple(row) for row in rows] == [(1, None), (2, None)]
+    assert cli.migrator._schema_workspaces == {}
@@ -0,0 +1,55 @@
+import logging
+
+import pytest
+from sqlalchemy import text
+
+from migration import err, helper
+from migration.db.lock import MigrationLock
+from migration.env import cli_env
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+def make_lock(timeout: int = 0) -> MigrationLock:
+    session = helper.build_session_from_env("dev")
+    return MigrationLock(session.bind, timeout)
+
+
+def test_migration_lock(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_migration_lock")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    monkeypatch.setattr(cli_env, "MIGRATION_LOCK_TIMEOUT", 0)
+
+    with make_lock():
+        # another migration is running
+        with pytest.raises(err.MigrationLockError):
+            tc.migrate_dev()
+        # read paths don't need the lock
+        cli = tc.make_cli()
+        is_consistent, len_applied = cli.info()
+        assert is_consistent and len_applied == 1
+        cli = tc.make_cli({"environment": "dev", "dry_run": True})
+        cli.migrate()
+
+    # the lock is released
+    tc.migrate_dev()
+    cli = tc.make_cli()
+    cli.build_dao()
+    tc.check_len_hists_row(cli, len_hists=2, len_row=0)
+
+
+def test_migration_lock_fencing(sort_plan_by_version):
+    logger.info("=== start === test_migration_lock_fencing")
+    tc.init_workspace()
+
+    lock = make_lock()
+    lock.acquire()
+    lock.ensure_held()
+    # simulate losing the lock
+    lock._conn.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": lock.name})
+    with pytest.raises(err.MigrationLockError):
+        lock.ensure_held()
+    lock.release()
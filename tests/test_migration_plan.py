@@ -5,17 +5,20 @@ import pytest
 
 from migration import err
 from migration import migration_plan as mp
+from migration.db.model import chain_checksum
 
 
 def make_mp(
-    sig: mp.MigrationSignature, dependencies: List[mp.MigrationSignature]
+    sig: mp.MigrationSignature,
+    dependencies: List[mp.MigrationSignature],
+    type: mp.Type = mp.Type.SCHEMA,
 ) -> mp.MigrationPlan:
     return mp.MigrationPlan(
         version=sig.version,
         name=sig.name,
         dependencies=dependencies,
         author="",
-        type=mp.Type.SCHEMA,
+        type=type,
         change=mp.Change(forward=mp.SchemaForward(id=""), backward=None),
     )
 
@@ -110,6 +113,62 @@ def test_multi_dependency():
         mp.MigrationPlanManager._sort_plans(plans)
 
 
+def test_dag_dependency():
+    sigs = make_sigs()
+    sig4 = mp.MigrationSignature(version="0004", name="4")
+    plans = [
+        make_mp(sig4, [sigs[2], sigs[3]], type=mp.Type.DATA),
+        make_mp(sigs[3], [sigs[1]], type=mp.Type.DATA),
+        make_mp(sigs[2], [sigs[1]], type=mp.Type.DATA),
+        make_mp(sigs[1], [sigs[0]]),
+        make_mp(sigs[0], []),
+    ]
+
+    sorted_plans = mp.MigrationPlanManager._sort_plans(plans)
+
+    # the independent plans are ordered by version
+    assert [p.sig() for p in sorted_plans] == [sigs[0], sigs[1], sigs[3], sigs[2], sig4]
+
+
+def test_dag_schema_dependency():
+    sigs = make_sigs()
+    plans = [
+        make_mp(sigs[0], []),
+        make_mp(sigs[1], [sigs[0]], type=mp.Type.DATA),
+        # the schema plans must depend on each other
+        make_mp(sigs[2], [sigs[0]]),
+        make_mp(sigs[3], [sigs[1]]),
+    ]
+
+    with pytest.raises(err.IntegrityError):
+        mp.MigrationPlanManager._sort_plans(plans)
+
+    plans[3].dependencies = [sigs[1], sigs[2]]
+    sorted_plans = mp.MigrationPlanManager._sort_plans(plans)
+    assert [p.sig() for p in sorted_plans] == [sigs[0], sigs[2], sigs[1], sigs[3]]
+
+
+def test_repeatable_dependencies():
+    sigs = make_sigs()
+    plans = [
+        make_mp(sigs[0], []),
+        make_mp(sigs[1], [sigs[0]]),
+    ]
+    repeatable = make_mp(
+        mp.MigrationSignature(version="R", name="seed"),
+        [sigs[1], sigs[0]],
+        type=mp.Type.REPEATABLE,
+    )
+    mp.MigrationPlanManager._check_dependency_of_repeatable_plans(plans, [repeatable])
+
+    # every dependency is checked
+    repeatable.dependencies = [sigs[1], sigs[2]]
+    with pytest.raises(err.IntegrityError, match="0002_2"):
+        mp.MigrationPlanManager._check_dependency_of_repeatable_plans(
+            plans, [repeatable]
+        )
+
+
 def test_checksum():
     os.environ["MY_ENV"] = "foo"
 
@@ -140,3 +199,113 @@ def test_checksum():
     os.environ["MY_ENV"] = "foo"
     checksum3 = makemp().get_checksum()
     assert checksum1 == checksum3
+
+
+def test_chunk_config():
+    chunk = mp.ChunkConfig(table="t", key="id", min_chunk_size=10, max_chunk_size=1000)
+    # too slow, shrink at most by half
+    assert chunk.next_chunk_size(100, 10) == 50
+    assert chunk.next_chunk_size(100, 0.25) == 200
+    assert chunk.next_chunk_size(100, 0) == 200
+    assert chunk.next_chunk_size(100, 0.4) == 125
+    assert chunk.next_chunk_size(12, 10) == 10
+    assert chunk.next_chunk_size(800, 0) == 1000
+
+
+def test_chunk_config_from_dict():
+    forward = mp.DataForward(
+        type=mp.DataChangeType.SQL_CHUNKED,
+        sql="UPDATE t SET a = 1 WHERE id >= :start AND id < :end",
+        chunk=mp.ChunkConfig(table="t", key="id", pause=1),
+    )
+    data = forward.to_dict()
+    assert data["chunk"]["pause"] == 1
+    assert mp.dacite.from_dict(data_class=mp.DataForward, data=data) == forward
+
+
+def test_load_config_from_dict():
+    forward = mp.DataForward(
+        type=mp.DataChangeType.BULK_LOAD,
+        file="users.tsv",
+        load=mp.LoadConfig(table="users", columns=["id", "name"], header=False),
+    )
+    data = forward.to_dict()
+    assert data["file"] == "users.tsv"
+    assert "key" not in data["load"]
+    assert mp.dacite.from_dict(data_class=mp.DataForward, data=data) == forward
+    assert forward.load.delimiter(forward.file) == "\t"
+    assert forward.load.delimiter("users.csv") == ","
+
+
+def test_checksum_bulk_load(tmp_path, monkeypatch):
+    monkeypatch.setattr(mp.cli_env, "MIGRATION_CWD", str(tmp_path))
+    os.makedirs(tmp_path / mp.cli_env.DATA_DIR)
+    data_file = tmp_path / mp.cli_env.DATA_DIR / "users.csv"
+
+    def makemp():
+        return mp.MigrationPlan(
+            version="0002",
+            name="load_users",
+            dependencies=[],
+            author="",
+            type=mp.Type.DATA,
+            change=mp.Change(
+                forward=mp.DataForward(
+                    type=mp.DataChangeType.BULK_LOAD,
+                    file="users.csv",
+                    load=mp.LoadConfig(table="users"),
+                ),
+                backward=None,
+            ),
+        )
+
+    data_file.write_text("id,name\n1,foo\n")
+    checksum1 = makemp().get_checksum()
+    data_file.write_text("id,name\n1,bar\n")
+    assert makemp().get_checksum() != checksum1
+
+
+def test_tags_from_dict():
+    plan = make_mp(mp.MigrationSignature(version="R", name="seed"), [])
+    checksum = plan.get_checksum()
+    assert "tags" not in plan.to_dict()
+    plan = make_mp(mp.MigrationSignature(version="R", name="seed"), [])
+    plan.tags = []
+    # empty tags don't change the checksum of the existing plans
+    assert plan.get_checksum() == checksum
+    plan.tags = ["users"]
+    data = plan.to_dict()
+    assert data["tags"] == ["users"]
+    assert mp.dacite.from_dict(data_class=mp.MigrationPlan, data=data).to_dict() == data
+
+
+def test_applied_plans_chain_checksum(monkeypatch):
+    plans = [
+        make_mp(mp.MigrationSignature(version=f"000{i}", name=str(i)), [])
+        for i in range(5)
+    ]
+    monkeypatch.setattr(
+        mp.MigrationPlanManager, "_read_migration_plans", lambda self: (plans, [])
+    )
+    mpm = mp.MigrationPlanManager()
+
+    def expected(indexes: List[int]) -> str:
+        checksum = ""
+        for i in sorted(indexes):
+            checksum = chain_checksum(checksum, plans[i].get_checksum())
+        return checksum
+
+    applied = mpm.applied_plans()
+    # applied out of plan order, as by a concurrent migration
+    for order in [[2], [2, 0], [2, 0, 4], [2, 0, 4, 1], [2, 0, 4, 1, 3]]:
+        applied.add(plans[order[-1]].sig())
+        assert len(applied) == len(order)
+        assert applied.get_chain_checksum() == expected(order)
+    assert applied.get_chain_checksum() == mpm.get_chain_checksum(5)
+    assert all(p.sig() in applied for p in plans)
+
+    applied.discard(plans[1].sig())
+    assert plans[1].sig() not in applied
+    assert plans[2].sig() in applied
+    assert applied.get_chain_checksum() == expected([0, 2, 3, 4])
+    assert mp.AppliedPlans(mpm, prefix=3).get_chain_checksum() == expected([0, 1, 2])
@@ -0,0 +1,63 @@
+import logging
+
+import pytest
+
+from migration.db import model
+from migration.env import cli_env
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+def make_plans():
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    for i, tags in enumerate([["a"], None, ["a", "b"], ["b"], None]):
+        _, plan = tc.make_repeatable_migration_plan(
+            name=f"seed_{i}",
+            forward_sql=f"insert into testtable (id, name) values ({100 + i}, 'r')",
+        )
+        plan.tags = tags
+        plan.save()
+
+
+def test_parallel_repeatable(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_parallel_repeatable")
+    monkeypatch.setattr(cli_env, "REPEATABLE_PARALLELISM", 3)
+    make_plans()
+
+    cli = tc.migrate_dev()
+    tc.check_len_hists_row(cli, len_hists=7, len_row=5)
+    for hist in cli.dao.get_all():
+        assert hist.state == model.MigrationState.SUCCESSFUL
+
+
+def test_parallel_repeatable_failure(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_parallel_repeatable_failure")
+    monkeypatch.setattr(cli_env, "REPEATABLE_PARALLELISM", 2)
+    make_plans()
+    _, plan = tc.make_repeatable_migration_plan(
+        name="seed_1",
+        # duplicate key of seed_0
+        forward_sql="insert into testtable (id, name) values (100, 'r')",
+    )
+    plan.save()
+
+    with pytest.raises(Exception):
+        tc.migrate_dev()
+    cli = tc.make_cli()
+    cli.build_dao()
+    states = {h.name: h.state for h in cli.dao.get_all()}
+    assert states["seed_1"] == model.MigrationState.PROCESSING
+    # the running plans are finished before raising the error
+    assert states["seed_0"] == model.MigrationState.SUCCESSFUL
+
+    # retried sequentially after fixing the plan
+    monkeypatch.setattr(cli_env, "REPEATABLE_PARALLELISM", 1)
+    _, plan = tc.make_repeatable_migration_plan(
+        name="seed_1",
+        forward_sql="insert into testtable (id, name) values (101, 'r')",
+    )
+    tc.migrate_dev()
+    tc.check_len_hists_row(cli, len_hists=7, len_row=5)
@@ -1,7 +1,11 @@
 import logging
 import os
 from typing import List
+from unittest import mock
 
+from sqlalchemy import text
+
+from migration import helper
 from migration.env import cli_env
 
 from . import testcommon as tc
@@ -42,3 +46,58 @@ def test_pull(sort_plan_by_version):
     cli.pull()
 
     assert len(list_files(cli_env.SDM_SCHEMA_DIR, ".sql")) == 1
+
+
+def test_pull_schema_snapshot_cache(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_pull_schema_snapshot_cache")
+    monkeypatch.setattr(cli_env, "SCHEMA_SNAPSHOT_CACHE", 1)
+
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    dev_cli = tc.migrate_dev()
+
+    for f in list_files(cli_env.SDM_SCHEMA_DIR, ".sql"):
+        os.remove(f)
+    cli = tc.make_cli({"env_or_version": "dev"})
+    cli.pull()
+    pulled = {f: open(f).read() for f in list_files(cli_env.SDM_SCHEMA_DIR, ".sql")}
+    assert len(pulled) == 1
+
+    # unchanged schema, the snapshot is reused without skeema
+    for f in pulled:
+        os.remove(f)
+    with mock.patch.object(
+        helper, "call_skeema", side_effect=Exception("skeema called")
+    ):
+        cli.pull()
+    assert {
+        f: open(f).read() for f in list_files(cli_env.SDM_SCHEMA_DIR, ".sql")
+    } == pulled
+
+    # changed schema, pulled again
+    with dev_cli.dao.session.begin():
+        dev_cli.dao.session.execute(
+            text("create table snapshot_cache_t (id int primary key)")
+        )
+    with mock.patch.object(
+        helper, "call_skeema", wraps=helper.call_skeema
+    ) as call_skeema:
+        cli.pull()
+    call_skeema.assert_called_once()
+    assert len(list_files(cli_env.SDM_SCHEMA_DIR, ".sql")) == 2
+
+    # check constraints are covered, the snapshot is the same as a full pull
+    with dev_cli.dao.session.begin():
+        dev_cli.dao.session.execute(
+            text(
+                "alter table snapshot_cache_t add constraint snapshot_cache_chk"
+                " check (id > 0)"
+            )
+        )
+    cli.pull()
+    cached = {f: open(f).read() for f in list_files(cli_env.SDM_SCHEMA_DIR, ".sql")}
+    monkeypatch.setattr(cli_env, "SCHEMA_SNAPSHOT_CACHE", 0)
+    cli.pull()
+    assert {
+        f: open(f).read() for f in list_files(cli_env.SDM_SCHEMA_DIR, ".sql")
+    } == cached
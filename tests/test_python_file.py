@@ -1,8 +1,10 @@
 import logging
 import os
 
+import pytest
 from sqlalchemy import text
 
+from migration import err
 from migration import migration_plan as mp
 from migration.env import cli_env
 
@@ -52,3 +54,141 @@ def run(session: Session, args: dict):
         assert len(hists) == 3
         row = dao.session.execute(text("select name from testtable;")).one()
         assert row[0] == "foo.bar"
+
+
+def test_migrate_python_file_stream(sort_plan_by_version):
+    logger.info("=== start === test_migrate_python_file_stream")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.migrate_dev()
+
+    with open(
+        os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, "copy.py"), "w"
+    ) as f:
+        f.write("""from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+from migration import stream
+
+def run(session: Session, args: dict):
+    stream.upsert_rows(
+        session,
+        "testtable",
+        ({"id": i, "name": f"name{i}"} for i in range(1, 2501)),
+        batch_size=1000,
+    )
+    # upper the names, reading and writing the same table
+    rows = (
+        {"id": row.id, "name": row.name.upper()}
+        for batch in stream.stream_rows(
+            session, "select id, name from testtable where id > :id", {"id": 0}, 300
+        )
+        for row in batch
+    )
+    return stream.upsert_rows(session, "testtable", rows, update_columns=["name"])
+""")
+    cli = tc.make_cli({"name": "copy_test_data", "type": "python"})
+    cli.make_data_migration()
+    data_plan = cli.read_migration_plans().get_plan_by_index(-1)
+    data_plan.change.forward.file = "copy.py"
+    data_plan.change.backward = mp.DataBackward(
+        type="sql", sql="delete from testtable;"
+    )
+    data_plan.change.forward.postcheck = mp.ConditionCheck(
+        type=str(mp.DataChangeType.SQL),
+        sql="select count(*) from testtable where name like 'NAME%';",
+        expected=2500,
+    )
+    data_plan.save()
+
+    cli = tc.migrate_dev()
+    with cli.dao.session.begin():
+        assert len(cli.dao.get_all()) == 3
+        row = cli.dao.session.execute(
+            text("select name from testtable where id = 2500;")
+        ).one()
+        assert row[0] == "NAME2500"
+
+
+def test_migrate_python_file_worker(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_migrate_python_file_worker")
+    monkeypatch.setattr(cli_env, "PYTHON_WORKERS", 2)
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.migrate_dev()
+
+    data_dir = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR)
+    with open(os.path.join(data_dir, "insert.py"), "w") as f:
+        f.write("""import os
+from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+def run(session: Session, args: dict):
+    with session.begin():
+        session.execute(
+            text("insert into testtable (id, name) values (1, :name);"),
+            {"name": str(os.getppid())},
+        )
+""")
+    with open(os.path.join(data_dir, "check.py"), "w") as f:
+        f.write("""from sqlalchemy.orm import Session
+from sqlalchemy import text
+
+def run(session: Session, args: dict):
+    return session.execute(text("select count(*) from testtable;")).scalar_one()
+""")
+    cli = tc.make_cli({"name": "insert_test_data", "type": "python"})
+    cli.make_data_migration()
+    data_plan = cli.read_migration_plans().get_plan_by_index(-1)
+    data_plan.change.forward.file = "insert.py"
+    data_plan.change.forward.precheck = mp.ConditionCheck(
+        type=str(mp.DataChangeType.PYTHON), file="check.py", expected=0
+    )
+    data_plan.change.forward.postcheck = mp.ConditionCheck(
+        type=str(mp.DataChangeType.PYTHON), file="check.py", expected=1
+    )
+    data_plan.change.backward = mp.DataBackward(
+        type="sql", sql="delete from testtable where id = 1;"
+    )
+    data_plan.save()
+
+    cli = tc.migrate_dev()
+    with cli.dao.session.begin():
+        assert len(cli.dao.get_all()) == 3
+        # the migration ran in a worker process of sdm
+        row = cli.dao.session.execute(text("select name from testtable;")).one()
+        assert row[0] == str(os.getpid())
+
+
+def test_python_worker_limits(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_python_worker_limits")
+    monkeypatch.setattr(cli_env, "PYTHON_WORKERS", 1)
+    monkeypatch.setattr(cli_env, "PYTHON_WORKER_TIMEOUT", 2)
+    monkeypatch.setattr(cli_env, "PYTHON_WORKER_MEMORY_LIMIT", 512)
+    tc.init_workspace()
+
+    data_dir = os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR)
+    files = {
+        "ok.py": "def run(session, args):\n    return 1\n",
+        "sleep.py": "import time\ndef run(session, args):\n    time.sleep(30)\n",
+        "exit.py": "import os\ndef run(session, args):\n    os._exit(3)\n",
+        "memory.py": (
+            "def run(session, args):\n    return len(bytearray(1024 * 1024 * 1024))\n"
+        ),
+    }
+    for name, content in files.items():
+        with open(os.path.join(data_dir, name), "w") as f:
+            f.write(content)
+
+    cli = tc.make_cli()
+    migrator = cli.migrator
+    with migrator.python_workers():
+        assert migrator.migrate_data_python("ok.py", cli.args) == 1
+        with pytest.raises(err.PythonWorkerError, match="timed out after 2"):
+            migrator.migrate_data_python("sleep.py", cli.args)
+        with pytest.raises(err.PythonWorkerError, match="exited with code 3"):
+            migrator.migrate_data_python("exit.py", cli.args)
+        with pytest.raises(err.PythonWorkerError, match="MemoryError"):
+            migrator.migrate_data_python("memory.py", cli.args)
+        # the killed workers are replaced
+        assert migrator.migrate_data_python("ok.py", cli.args) == 1
@@ -1,9 +1,13 @@
 import logging
 import os
 
-from sqlalchemy import text
+import pytest
+from sqlalchemy import select, text
 
+from migration import err
 from migration import migration_plan as mp
+from migration.db import model
+from migration.db.progress import Direction
 from migration.env import cli_env
 
 from . import testcommon as tc
@@ -49,3 +53,128 @@ def test_migrate_sql_file(sort_plan_by_version):
         assert len(hists) == 3
         row = dao.session.execute(text("select name from testtable;")).one()
         assert row[0] == "foo.bar"
+
+
+def make_sql_file_plan(sql: str) -> mp.MigrationPlan:
+    cli = tc.make_cli(
+        {
+            "name": "insert_test_data",
+            "type": "sql_file",
+        }
+    )
+    cli.make_data_migration()
+    with open(
+        os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, "insert_test_data.sql"),
+        "w",
+    ) as f:
+        f.write(sql)
+    data_plan = cli.read_migration_plans().get_plan_by_index(-1)
+    data_plan.change.forward.file = "insert_test_data.sql"
+    data_plan.change.backward = mp.DataBackward(
+        type="sql",
+        sql="delete from testtable;",
+    )
+    data_plan.save()
+    return data_plan
+
+
+def test_migrate_sql_file_statements(sort_plan_by_version):
+    logger.info("=== start === test_migrate_sql_file_statements")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    make_sql_file_plan("""-- seed data
+insert into testtable (id, name) values (1, '100%;');
+insert into testtable (id, name) values (2, 'a:b');
+DELIMITER $$
+CREATE PROCEDURE seed_testtable()
+BEGIN
+  insert into testtable (id, name) values (3, 'foo');
+  insert into testtable (id, name) values (4, 'bar');
+END$$
+DELIMITER ;
+CALL seed_testtable();
+DROP PROCEDURE seed_testtable;
+""")
+
+    cli = tc.migrate_dev()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=4)
+    with cli.dao.session.begin():
+        row = cli.dao.session.execute(
+            text("select name from testtable where id = 1;")
+        ).one()
+        assert row[0] == "100%;"
+
+
+def test_migrate_sql_file_resume(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_migrate_sql_file_resume")
+    monkeypatch.setattr(cli_env, "SQL_FILE_COMMIT_EVERY", 2)
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.migrate_dev()
+    make_sql_file_plan("""insert into testtable (id, name) values (1, 'a');
+insert into testtable (id, name) values (2, 'b');
+
+insert into testtable (id, name) values (3, 'c');
+insert into testtable (id, name) values (1, 'duplicate');
+insert into testtable (id, name) values (4, 'd');
+""")
+
+    with pytest.raises(err.SQLStatementError) as e:
+        tc.migrate_dev()
+    assert e.value.index == 4
+    assert e.value.line_no == 5
+    assert "`sdm fix` resumes from #3" in str(e.value)
+
+    # the first 2 statements are committed
+    cli = tc.make_cli()
+    cli.build_dao()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=2)
+
+    # fix the data and resume from the first uncommitted statement
+    with cli.dao.session.begin():
+        cli.dao.session.execute(text("delete from testtable where id = 1;"))
+    cli = tc.make_cli({"environment": "dev", "subcommand": "migrate", "resume_from": 3})
+    cli.fix_migrate()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=4)
+
+
+def test_migrate_sql_file_resume_by_checkpoint(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_migrate_sql_file_resume_by_checkpoint")
+    monkeypatch.setattr(cli_env, "SQL_FILE_COMMIT_EVERY", 2)
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.migrate_dev()
+    make_sql_file_plan("""insert into testtable (id, name) values (1, 'a');
+insert into testtable (id, name) values (2, 'b');
+insert into testtable (id, name) values (3, 'c');
+insert into testtable (id, name) values (1, 'duplicate');
+""")
+
+    with pytest.raises(err.SQLStatementError):
+        tc.migrate_dev()
+
+    cli = tc.make_cli()
+    cli.build_dao()
+    with cli.dao.session.begin():
+        progress = cli.dao.session.scalars(select(model.MigrationHistoryProgress)).one()
+        assert progress.statement_index == 2
+        assert progress.rows == 2
+        assert progress.direction == Direction.FORWARD
+        cli.dao.session.execute(text("delete from testtable where id = 1;"))
+
+    # resume from the checkpoint without --resume-from
+    cli = tc.make_cli({"environment": "dev", "subcommand": "migrate"})
+    cli.fix_migrate()
+    tc.check_len_hists_row(cli, len_hists=3, len_row=3)
+    with cli.dao.session.begin():
+        progress = cli.dao.session.scalars(select(model.MigrationHistoryProgress)).one()
+        assert progress.statement_index == 4
+        assert progress.rows == 4
+
+    # the checkpoint is deleted with the migration history
+    cli = tc.make_cli({"environment": "dev", "version": "0001"})
+    cli.rollback()
+    with cli.dao.session.begin():
+        assert (
+            cli.dao.session.scalars(select(model.MigrationHistoryProgress)).all() == []
+        )
@@ -0,0 +1,150 @@
+import json
+import logging
+import os
+
+from sqlalchemy import select, text
+
+from migration import migration_plan as mp
+from migration.db import hist_dao, model
+from migration.env import cli_env
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+
+def write_data_file(rows: dict):
+    with open(
+        os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, "test_data.csv"), "w"
+    ) as f:
+        f.write("id,name\n")
+        for id, name in rows.items():
+            f.write(f"{id},{name}\n")
+
+
+def make_sync_plan(
+    file: str = "test_data.csv",
+    table: str = "testtable",
+    dependency: mp.MigrationSignature = mp.MigrationSignature(
+        version="0001", name="new_test_table"
+    ),
+) -> mp.MigrationPlan:
+    cli = tc.make_cli({"name": "sync_test_data", "type": "sync"})
+    cli.make_repeatable_migration()
+    plan = cli.read_migration_plans().get_repeatable_plan("sync_test_data")
+    plan.change.forward.file = file
+    plan.change.forward.load.table = table
+    plan.change.forward.load.batch_size = 10
+    plan.dependencies = [dependency]
+    plan.save()
+    return plan
+
+
+def get_last_progress(cli) -> dict:
+    with cli.dao.session.begin():
+        logs = cli.dao.session.scalars(
+            select(model.MigrationHistoryLog)
+            .where(model.MigrationHistoryLog.operation == hist_dao.Operation.PROGRESS)
+            .order_by(model.MigrationHistoryLog.id)
+        ).all()
+        return json.loads(logs[-1].get_snapshot())
+
+
+def get_rows(cli) -> dict:
+    with cli.dao.session.begin():
+        return dict(
+            cli.dao.session.execute(text("select id, name from testtable;")).all()
+        )
+
+
+def test_sync(sort_plan_by_version):
+    logger.info("=== start === test_sync")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1000, 'extra');",
+        "delete from testtable where id = 1000;",
+    )
+    rows = {i: f"name{i}" for i in range(1, 51)}
+    rows[50] = "\\N"
+    write_data_file(rows)
+    make_sync_plan()
+
+    cli = tc.migrate_dev()
+    assert get_rows(cli) == {i: None if i == 50 else f"name{i}" for i in range(1, 51)}
+    progress = get_last_progress(cli)
+    assert progress["inserted"] == 50
+    assert progress["deleted"] == 1
+
+    # only the changed chunks are read and written
+    rows[3] = "changed"
+    del rows[17]
+    rows[51] = "new"
+    write_data_file(rows)
+    cli = tc.migrate_dev()
+    assert get_rows(cli)[3] == "changed"
+    assert 17 not in get_rows(cli)
+    progress = get_last_progress(cli)
+    # the chunk of the deleted key 17 is not skipped
+    assert progress["chunks"] == 5
+    assert progress["skipped_chunks"] == 2
+    assert progress["inserted"] == 1
+    assert progress["updated"] == 1
+    assert progress["deleted"] == 1
+
+
+def test_sync_typed_values(sort_plan_by_version):
+    logger.info("=== start === test_sync_typed_values")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "create table typedtable (id int primary key, price decimal(10,2),"
+        " day date, at datetime, ratio float, active bool, note varchar(32));",
+        "drop table typedtable;",
+    )
+    # the values are not written as mysql prints them
+    with open(
+        os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, "typed_data.csv"), "w"
+    ) as f:
+        f.write("id,price,day,at,ratio,active,note\n")
+        for i in range(1, 26):
+            f.write(f"{i},{i}.5,2024-1-{i},2024-01-{i} 3:04:05,0.{i},{i % 2},Note\n")
+        f.write("26,\\N,\\N,\\N,\\N,\\N,\\N\n")
+    plan = make_sync_plan(
+        "typed_data.csv",
+        "typedtable",
+        mp.MigrationSignature(version="0002", name="insert_test_data"),
+    )
+
+    cli = tc.migrate_dev()
+    progress = get_last_progress(cli)
+    assert progress["inserted"] == 26
+
+    # the unchanged table is not written
+    states = []
+    args = tc.make_args({"environment": "dev"})
+    cli.migrator.migrate_data_sync(plan.change.forward, args, progress=states.append)
+    assert states[-1]["chunks"] == 3
+    assert states[-1]["skipped_chunks"] == 3
+    assert (
+        states[-1]["inserted"],
+        states[-1]["updated"],
+        states[-1]["deleted"],
+    ) == (0, 0, 0)
+
+    # a change of letter case is written
+    with cli.dao.session.begin():
+        cli.dao.session.execute(
+            text("update typedtable set note = 'NOTE' where id = 5")
+        )
+    states = []
+    cli.migrator.migrate_data_sync(plan.change.forward, args, progress=states.append)
+    assert states[-1]["skipped_chunks"] == 2
+    assert states[-1]["updated"] == 1
+    with cli.dao.session.begin():
+        assert (
+            cli.dao.session.execute(
+                text("select note from typedtable where id = 5")
+            ).scalar_one()
+            == "Note"
+        )
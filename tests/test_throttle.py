@@ -0,0 +1,101 @@
+import json
+import logging
+
+import pytest
+from sqlalchemy import select, text
+
+from migration import err
+from migration.db import hist_dao, model
+from migration.env import cli_env
+from migration.throttle import Throttle
+
+from . import testcommon as tc
+from .test_chunked_migration import make_chunked_plan
+
+logger = logging.getLogger(__name__)
+
+
+@pytest.fixture
+def throttled(monkeypatch):
+    # the other test instance is not a replica, its lag is not checked
+    monkeypatch.setattr(
+        cli_env,
+        "THROTTLE_REPLICAS",
+        f"{cli_env.UNITTEST_MYSQL_HOST1}:{cli_env.UNITTEST_MYSQL_PORT1}",
+    )
+    monkeypatch.setattr(cli_env, "THROTTLE_MAX_REPLICA_LAG", 1)
+    monkeypatch.setattr(cli_env, "THROTTLE_MAX_THREADS_RUNNING", 1000)
+    monkeypatch.setattr(cli_env, "THROTTLE_CHECK_INTERVAL", 0.1)
+
+
+def make_plans():
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    values = ", ".join(f"({i}, 'seed')" for i in range(1, 51))
+    tc.make_data_migration_plan(
+        f"insert into testtable (id, name) values {values};",
+        "delete from testtable;",
+    )
+    make_chunked_plan()
+
+
+def test_throttle_check(sort_plan_by_version, throttled):
+    logger.info("=== start === test_throttle_check")
+    tc.init_workspace()
+    throttle = Throttle.from_env("dev")
+    assert len(throttle.replicas) == 1
+    assert throttle.replica_lag(throttle.replicas[0]) is None
+    assert throttle.threads_running() >= 1
+    assert throttle.check() is None
+    assert Throttle.from_env("dev").wait() == 0
+
+
+def test_throttle_chunked_migration(
+    sort_plan_by_version, throttled, monkeypatch, caplog
+):
+    logger.info("=== start === test_throttle_chunked_migration")
+    make_plans()
+    # the primary is busy for the first checks
+    threads_running = iter([2000, 2000])
+    monkeypatch.setattr(
+        Throttle, "threads_running", lambda self: next(threads_running, 1)
+    )
+
+    with caplog.at_level(logging.INFO):
+        cli = tc.migrate_dev()
+    assert "Migration throttled for" in caplog.text
+    tc.check_len_hists_row(cli, len_hists=4, len_row=50)
+    with cli.dao.session.begin():
+        logs = cli.dao.session.scalars(
+            select(model.MigrationHistoryLog)
+            .where(model.MigrationHistoryLog.operation == hist_dao.Operation.PROGRESS)
+            .order_by(model.MigrationHistoryLog.id)
+        ).all()
+        progress = json.loads(logs[-1].get_snapshot())
+        assert progress["rows"] == 50
+        assert "throttle_time" in progress
+
+
+def test_throttle_timeout(sort_plan_by_version, throttled, monkeypatch):
+    logger.info("=== start === test_throttle_timeout")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    values = ", ".join(f"({i}, 'seed')" for i in range(1, 51))
+    tc.make_data_migration_plan(
+        f"insert into testtable (id, name) values {values};",
+        "delete from testtable;",
+    )
+    tc.migrate_dev()
+    make_chunked_plan()
+    monkeypatch.setattr(cli_env, "THROTTLE_MAX_WAIT", 0)
+    monkeypatch.setattr(Throttle, "threads_running", lambda self: 2000)
+
+    with pytest.raises(err.ThrottleError):
+        tc.migrate_dev()
+    # the chunked migration is not started
+    cli = tc.make_cli()
+    cli.build_dao()
+    tc.check_len_hists_row(cli, len_hists=4, len_row=50)
+    with cli.dao.session.begin():
+        rows = cli.dao.session.execute(text("select name from testtable;")).all()
+        assert all(row[0] == "seed" for row in rows)
@@ -0,0 +1,72 @@
+import logging
+import os
+import subprocess
+import time
+
+import pytest
+
+from migration import migration_plan as mp
+from migration.env import cli_env
+
+from . import testcommon as tc
+
+logger = logging.getLogger(__name__)
+
+CHECK_TS = """import { Column, PrimaryColumn, Entity, DataSource } from "typeorm"
+@Entity()
+class Testtable {
+  @PrimaryColumn()
+  id: number
+
+  @Column()
+  name: string
+}
+
+export const Entities = [Testtable]
+
+export const Run = async (datasource: DataSource, args: { [key: string]: string }): Promise<number> => {
+    return await datasource.manager.count(Testtable)
+}
+"""  # noqa
+
+
+@pytest.mark.slow
+def test_typescript_worker_latency(sort_plan_by_version, monkeypatch):
+    logger.info("=== start === test_typescript_worker_latency")
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.migrate_dev()
+    with open(
+        os.path.join(cli_env.MIGRATION_CWD, cli_env.DATA_DIR, "check.ts"), "w"
+    ) as f:
+        f.write(CHECK_TS)
+    subprocess.run(["npm", "install"], cwd=cli_env.MIGRATION_CWD)
+
+    cli = tc.make_cli()
+    condition = mp.ConditionCheck(
+        type=str(mp.DataChangeType.TYPESCRIPT), file="check.ts", expected=0
+    )
+    runs = 5
+
+    def measure() -> float:
+        began = time.monotonic()
+        for _ in range(runs):
+            assert cli.migrator.check_condition(condition, cli.args)
+        return (time.monotonic() - began) / runs
+
+    # warm up the build cache
+    assert cli.migrator.check_condition(condition, cli.args)
+    spawn_latency = measure()
+
+    monkeypatch.setattr(cli_env, "TYPESCRIPT_WORKER", 1)
+    with cli.migrator.typescript_worker():
+        # the first invocation starts the worker
+        assert cli.migrator.check_condition(condition, cli.args)
+        worker_latency = measure()
+
+    logger.info(
+        "typescript check latency, spawn=%.3fs, worker=%.3fs",
+        spawn_latency,
+        worker_latency,
+    )
+    assert worker_latency < spawn_latency
@@ -0,0 +1,86 @@
+import logging
+import re
+
+import pytest
+from sqlalchemy import update
+
+from migration.db import model
+
+from . import testcommon as tc
+from .test_history_dao import collect_statements
+
+logger = logging.getLogger(__name__)
+
+
+def make_plans():
+    tc.init_workspace()
+    tc.make_schema_migration_plan()
+    tc.make_data_migration_plan(
+        "insert into testtable (id, name) values (1, 'foo.bar');",
+        "delete from testtable where id = 1;",
+    )
+
+
+def test_versioned_head(sort_plan_by_version):
+    logger.info("=== start === test_versioned_head")
+    make_plans()
+    cli = tc.migrate_dev()
+    with cli.dao.session.begin():
+        hists = cli.dao.get_all_versioned()
+        assert [h.chain_checksum for h in hists] == [
+            cli.mpm.get_chain_checksum(i + 1) for i in range(len(hists))
+        ]
+    assert cli.dao.get_versioned_head() == (3, cli.mpm.get_chain_checksum(3))
+
+    # no-op migrate doesn't read the histories
+    cli = tc.make_cli()
+    cli.read_migration_plans()
+    dao = cli.build_dao()
+    with collect_statements(dao.session.bind) as statements:
+        applied_plans, _ = cli._migrate_versioned(None, None, False, False)
+    assert len(applied_plans) == 3
+    table = re.compile(rf"\b{model.MigrationHistory.__tablename__}\b")
+    assert not any(table.search(s) for s in statements)
+
+    # the head follows rollback
+    cli = tc.make_cli({"environment": "dev", "version": "0001"})
+    cli.rollback()
+    assert cli.dao.get_versioned_head() == (2, cli.mpm.get_chain_checksum(2))
+    tc.migrate_and_check(len_hists=3, len_row=1)
+
+
+def test_verify_history(sort_plan_by_version):
+    logger.info("=== start === test_verify_history")
+    make_plans()
+    cli = tc.migrate_dev()
+    with cli.dao.session.begin():
+        cli.dao.session.execute(
+            update(model.MigrationHistory)
+            .where(model.MigrationHistory.ver == "0001")
+            .values(checksum="tampered")
+        )
+    cli.dao.commit()
+
+    # the fast path only compares the head
+    tc.migrate_dev()
+    cli = tc.make_cli({"environment": "dev", "verify_history": True})
+    with pytest.raises(Exception):
+        cli.migrate()
+
+
+def test_verify_chain_checksum(sort_plan_by_version):
+    logger.info("=== start === test_verify_chain_checksum")
+    make_plans()
+    cli = tc.migrate_dev()
+    with cli.dao.session.begin():
+        cli.dao.session.execute(
+            update(model.MigrationHistory)
+            .where(model.MigrationHistory.ver == "0001")
+            .values(chain_checksum="tampered")
+        )
+    cli.dao.commit()
+
+    # the checksums of the histories match the plans, the chain doesn't
+    cli = tc.make_cli({"environment": "dev", "verify_history": True})
+    with pytest.raises(Exception, match="version=0001.*chain_checksum=tampered"):
+        cli.migrate()
@@ -0,0 +1,88 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from migration import migration_plan as mp
+from migration.lib import CLI
+
+
+def make_plan(version: str, dependencies, type=mp.Type.DATA) -> mp.MigrationPlan:
+    return mp.MigrationPlan(
+        version=version,
+        name=version,
+        author="",
+        type=type,
+        change=mp.Change(
+            forward=mp.DataForward(type=mp.DataChangeType.SQL, sql="select 1"),
+            backward=None,
+        ),
+        dependencies=[mp.MigrationSignature(version=d, name=d) for d in dependencies],
+    )
+
+
+def run_dag(plans, durations, parallelism=3, fail=()):
+    running = set()
+    overlaps = []
+    mutex = threading.Lock()
+    applied = {mp.MigrationSignature(version="0000", name="0000")}
+    applied_plans = []
+    finished = []
+
+    def forward(plan, args, **kwargs):
+        with mutex:
+            for other in running:
+                overlaps.append((other, plan.version))
+            running.add(plan.version)
+        time.sleep(durations.get(plan.version, 0.01))
+        with mutex:
+            running.remove(plan.version)
+        if plan.version in fail:
+            raise Exception(f"{plan.version} failed")
+
+    def finish(dao, plan, next_plan, applied=None, operator="", fake=False):
+        applied.add(plan.sig())
+        finished.append(plan.version)
+
+    cli = CLI()
+    with mock.patch.object(cli, "migrator") as migrator, mock.patch.object(
+        cli, "_checkpoint"
+    ), mock.patch.object(cli, "_finish_versioned_plan", side_effect=finish):
+        migrator.forward.side_effect = forward
+        try:
+            cli._migrate_versioned_parallel(
+                mock.MagicMock(), plans, applied, applied_plans, parallelism, False
+            )
+        finally:
+            assert [p.version for p in applied_plans] == finished
+    return finished, overlaps
+
+
+def test_dag_migration():
+    plans = [
+        make_plan("0001", ["0000"], type=mp.Type.SCHEMA),
+        make_plan("0002", ["0001"]),
+        make_plan("0003", ["0001"]),
+        make_plan("0004", ["0002", "0003"]),
+        make_plan("0005", ["0004"], type=mp.Type.SCHEMA),
+        make_plan("0006", ["0001"]),
+    ]
+    finished, overlaps = run_dag(plans, {"0002": 0.3, "0006": 0.1})
+    # completion order, 0004 waits for both of its dependencies
+    assert finished == ["0001", "0003", "0006", "0002", "0004", "0005"]
+    assert ("0002", "0003") in overlaps
+    # the schema plans run alone
+    for pair in overlaps:
+        assert "0001" not in pair and "0005" not in pair
+
+
+def test_dag_migration_failure():
+    plans = [
+        make_plan("0001", ["0000"]),
+        make_plan("0002", ["0000"]),
+        make_plan("0003", ["0001"]),
+        make_plan("0004", ["0002"]),
+    ]
+    with pytest.raises(Exception, match="0001 failed"):
+        run_dag(plans, {"0002": 0.2}, parallelism=2, fail=("0001",))
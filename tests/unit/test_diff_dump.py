@@ -0,0 +1,59 @@
+import json
+import os
+import time
+from argparse import Namespace
+from unittest import mock
+
+import pytest
+
+from migration.env import cli_env
+from migration.lib import CLI
+
+
+def fake_dump(diff_arg, diff_type, dump_dir_path, mkdir=True):
+    # skeema pull of an environment
+    time.sleep(0.3)
+    if diff_arg == "broken":
+        raise Exception("skeema pull failed")
+    os.makedirs(dump_dir_path)
+    with open(os.path.join(dump_dir_path, "t.sql"), "w") as f:
+        f.write("CREATE TABLE `t` (\n  `id` int\n);\n")
+
+
+def diff(left: str, right: str, **kwargs):
+    cli = CLI(args=Namespace(left=left, right=right, **kwargs))
+    with (
+        mock.patch.object(cli, "read_migration_plans"),
+        mock.patch.object(cli, "dump_schema", side_effect=fake_dump),
+    ):
+        cli.diff()
+
+
+def test_diff_dumps_concurrently(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(cli_env, "MIGRATION_CWD", str(tmp_path))
+    (tmp_path / cli_env.SCHEMA_DIR).mkdir()
+    (tmp_path / cli_env.SCHEMA_DIR / "t.sql").write_text(
+        "CREATE TABLE `t` (\n  `id` int,\n  `name` varchar(255)\n);\n"
+    )
+
+    began = time.monotonic()
+    diff("dev", "prod")
+    # both sides are dumped at the same time
+    assert time.monotonic() - began < 0.55
+    assert "No difference between dev and prod" in capsys.readouterr().out
+
+    with pytest.raises(Exception, match="Difference found"):
+        diff("HEAD", "prod", verbose=False, format="json")
+    result = json.loads(capsys.readouterr().out)
+    assert result["files"] == [
+        {
+            "name": "t.sql",
+            "state": "changed",
+            "tables": ["t"],
+            "added_lines": 1,
+            "removed_lines": 2,
+        }
+    ]
+
+    with pytest.raises(Exception, match="skeema pull failed"):
+        diff("dev", "broken")
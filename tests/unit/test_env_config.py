@@ -0,0 +1,75 @@
+import os
+from unittest import mock
+
+import pytest
+
+from migration import helper
+from migration.env import cli_env
+
+ENV_INI = """generator=skeema:1.10.1
+schema=test
+[dev]
+host=127.0.0.1
+port=3306
+user=root
+ignore-table=_migration_history
+"""
+
+
+@pytest.fixture
+def env_ini(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli_env, "MIGRATION_CWD", str(tmp_path))
+    path = tmp_path / cli_env.ENV_INI_FILE
+    path.parent.mkdir()
+    path.write_text(ENV_INI)
+    return path
+
+
+def test_env_config(env_ini):
+    with mock.patch.object(
+        helper, "parse_env_ini", wraps=helper.parse_env_ini
+    ) as parse_env_ini:
+        config = helper.get_env_config("dev")
+        assert (config.host, config.port, config.user, config.schema) == (
+            "127.0.0.1",
+            3306,
+            "root",
+            "test",
+        )
+        # the file is parsed once, and not touched by the lookups
+        with mock.patch.object(helper.os, "stat", side_effect=AssertionError):
+            assert helper.get_env_config("dev") is config
+        assert parse_env_ini.call_count == 1
+
+        env = config.subprocess_env({"SDM_EXPECTED": "1"})
+        assert env["HOST"] == "127.0.0.1"
+        assert env["SCHEMA"] == "test"
+        assert env["SDM_EXPECTED"] == "1"
+        assert "SDM_EXPECTED" not in config.env_template
+        with pytest.raises(TypeError):
+            config.env_template["HOST"] = "localhost"
+
+        with pytest.raises(Exception, match="not found"):
+            helper.get_env_config("prod")
+
+        # the file is parsed again after it changes
+        env_ini.write_text(ENV_INI + "[prod]\nhost=10.0.0.1\nport=3307\nuser=sdm\n")
+        stat = os.stat(env_ini)
+        os.utime(env_ini, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+        # checked by the next command
+        with pytest.raises(Exception, match="not found"):
+            helper.get_env_config("prod")
+        helper.refresh_env_configs()
+        assert helper.get_env_config("prod").port == 3307
+        assert helper.get_env_config("dev") == config
+        assert parse_env_ini.call_count == 2
+
+
+def test_refresh_unchanged_env_config(env_ini):
+    config = helper.get_env_config("dev")
+    helper.refresh_env_configs()
+    assert helper.get_env_config("dev") is config
+    env_ini.unlink()
+    helper.refresh_env_configs()
+    with pytest.raises(FileNotFoundError):
+        helper.get_env_config("dev")
@@ -0,0 +1,29 @@
+import pytest
+
+from migration import migration_plan as mp
+from migration.migrator import open_load_file
+
+
+def test_open_load_file(tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text('id,name\r\n1,"a,""b"""\r\n\r\n2,\\N\r\n3,"multi\nline"\r\n')
+    with open_load_file(str(path), mp.LoadConfig(table="users")) as (columns, rows):
+        assert columns == ["id", "name"]
+        assert list(rows) == [["1", 'a,"b"'], ["2", None], ["3", "multi\nline"]]
+
+
+def test_open_load_file_tsv_without_header(tmp_path):
+    path = tmp_path / "users.tsv"
+    path.write_text("1\ta,b\n2\tc\n")
+    load = mp.LoadConfig(table="users", columns=["id", "name"], header=False)
+    with open_load_file(str(path), load) as (columns, rows):
+        assert columns == ["id", "name"]
+        assert list(rows) == [["1", "a,b"], ["2", "c"]]
+
+
+def test_open_load_file_invalid_row(tmp_path):
+    path = tmp_path / "users.csv"
+    path.write_text("id,name\n1,a,b\n")
+    with open_load_file(str(path), mp.LoadConfig(table="users")) as (_, rows):
+        with pytest.raises(Exception, match="line 2"):
+            list(rows)
@@ -0,0 +1,86 @@
+import os
+import shutil
+from types import MappingProxyType
+
+import pytest
+
+from migration import helper
+from migration.env import cli_env
+from migration.node_worker import NodeWorker
+
+pytestmark = pytest.mark.skipif(
+    shutil.which(cli_env.NODE_CMD_PATH) is None, reason="node is not installed"
+)
+
+FAKE_TYPEORM = """let initialized = 0
+class DataSource {
+  constructor(options) { this.options = options }
+  async initialize() { initialized += 1 }
+  setOptions(options) { this.options = { ...this.options, ...options } }
+  async buildMetadatas() {}
+  async destroy() {}
+}
+module.exports = { DataSource, initialized: () => initialized }
+"""
+
+MODULES = {
+    # the output doesn't break the protocol
+    "ok.js": """exports.Entities = []
+exports.Run = async (ds, args) => {
+  console.log("migrated")
+  return require("typeorm").initialized() * 10 + parseInt(args.SDM_CHECKSUM_MATCH)
+}
+""",
+    "fail.js": """exports.Entities = []
+exports.Run = async (ds, args) => { throw new Error("boom") }
+""",
+    "exit.js": """exports.Entities = []
+exports.Run = async (ds, args) => { process.exit(3) }
+""",
+}
+
+CONFIG = helper.EnvConfig(
+    name="dev",
+    host="127.0.0.1",
+    port=3306,
+    user="root",
+    schema="test",
+    env_template=MappingProxyType(dict(os.environ)),
+)
+
+
+@pytest.fixture
+def worker(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli_env, "MIGRATION_CWD", str(tmp_path))
+    typeorm = tmp_path / "node_modules" / "typeorm"
+    typeorm.mkdir(parents=True)
+    (typeorm / "index.js").write_text(FAKE_TYPEORM)
+    for name, content in MODULES.items():
+        (tmp_path / name).write_text(content)
+    worker = NodeWorker(str(tmp_path))
+    yield worker
+    worker.close()
+
+
+def test_node_worker(worker, tmp_path):
+    def run(name: str) -> int:
+        return worker.run(str(tmp_path / name), CONFIG, {"SDM_CHECKSUM_MATCH": "1"})
+
+    # the data source is initialized once
+    assert run("ok.js") == 11
+    assert run("ok.js") == 11
+    pid = worker._proc.pid
+
+    with pytest.raises(Exception, match="boom"):
+        run("fail.js")
+    assert run("ok.js") == 11
+    assert worker._proc.pid == pid
+
+    # the worker is restarted after it exits
+    with pytest.raises(Exception, match="exited with code 3"):
+        run("exit.js")
+    assert run("ok.js") == 11
+    assert worker._proc.pid != pid
+
+    worker.close()
+    assert worker._proc is None
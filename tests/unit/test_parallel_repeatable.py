@@ -0,0 +1,77 @@
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from migration import migration_plan as mp
+from migration.lib import CLI
+
+
+def make_plan(name: str, tags=None) -> mp.MigrationPlan:
+    return mp.MigrationPlan(
+        version=mp.RepeatableVersion,
+        name=name,
+        author="",
+        type=mp.Type.REPEATABLE,
+        change=mp.Change(
+            forward=mp.DataForward(type=mp.DataChangeType.SQL, sql="select 1"),
+            backward=None,
+        ),
+        dependencies=[],
+        tags=tags,
+    )
+
+
+def run_parallel(plans, parallelism=3, fail=(), started=None):
+    running = set()
+    overlaps = []
+    started = started if started is not None else []
+    mutex = threading.Lock()
+
+    def execute(dao, plan, histories, fake, operator=""):
+        with mutex:
+            started.append(plan.name)
+            for other in running:
+                overlaps.append((other, plan.name))
+            running.add(plan.name)
+        time.sleep(0.05)
+        with mutex:
+            running.remove(plan.name)
+        if plan.name in fail:
+            raise Exception(f"{plan.name} failed")
+
+    cli = CLI()
+    with mock.patch.object(cli, "_make_dao"), mock.patch.object(
+        cli, "_execute_repeatable_plan", side_effect=execute
+    ):
+        cli._migrate_repeatable_parallel(plans, {}, parallelism, False)
+    return started, overlaps
+
+
+def test_parallel_repeatable_tags():
+    plans = [
+        make_plan("a", ["users"]),
+        make_plan("b"),
+        make_plan("c", ["users", "orders"]),
+        make_plan("d", ["orders"]),
+        make_plan("e"),
+    ]
+    started, overlaps = run_parallel(plans)
+    assert sorted(started) == ["a", "b", "c", "d", "e"]
+    # plans sharing a tag run one after another, in order
+    assert started.index("a") < started.index("c") < started.index("d")
+    for x, y in [("a", "c"), ("c", "d")]:
+        assert (x, y) not in overlaps and (y, x) not in overlaps
+    # the others run concurrently
+    assert ("a", "b") in overlaps
+
+
+def test_parallel_repeatable_failure():
+    plans = [make_plan("a"), make_plan("b"), make_plan("c"), make_plan("d")]
+    started = []
+    # the error of the first failed plan in order is raised
+    with pytest.raises(Exception, match="a failed"):
+        run_parallel(plans, parallelism=2, fail=("b", "a"), started=started)
+    # no more plans are started after the failures
+    assert sorted(started) == ["a", "b"]
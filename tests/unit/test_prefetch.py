@@ -0,0 +1,81 @@
+import os
+import threading
+import time
+from argparse import Namespace
+from unittest import mock
+
+from migration import helper
+from migration import migration_plan as mp
+from migration import migrator as mg
+from migration.env import cli_env
+from migration.prefetch import Prefetcher
+
+
+def test_prefetcher():
+    plans = [f"plan{i}" for i in range(5)]
+    started = []
+    mutex = threading.Lock()
+
+    def prepare(plan):
+        with mutex:
+            started.append(plan)
+        if plan == "plan3":
+            raise Exception("broken")
+        time.sleep(0.05)
+
+    executed = []
+    with Prefetcher(prepare, plans, lookahead=2) as prefetcher:
+        for i, plan in enumerate(plans):
+            prefetcher.ready(i)
+            # the lookahead is bounded
+            assert len(started) <= i + 3
+            executed.append(plan)
+            time.sleep(0.1)
+    assert executed == plans
+    assert sorted(started) == plans
+    # the first plan is prepared on the critical path, the others are hidden
+    assert prefetcher.wait_time >= 0.05
+    assert prefetcher.hidden_time() >= 0.1
+
+
+def test_prepare_schema_workspace(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli_env, "MIGRATION_CWD", str(tmp_path))
+    (tmp_path / cli_env.SCHEMA_DIR).mkdir()
+    (tmp_path / cli_env.SCHEMA_DIR / ".skeema").write_text("[dev]\n")
+    store = tmp_path / cli_env.SCHEMA_STORE_DIR
+    (store / "aa").mkdir(parents=True)
+    (store / "aa" / "01").write_text("CREATE TABLE t (id int);")
+    (store / "bb").mkdir()
+    (store / "bb" / "02").write_text("aa01:t.sql\n")
+
+    plan = mp.MigrationPlan(
+        version="0001",
+        name="t",
+        author="",
+        type=mp.Type.SCHEMA,
+        change=mp.Change(forward=mp.SchemaForward(id="bb02"), backward=None),
+        dependencies=[],
+    )
+    migrator = mg.Migrator()
+    with mock.patch.object(plan, "get_checksum") as get_checksum:
+        migrator.prepare(plan)
+        get_checksum.assert_called_once()
+    workspace = migrator._schema_workspaces["bb02"].name
+    assert os.path.exists(os.path.join(workspace, cli_env.SCHEMA_DIR, "t.sql"))
+
+    def push(raw_args, cwd):
+        # the prepared workspace is pushed
+        assert cwd == workspace
+        assert os.path.exists(os.path.join(cwd, cli_env.SCHEMA_DIR, "t.sql"))
+
+    with mock.patch.object(helper, "call_skeema", side_effect=push) as call_skeema:
+        migrator.move_schema_to("bb02", Namespace(environment="dev"))
+        call_skeema.assert_called_once()
+    assert not os.path.exists(workspace)
+    assert migrator._schema_workspaces == {}
+
+    # the workspaces of the plans not executed are removed
+    migrator.prepare(plan)
+    workspace = migrator._schema_workspaces["bb02"].name
+    migrator.discard_prepared()
+    assert not os.path.exists(workspace)
@@ -0,0 +1,42 @@
+from argparse import Namespace
+from unittest import mock
+
+from migration import migrator as mg
+from migration.env import cli_env
+
+MIGRATION = """runs = 0
+
+def run(session, args):
+    global runs
+    runs += 1
+    return %d
+"""
+
+
+def test_migrate_data_python_module_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli_env, "MIGRATION_CWD", str(tmp_path))
+    (tmp_path / cli_env.DATA_DIR).mkdir()
+    path = tmp_path / cli_env.DATA_DIR / "run.py"
+    path.write_text(MIGRATION % 0)
+
+    session = mock.MagicMock()
+    session.__enter__.return_value = session
+    args = Namespace(environment="dev")
+    migrator = mg.Migrator()
+    with mock.patch.object(
+        mg.helper, "build_session_from_env", return_value=session
+    ) as build_session:
+        assert migrator.migrate_data_python("run.py", args) == 0
+        # the precheck reuses the module
+        assert migrator.check_condition_python("run.py", 0, args, checksum_match=True)
+        module = mg.load_python_module(str(path))
+        assert module.runs == 2
+        assert build_session.call_count == 2
+        # the session is closed after each run
+        assert session.__exit__.call_count == 2
+
+        # the file is imported again after it changes
+        path.write_text(MIGRATION % 1)
+        assert migrator.migrate_data_python("run.py", args) == 1
+        assert mg.load_python_module(str(path)) is not module
+        assert mg.load_python_module(str(path)).runs == 1
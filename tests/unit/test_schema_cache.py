@@ -0,0 +1,89 @@
+import os
+from unittest import mock
+
+from sqlalchemy.exc import OperationalError
+
+from migration import schema_cache
+
+
+def write_files(dir_path, files):
+    os.makedirs(dir_path, exist_ok=True)
+    for name, content in files.items():
+        with open(os.path.join(dir_path, name), "w") as f:
+            f.write(content)
+
+
+def read_files(dir_path):
+    res = {}
+    for name in os.listdir(dir_path):
+        with open(os.path.join(dir_path, name)) as f:
+            res[name] = f.read()
+    return res
+
+
+def test_fingerprint_sql():
+    sql = schema_cache.fingerprint_sql()
+    assert sql.count("SELECT CONCAT(COUNT(*)") == len(schema_cache.FINGERPRINT_SOURCES)
+    for table, schema_column, _ in schema_cache.FINGERPRINT_SOURCES:
+        assert f"information_schema.`{table}` WHERE `{schema_column}` = :schema" in sql
+    # data changes don't change the fingerprint
+    assert "TABLE_ROWS" not in sql and "UPDATE_TIME" not in sql
+
+
+def test_available_sources():
+    # information_schema of mysql 5.7, without CHECK_CONSTRAINTS and ENFORCED
+    rows = [
+        (table, column)
+        for table, schema_column, columns in schema_cache.FINGERPRINT_SOURCES
+        if table != "CHECK_CONSTRAINTS"
+        for column in [schema_column] + columns
+        if column != "ENFORCED"
+    ]
+    conn = mock.MagicMock()
+    conn.engine.url.render_as_string.return_value = "mysql://5.7/test"
+    conn.execute.return_value.all.return_value = rows
+
+    sources = schema_cache.available_sources(conn)
+    assert "CHECK_CONSTRAINTS" not in [table for table, _, _ in sources]
+    assert dict((table, columns) for table, _, columns in sources)[
+        "TABLE_CONSTRAINTS"
+    ] == ["CONSTRAINT_NAME", "TABLE_NAME", "CONSTRAINT_TYPE"]
+    assert len(sources) == len(schema_cache.FINGERPRINT_SOURCES) - 1
+    # looked up once per server
+    assert schema_cache.available_sources(conn) is sources
+    assert conn.execute.call_count == 1
+
+
+def test_snapshot_key_without_fingerprint(tmp_path):
+    engine = mock.MagicMock()
+    engine.connect.side_effect = OperationalError("select", {}, Exception("gone"))
+    skeema_file = tmp_path / ".skeema"
+    skeema_file.write_text("[dev]\n")
+    assert schema_cache.snapshot_key(engine, str(skeema_file)) is None
+
+
+def test_snapshot_cache(tmp_path):
+    cache = schema_cache.SchemaSnapshotCache(str(tmp_path / "cache"))
+    pulled = str(tmp_path / "pulled")
+    write_files(pulled, {".skeema": "[dev]\n", "t1.sql": "t1\n", "t2.sql": "t2\n"})
+
+    assert not cache.restore("dev", "k1", pulled)
+    cache.save("dev", "k1", pulled)
+    # saved again by another process
+    cache.save("dev", "k1", pulled)
+
+    target = str(tmp_path / "target")
+    write_files(target, {".skeema": "[dev]\n", "t1.sql": "old\n", "t3.sql": "t3\n"})
+    assert cache.restore("dev", "k1", target)
+    assert read_files(target) == {
+        ".skeema": "[dev]\n",
+        "t1.sql": "t1\n",
+        "t2.sql": "t2\n",
+    }
+
+    # only the last snapshot of an environment is kept
+    write_files(pulled, {"t1.sql": "t1 v2\n"})
+    cache.save("dev", "k2", pulled)
+    assert os.listdir(tmp_path / "cache" / "dev") == ["k2"]
+    assert not cache.restore("dev", "k1", target)
+    assert not cache.restore("prod", "k2", target)
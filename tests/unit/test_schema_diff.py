@@ -0,0 +1,70 @@
+from unittest import mock
+
+from migration import helper, schema_diff
+from migration.env import cli_env
+
+
+def test_compare(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli_env, "MIGRATION_CWD", str(tmp_path))
+    contents = {
+        "a.sql": "CREATE TABLE `a` (\n  `id` int\n);\n",
+        "b.sql": "CREATE TABLE `b` (\n  `id` int\n);\n",
+        "c.sql": "CREATE TABLE IF NOT EXISTS c (\n  id int\n);\n",
+    }
+    # the version in the schema store
+    index = []
+    for name, content in contents.items():
+        sha1 = helper.sha1_encode([content])
+        path = tmp_path / cli_env.SCHEMA_STORE_DIR / sha1[:2] / sha1[2:]
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+        index.append((sha1, name))
+    # the dump of an environment
+    dump = tmp_path / "dump"
+    dump.mkdir()
+    (dump / "a.sql").write_text(contents["a.sql"])
+    (dump / "b.sql").write_text("CREATE TABLE `b` (\n  `id` bigint\n);")
+    (dump / "d.sql").write_text("CREATE TABLE `d` (\n  `id` int\n);\n")
+    (dump / "README").write_text("")
+
+    left = schema_diff.files_of_index(index)
+    right = schema_diff.files_of_dir(str(dump))
+    assert sorted(right.keys()) == ["a.sql", "b.sql", "d.sql"]
+    with mock.patch.object(
+        schema_diff.SchemaFile,
+        "read_lines",
+        autospec=True,
+        side_effect=schema_diff.SchemaFile.read_lines,
+    ) as read_lines:
+        result = schema_diff.compare("0002", left, "dev", right, with_diff=True)
+        # the identical files are not read
+        assert sorted(f.path for (f,), _ in read_lines.call_args_list) == sorted(
+            [
+                left["b.sql"].path,
+                right["b.sql"].path,
+                left["c.sql"].path,
+                right["d.sql"].path,
+            ]
+        )
+    assert result.identical == 1
+    assert [(f.name, f.state, f.tables) for f in result.files] == [
+        ("b.sql", schema_diff.CHANGED, ["b"]),
+        ("c.sql", schema_diff.REMOVED, ["c"]),
+        ("d.sql", schema_diff.ADDED, ["d"]),
+    ]
+    b = result.files[0]
+    assert (b.added_lines, b.removed_lines) == (2, 2)
+    # the last line of the dump has no newline
+    assert "-  `id` int\n-);\n+  `id` bigint\n+);\n" in b.diff
+    text = result.to_text()
+    assert "3 files differ between 0002 and dev, 1 identical files" in text
+    assert "+++ right/d.sql" in text
+
+    result = schema_diff.compare("dev", right, "dev", right)
+    assert not result.has_diff()
+    assert result.to_dict() == {
+        "left": "dev",
+        "right": "dev",
+        "identical": 3,
+        "files": [],
+    }
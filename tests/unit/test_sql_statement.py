@@ -0,0 +1,113 @@
+from migration import sql_statement
+
+
+def test_split_statements():
+    sql = """-- leading comment
+insert into t (id, name) values (1, 'a;b');
+insert into t (id, name) values (2, "it''s; \\" ok");  # trailing comment;
+/* block; comment */ update t set name = `x;y` where id = 1;
+select 1--1;
+-- last comment
+"""
+    got = sql_statement.split_statements(sql)
+    assert got == [
+        "-- leading comment\ninsert into t (id, name) values (1, 'a;b')",
+        'insert into t (id, name) values (2, "it\'\'s; \\" ok")',
+        (
+            "# trailing comment;\n/* block; comment */ update t set name = `x;y` where"
+            " id = 1"
+        ),
+        "select 1--1",
+    ]
+
+
+def test_split_statements_without_trailing_delimiter():
+    got = sql_statement.split_statements("select 1;\nselect 2")
+    assert got == ["select 1", "select 2"]
+
+
+def test_split_statements_multiline_quote():
+    got = sql_statement.split_statements("insert into t values ('a\n;\nb');select 1;")
+    assert got == ["insert into t values ('a\n;\nb')", "select 1"]
+
+
+def test_first_keyword():
+    assert sql_statement.first_keyword("  -- c\n/* c */ (select 1)") == "SELECT"
+    assert (
+        sql_statement.first_keyword("/*!40000 ALTER TABLE `t` DISABLE KEYS */")
+        == "ALTER"
+    )
+    assert sql_statement.first_keyword("-- only comment") == ""
+
+
+def test_has_implicit_commit():
+    assert not sql_statement.has_implicit_commit(
+        "insert into t values (1); update t set a = 1; delete from t where id = 2;"
+    )
+    assert not sql_statement.has_implicit_commit("insert into t values ('create')")
+    assert sql_statement.has_implicit_commit(
+        "insert into t values (1); create table t2 (id int);"
+    )
+    assert sql_statement.has_implicit_commit("truncate t")
+    assert sql_statement.has_implicit_commit("SET autocommit = 1")
+    assert sql_statement.has_implicit_commit("start transaction; insert into t;")
+    assert not sql_statement.has_implicit_commit("set @a = 1; insert into t;")
+    # dynamic sql may be DDL
+    assert sql_statement.has_implicit_commit(
+        "set @s = 'drop table t'; prepare stmt from @s; execute stmt;"
+    )
+    assert sql_statement.has_implicit_commit("lock tables t write; unlock tables;")
+
+
+def test_split_statements_delimiter():
+    sql = """DELIMITER $$
+CREATE PROCEDURE p()
+BEGIN
+  SELECT 1;
+  SELECT 2;
+END$$
+delimiter ;
+CALL p();
+"""
+    got = sql_statement.split_statements(sql)
+    assert got == [
+        "CREATE PROCEDURE p()\nBEGIN\n  SELECT 1;\n  SELECT 2;\nEND",
+        "CALL p()",
+    ]
+
+
+def test_split_statements_routine_body():
+    procedure = """CREATE DEFINER=`root`@`%` PROCEDURE p(IN n INT)
+BEGIN
+  DECLARE i INT DEFAULT 0;
+  lbl: WHILE i < n DO
+    IF i % 2 = 0 THEN
+      INSERT INTO t VALUES (CASE WHEN i > 1 THEN 'a;' ELSE 'b' END);
+    END IF;
+    CASE i WHEN 1 THEN SET i = i + 1; ELSE BEGIN END; END CASE;
+    SET i = i + 1;
+  END WHILE lbl;
+END"""
+    trigger = """CREATE TRIGGER tr BEFORE INSERT ON t FOR EACH ROW
+BEGIN
+  SET NEW.end_date = NOW();
+END"""
+    sql = (
+        f"{procedure};\n{trigger};\n"
+        "CREATE FUNCTION f() RETURNS INT RETURN 1;\n"
+        "BEGIN;\nselect 1;\n"
+    )
+    got = sql_statement.split_statements(sql)
+    assert got == [
+        procedure,
+        trigger,
+        "CREATE FUNCTION f() RETURNS INT RETURN 1",
+        "BEGIN",
+        "select 1",
+    ]
+
+
+def test_iter_numbered_statements():
+    lines = "select 1;\n\n-- c\nselect\n2; select 3;".splitlines(keepends=True)
+    got = list(sql_statement.iter_numbered_statements(lines))
+    assert got == [(1, "select 1"), (4, "-- c\nselect\n2"), (5, "select 3")]
@@ -0,0 +1,42 @@
+import pytest
+
+from migration import err
+from migration.throttle import Throttle, parse_replicas
+
+
+class FakeThrottle(Throttle):
+    def __init__(self, reasons, **kwargs) -> None:
+        super().__init__(None, [], **kwargs)
+        self.reasons = list(reasons)
+        self.checks = 0
+
+    def check(self):
+        self.checks += 1
+        return self.reasons.pop(0) if len(self.reasons) > 0 else None
+
+
+def test_parse_replicas():
+    assert parse_replicas("") == []
+    assert parse_replicas("db1:3307, db2,") == [("db1", 3307), ("db2", 3306)]
+
+
+def test_throttle_wait():
+    throttle = FakeThrottle(["busy", "busy"], check_interval=0.01)
+    waited = throttle.wait()
+    assert waited > 0
+    assert throttle.checks == 3
+    assert throttle.throttle_time == waited
+
+
+def test_throttle_wait_healthy_is_cached():
+    throttle = FakeThrottle([], check_interval=60)
+    assert throttle.wait() == 0
+    assert throttle.wait() == 0
+    assert throttle.checks == 1
+    assert throttle.throttle_time == 0
+
+
+def test_throttle_wait_timeout():
+    throttle = FakeThrottle(["busy"] * 100, check_interval=0.01, max_wait=0)
+    with pytest.raises(err.ThrottleError):
+        throttle.wait()
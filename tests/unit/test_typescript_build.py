@@ -0,0 +1,97 @@
+import os
+from unittest import mock
+
+import pytest
+
+from migration import migrator as mg
+from migration.env import cli_env
+
+
+@pytest.fixture
+def ts_cwd(tmp_path, monkeypatch):
+    monkeypatch.setattr(cli_env, "MIGRATION_CWD", str(tmp_path))
+    monkeypatch.setattr(cli_env, "TYPESCRIPT_BUILD_CACHE", 1)
+    (tmp_path / "package.json").write_text("{}")
+    (tmp_path / "tsconfig.json").write_text("{}")
+    (tmp_path / "migration.ts").write_text("export const Run = 1")
+    return tmp_path
+
+
+def fake_build(cmd, cwd=None, **kwargs):
+    # tsc emits the js next to the ts
+    for name in ["index", "migration"]:
+        with open(os.path.join(cwd, "src", f"{name}.js"), "w") as f:
+            f.write("")
+
+
+def build(ts_file_path: str) -> str:
+    with mg.Migrator().typescript_build(ts_file_path) as build_dir:
+        assert os.path.exists(os.path.join(build_dir, "src", "index.js"))
+        return build_dir
+
+
+def test_typescript_build_cache(ts_cwd):
+    ts_file_path = str(ts_cwd / "migration.ts")
+    with mock.patch.object(
+        mg.subprocess, "check_call", side_effect=fake_build
+    ) as check_call:
+        build_dir = build(ts_file_path)
+        assert check_call.call_count == 1
+        # the ts files are not compiled again by the later builds
+        assert sorted(os.listdir(os.path.join(build_dir, "src"))) == [
+            "index.js",
+            "migration.js",
+        ]
+
+        # cache hit
+        assert build(ts_file_path) == build_dir
+        assert check_call.call_count == 1
+
+        # the build configuration is changed
+        (ts_cwd / "package-lock.json").write_text("{}")
+        assert build(ts_file_path) != build_dir
+        assert check_call.call_count == 2
+
+
+def test_typescript_build_imported_file_changed(ts_cwd):
+    data_dir = ts_cwd / cli_env.DATA_DIR
+    data_dir.mkdir()
+    (data_dir / "util.ts").write_text("export const Value = 1")
+    (data_dir / "migration.ts").write_text(
+        'import { Value } from "./util"\nexport const Run = Value'
+    )
+    ts_file_path = str(data_dir / "migration.ts")
+    with mock.patch.object(
+        mg.subprocess, "check_call", side_effect=fake_build
+    ) as check_call:
+        build_dir = build(ts_file_path)
+        assert build(ts_file_path) == build_dir
+        assert check_call.call_count == 1
+
+        # the migration is not changed, but the file it imports is
+        (data_dir / "util.ts").write_text("export const Value = 2")
+        assert build(ts_file_path) != build_dir
+        assert check_call.call_count == 2
+
+
+def test_typescript_build_without_cache(ts_cwd, monkeypatch):
+    monkeypatch.setattr(cli_env, "TYPESCRIPT_BUILD_CACHE", 0)
+    ts_file_path = str(ts_cwd / "migration.ts")
+    with mock.patch.object(
+        mg.subprocess, "check_call", side_effect=fake_build
+    ) as check_call:
+        build_dir = build(ts_file_path)
+        build(ts_file_path)
+        assert check_call.call_count == 2
+    assert not os.path.exists(build_dir)
+    assert not os.path.exists(ts_cwd / cli_env.CACHE_DIR)
+
+
+def test_typescript_build_key(ts_cwd):
+    ts_file_path = str(ts_cwd / "migration.ts")
+    key = mg.typescript_build_key(ts_file_path, "index")
+    assert mg.typescript_build_key(ts_file_path, "index") == key
+    # the index.ts variant
+    assert mg.typescript_build_key(ts_file_path, "index2") != key
+    (ts_cwd / "migration.ts").write_text("export const Run = 2")
+    assert mg.typescript_build_key(ts_file_path, "index") != key